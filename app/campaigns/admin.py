@@ -1,20 +1,21 @@
 from django.contrib import admin
-from .models import Campaign, Flow, Offer, FlowOffer
+from .models import ArchivedRecord, Campaign, Flow, Offer, OfferVisibility, FlowOffer
 
 
 @admin.register(Campaign)
 class CampaignAdmin(admin.ModelAdmin):
     """Админ-панель для модели Campaign"""
     
-    list_display = ('id', 'name', 'keitaro_id', 'state', 'type', 'synced_at')
+    list_display = ('id', 'name', 'keitaro_id', 'state', 'type', 'flows_count', 'synced_at')
     list_filter = ('state', 'type', 'synced_at')
     search_fields = ('name', 'alias', 'keitaro_id')
-    readonly_fields = ('keitaro_id', 'synced_at', 'created_at')
+    # Счётчики поддерживаются сервисами (manage.py recount)
+    readonly_fields = ('keitaro_id', 'flows_count', 'synced_at', 'created_at')
     list_per_page = 50
     
     fieldsets = (
         ('Основная информация', {
-            'fields': ('name', 'alias', 'state', 'type')
+            'fields': ('name', 'alias', 'state', 'type', 'flows_count')
         }),
         ('Keitaro', {
             'fields': ('keitaro_id', 'synced_at')
@@ -30,15 +31,17 @@ class CampaignAdmin(admin.ModelAdmin):
 class FlowAdmin(admin.ModelAdmin):
     """Админ-панель для модели Flow"""
     
-    list_display = ('id', 'name', 'campaign', 'keitaro_id', 'type', 'position', 'state', 'synced_at')
+    list_display = ('id', 'name', 'campaign', 'keitaro_id', 'type', 'position', 'state',
+                    'active_offers_count', 'total_offers_count', 'synced_at')
     list_filter = ('type', 'state', 'synced_at')
     search_fields = ('name', 'keitaro_id', 'campaign__name')
-    readonly_fields = ('keitaro_id', 'synced_at', 'created_at')
+    # Счётчики поддерживаются сервисами (manage.py recount)
+    readonly_fields = ('keitaro_id', 'active_offers_count', 'total_offers_count', 'synced_at', 'created_at')
     list_per_page = 50
     
     fieldsets = (
         ('Основная информация', {
-            'fields': ('campaign', 'name', 'type', 'position', 'state')
+            'fields': ('campaign', 'name', 'type', 'position', 'state', 'active_offers_count', 'total_offers_count')
         }),
         ('Keitaro', {
             'fields': ('keitaro_id', 'synced_at')
@@ -54,18 +57,18 @@ class FlowAdmin(admin.ModelAdmin):
 class OfferAdmin(admin.ModelAdmin):
     """Админ-панель для модели Offer"""
     
-    list_display = ('id', 'name', 'keitaro_id', 'user', 'state', 'cached_at')
-    list_filter = ('state', 'user', 'cached_at')
+    list_display = ('id', 'name', 'keitaro_id', 'instance', 'state', 'cached_at')
+    list_filter = ('state', 'instance', 'cached_at')
     search_fields = ('name', 'keitaro_id')
-    readonly_fields = ('keitaro_id', 'cached_at', 'created_at')
+    readonly_fields = ('instance', 'keitaro_id', 'cached_at', 'created_at')
     list_per_page = 50
     
     fieldsets = (
         ('Основная информация', {
-            'fields': ('user', 'name', 'state')
+            'fields': ('name', 'state')
         }),
         ('Keitaro', {
-            'fields': ('keitaro_id', 'cached_at')
+            'fields': ('instance', 'keitaro_id', 'cached_at')
         }),
         ('Даты', {
             'fields': ('created_at',),
@@ -74,6 +77,16 @@ class OfferAdmin(admin.ModelAdmin):
     )
 
 
+@admin.register(OfferVisibility)
+class OfferVisibilityAdmin(admin.ModelAdmin):
+    """Админ-панель для модели OfferVisibility"""
+    
+    list_display = ('id', 'user', 'offer', 'synced_at')
+    search_fields = ('offer__name', 'offer__keitaro_id')
+    raw_id_fields = ('user', 'offer')
+    list_per_page = 50
+
+
 @admin.register(FlowOffer)
 class FlowOfferAdmin(admin.ModelAdmin):
     """Админ-панель для модели FlowOffer"""
@@ -96,3 +109,20 @@ class FlowOfferAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+
+
+@admin.register(ArchivedRecord)
+class ArchivedRecordAdmin(admin.ModelAdmin):
+    """Админ-панель для архива (только просмотр; восстановление - manage.py archive --restore)"""
+    
+    list_display = ('id', 'kind', 'object_id', 'campaign_keitaro_id', 'removed_at', 'archived_at')
+    list_filter = ('kind',)
+    search_fields = ('campaign_keitaro_id',)
+    exclude = ('payload',)
+    list_per_page = 50
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -41,3 +41,27 @@ class CreateCampaignForm(forms.Form):
         })
     )
 
+
+
+class CloneCampaignForm(forms.Form):
+    """Форма для клонирования рекламной кампании"""
+    
+    name = forms.CharField(
+        label='Название копии',
+        max_length=255,
+        required=True,
+        widget=forms.TextInput(attrs={
+            'class': 'w-full px-3 py-2 border border-gray-300 rounded-lg focus:ring-2 focus:ring-blue-500',
+            'placeholder': 'Введите название кампании'
+        })
+    )
+    
+    geo_codes = forms.CharField(
+        label='Гео-коды стран',
+        required=False,
+        help_text='Коды стран через запятую для гео-фильтров потоков (пусто - как у исходной кампании)',
+        widget=forms.TextInput(attrs={
+            'class': 'w-full px-3 py-2 border border-gray-300 rounded-lg focus:ring-2 focus:ring-blue-500',
+            'placeholder': 'US,GB,DE,FR'
+        })
+    )
@@ -0,0 +1,81 @@
+"""
+Архивация удалённых кампаний и отключённых офферов потоков, восстановление и отчёт о размере
+"""
+from django.core.management.base import BaseCommand, CommandError
+from config.exceptions import ArchiveRestoreException
+from campaigns.models import ArchivedRecord
+from campaigns.services import archive
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит кампании, удалённые дольше срока хранения (ARCHIVE_RETENTION_DAYS), и отключённые '
+        'офферы потоков из рабочих таблиц в сжатый архив. --restore и --restore-campaign возвращают '
+        'записи из архива, --report показывает размер таблиц и архива'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Срок хранения в днях (по умолчанию ARCHIVE_RETENTION_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=archive.ARCHIVE_BATCH_SIZE,
+                            help='Строк в одной транзакции')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, сколько строк будет архивировано')
+        parser.add_argument('--report', action='store_true', help='Отчёт о размере рабочих таблиц и архива')
+        parser.add_argument('--restore', type=int, action='append', metavar='RECORD_ID',
+                            help='Восстановить архивную запись по ID (можно несколько)')
+        parser.add_argument('--restore-campaign', type=int, metavar='KEITARO_ID',
+                            help='Восстановить кампанию и её архивированные офферы потоков')
+
+    def handle(self, *args, **options):
+        if options['days'] is not None and options['days'] < 0:
+            raise CommandError('Срок хранения не может быть отрицательным')
+
+        if options['restore'] or options['restore_campaign']:
+            self._restore(options)
+        elif options['report']:
+            self._report(options['days'])
+        elif options['dry_run']:
+            cutoff = archive.retention_cutoff(options['days'])
+            self.stdout.write(
+                f'Будет архивировано кампаний: {archive.expired_campaigns(cutoff).count()}, '
+                f'офферов потоков: {archive.expired_flow_offers(cutoff).count()}'
+            )
+        else:
+            archived = archive.archive(options['days'], options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Архивировано кампаний: {archived["campaigns"]}, офферов потоков: {archived["flow_offers"]}'
+            ))
+
+    def _restore(self, options):
+        try:
+            restored = 0
+            for record_id in options['restore'] or []:
+                try:
+                    record = ArchivedRecord.objects.get(pk=record_id)
+                except ArchivedRecord.DoesNotExist:
+                    raise CommandError(f'Архивная запись {record_id} не найдена')
+                archive.restore(record)
+                restored += 1
+            if options['restore_campaign']:
+                restored += archive.restore_campaign(options['restore_campaign'])
+        except ArchiveRestoreException as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'Восстановлено записей: {restored}'))
+
+    def _report(self, days):
+        data = archive.report(days)
+        self.stdout.write(f'Срок хранения: {data["retention_days"]} дн.')
+        self.stdout.write(f'{"Таблица":<14}{"строк":>10}{"помечено":>10}{"старше срока":>14}')
+        for table in ('campaigns', 'flow_offers'):
+            row = data[table]
+            self.stdout.write(f'{table:<14}{row["total"]:>10}{row["removed"]:>10}{row["expired"]:>14}')
+
+        self.stdout.write('')
+        self.stdout.write(f'{"Архив":<14}{"записей":>10}{"JSON, КБ":>10}')
+        for kind, row in data['archive'].items():
+            self.stdout.write(f'{kind:<14}{row["records"]:>10}{row["payload_bytes"] / 1024:>10.1f}')
+
+        if data['table_bytes']:
+            self.stdout.write('')
+            self.stdout.write(f'{"Таблица":<14}{"с индексами, КБ":>18}')
+            for table, size in data['table_bytes'].items():
+                self.stdout.write(f'{table:<14}{size / 1024:>18.1f}')
@@ -0,0 +1,228 @@
+"""
+Бенчмарки синхронизации, страниц кампаний и редактирования офферов
+"""
+import json
+import platform
+import subprocess
+from datetime import datetime
+from typing import List
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from config.db_router import REPLICA_DB_ALIAS
+from users.models import User
+from campaigns.models import Campaign, Flow, Offer, FlowOffer
+from campaigns.services import KeitaroSyncService
+from campaigns.services.counters import refresh_flow_counters
+from campaigns.services.snapshots import refresh_flow_snapshots
+from campaigns.testing import FakeKeitaroServer
+from campaigns.testing.bench import Benchmark, Dataset, build_account, compare, measure, seed_database
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет время и количество SQL запросов синхронизации, страниц кампаний и редактирования '
+        'share на синтетическом наборе данных. Данные создаются в отдельной тестовой БД, '
+        'Keitaro заменяется локальной имитацией'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--campaigns', type=int, default=5000, help='Количество кампаний')
+        parser.add_argument('--flows-per-campaign', type=int, default=10, help='Потоков в кампании')
+        parser.add_argument('--offers-per-flow', type=int, default=10, help='Офферов в потоке')
+        parser.add_argument('--offers', type=int, default=5000, help='Размер каталога офферов')
+        parser.add_argument('--seed', type=int, default=1, help='Seed генератора данных')
+        parser.add_argument('--repeat', type=int, default=5, help='Измеряемых прогонов каждого замера')
+        parser.add_argument('--warmup', type=int, default=1, help='Прогонов для прогрева')
+        parser.add_argument('--latency-ms', type=float, default=0, help='Задержка ответов имитации Keitaro, мс')
+        parser.add_argument('--only', action='append', help='Запустить только указанные замеры (можно несколько)')
+        parser.add_argument('--output', default='bench_results.json', help='Файл для результатов в JSON')
+        parser.add_argument('--compare', help='JSON предыдущего прогона для сравнения')
+
+    def handle(self, *args, **options):
+        dataset = Dataset(
+            campaigns=options['campaigns'],
+            flows_per_campaign=options['flows_per_campaign'],
+            offers_per_flow=options['offers_per_flow'],
+            offers=options['offers'],
+            seed=options['seed'],
+        )
+        if dataset.campaigns < 1 or dataset.flows_per_campaign < 1 or dataset.offers < 2:
+            raise CommandError('Нужна хотя бы одна кампания, один поток и два оффера')
+
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        account = build_account(dataset)
+        server = FakeKeitaroServer(account, latency=options['latency_ms'] / 1000).start()
+
+        # Отдельная тестовая БД: рабочие данные не затрагиваются
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        # Реплика (если настроена) читает ту же тестовую БД
+        replica = connections[REPLICA_DB_ALIAS] if REPLICA_DB_ALIAS in connections else None
+        old_replica_name = replica.settings_dict['NAME'] if replica else None
+        if replica:
+            replica.close()
+            replica.creation.set_as_test_mirror(connection.settings_dict)
+        try:
+            with override_settings(
+                KEITARO_URL=server.url,
+                KEITARO_RATE_LIMITS={},
+                KEITARO_RETRY_BACKOFF=0,
+                # Замеряем реальный путь запросов, без кэша ответов
+                KEITARO_RESPONSE_CACHE=None,
+            ):
+                results = self._run(dataset, account, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            if replica:
+                replica.close()
+                replica.settings_dict['NAME'] = old_replica_name
+            teardown_test_environment()
+            server.stop()
+
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+        self._print_results(results)
+        if baseline:
+            self._print_comparison(compare(results, baseline))
+        self.stdout.write(self.style.SUCCESS(f'Результаты сохранены в {options["output"]}'))
+
+    def _run(self, dataset: Dataset, account, options) -> dict:
+        self.stdout.write(
+            f'Наполнение БД: {dataset.campaigns} кампаний, {dataset.flows} потоков, '
+            f'{dataset.flow_offers} офферов в потоках, {dataset.offers} офферов в каталоге'
+        )
+        user = User.objects.create(api_key='bench-key')
+        seed_seconds = seed_database(user, dataset, account, progress=lambda message: self.stdout.write(
+            f'  {message}', ending='\r'))
+        self.stdout.write(f'\nНаполнено за {seed_seconds:.1f} с')
+
+        benchmarks = self._benchmarks(user)
+        if options['only']:
+            unknown = set(options['only']) - {b.name for b in benchmarks}
+            if unknown:
+                raise CommandError(f'Неизвестные замеры: {", ".join(sorted(unknown))}')
+            benchmarks = [b for b in benchmarks if b.name in options['only']]
+
+        results = {}
+        for benchmark in benchmarks:
+            self.stdout.write(f'{benchmark.name}...', ending=' ')
+            self.stdout.flush()
+            results[benchmark.name] = measure(benchmark, options['repeat'], options['warmup'])
+            self.stdout.write(f'{results[benchmark.name]["wall_ms"]["median"]} мс')
+
+        return {
+            'meta': {
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+                'revision': self._revision(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'repeat': options['repeat'],
+                'warmup': options['warmup'],
+                'keitaro_latency_ms': options['latency_ms'],
+                'dataset': dataset.as_dict(),
+                'seed_seconds': round(seed_seconds, 3),
+            },
+            'results': results,
+        }
+
+    def _benchmarks(self, user) -> List[Benchmark]:
+        """Список замеров"""
+        client = Client()
+        session = client.session
+        session['user_id'] = user.id
+        session.save()
+        client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+
+        service = KeitaroSyncService(user)
+        campaign = Campaign.objects.get(keitaro_id=1)
+        flow = campaign.flows.order_by('position').first()
+        flow_offer = flow.flow_offers.filter(state='active').first()
+        free_offers = Offer.objects.exclude(flow_offers__flow=flow).filter(state='active').order_by('pk')
+        added = {}
+
+        def get(url, **extra):
+            def run():
+                response = client.get(url, **extra)
+                assert response.status_code == 200, f'{url}: {response.status_code}'
+            return run
+
+        def post(url_name, **kwargs):
+            def run():
+                response = client.post(reverse(url_name, kwargs=kwargs), data=added.get('data', {}), **ajax)
+                assert response.status_code == 200, f'{url_name}: {response.status_code}'
+            return run
+
+        def pick_offer():
+            added['data'] = {'offer_id': free_offers.first().keitaro_id}
+
+        def drop_added_offer():
+            FlowOffer.objects.filter(flow=flow, offer__keitaro_id=added.pop('data')['offer_id']).delete()
+            refresh_flow_counters(Flow.objects.filter(pk=flow.pk))
+            refresh_flow_snapshots(Flow.objects.filter(pk=flow.pk))
+
+        def set_state(state):
+            def run():
+                FlowOffer.objects.filter(pk=flow_offer.pk).update(state=state)
+                refresh_flow_counters(Flow.objects.filter(pk=flow.pk))
+                refresh_flow_snapshots(Flow.objects.filter(pk=flow.pk))
+            return run
+
+        # Синхронизация идёт последней: она меняет данные, на которых замеряются страницы
+        return [
+            Benchmark('campaign_list', get(reverse('campaigns:campaign_list'))),
+            Benchmark('campaign_detail', get(reverse('campaigns:campaign_detail', kwargs={'pk': campaign.pk}))),
+            Benchmark('offer_autocomplete', get(reverse('campaigns:offer_autocomplete'), data={'q': 'Offer 1'}, **ajax)),
+            Benchmark('add_offer', post('campaigns:add_offer', flow_id=flow.pk),
+                      setup=pick_offer, teardown=drop_added_offer),
+            Benchmark('remove_offer', post('campaigns:remove_offer', pk=flow_offer.pk),
+                      teardown=set_state('active')),
+            Benchmark('restore_offer', post('campaigns:restore_offer', pk=flow_offer.pk),
+                      setup=set_state('disabled')),
+            Benchmark('toggle_pin', post('campaigns:toggle_pin', pk=flow_offer.pk)),
+            Benchmark('sync_streams', lambda: service.sync_streams(campaign)),
+            Benchmark('sync_offers', service.sync_offers),
+            Benchmark('sync_campaigns', service.sync_campaigns),
+        ]
+
+    @staticmethod
+    def _revision() -> str:
+        """Текущий git commit (если доступен)"""
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                capture_output=True, text=True, cwd=settings.BASE_DIR, timeout=5,
+            ).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ''
+
+    def _print_results(self, results: dict):
+        self.stdout.write('')
+        self.stdout.write(f'{"Замер":<22}{"медиана, мс":>14}{"p95, мс":>12}{"запросов":>10}')
+        for name, result in results['results'].items():
+            self.stdout.write(
+                f'{name:<22}{result["wall_ms"]["median"]:>14}{result["wall_ms"]["p95"]:>12}{result["queries"]:>10}'
+            )
+
+    def _print_comparison(self, rows: List[dict]):
+        self.stdout.write('')
+        self.stdout.write(f'{"Замер":<22}{"было, мс":>12}{"стало, мс":>12}{"изменение":>11}{"запросов":>14}')
+        for row in rows:
+            change = '' if row['median_change_pct'] is None else f'{row["median_change_pct"]:+.1f}%'
+            style = self.style.ERROR if (row['median_change_pct'] or 0) > 10 else self.style.SUCCESS
+            self.stdout.write(style(
+                f'{row["name"]:<22}{row["median_before"]:>12}{row["median_after"]:>12}{change:>11}'
+                f'{row["queries_before"]:>7} → {row["queries_after"]:<4}'
+            ))
@@ -0,0 +1,58 @@
+"""
+Массовое создание кампаний в Keitaro из CSV (name, geo_codes, offer_id)
+"""
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from config.exceptions import KeitaroAPIException
+from users.models import User
+from campaigns.services.bulk_create import BulkCampaignCreator, summarize
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт кампании из CSV с колонками name, geo_codes, offer_id. Файл сначала проверяется '
+        'целиком; кампании создаются в Keitaro параллельно (BULK_CREATE_CONCURRENCY) с повторами '
+        'при ошибках подключения и сохраняются в БД одной вставкой'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к CSV файлу (UTF-8)')
+        parser.add_argument('--user', type=int, required=True, help='ID пользователя (его API ключ и офферы)')
+        parser.add_argument('--concurrency', type=int, help='Кампаний одновременно (по умолчанию BULK_CREATE_CONCURRENCY)')
+        parser.add_argument('--retries', type=int, help='Повторов вызова Keitaro (по умолчанию BULK_CREATE_RETRIES)')
+        parser.add_argument('--skip-invalid', action='store_true', help='Создать корректные строки, пропустив ошибочные')
+
+    def handle(self, *args, **options):
+        if not settings.KEITARO_URL:
+            raise CommandError('KEITARO_URL не настроен')
+        try:
+            user = User.objects.get(pk=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f'Пользователь {options["user"]} не найден')
+        try:
+            with open(options['path'], encoding='utf-8-sig') as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            raise CommandError(f'Не удалось прочитать CSV: {e}')
+
+        creator = BulkCampaignCreator(user, options['concurrency'], options['retries'])
+        try:
+            rows = async_to_sync(creator.create_from_csv)(text, skip_invalid=options['skip_invalid'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        except KeitaroAPIException as e:
+            raise CommandError(f'Ошибка Keitaro API: {e}')
+
+        for row in rows:
+            if row.status == 'created':
+                self.stdout.write(f'{row.line:>5}  created  {row.name} (Keitaro ID {row.keitaro_id})')
+            elif row.errors:
+                self.stdout.write(f'{row.line:>5}  {row.status:<8} {row.name}: {"; ".join(row.errors)}')
+
+        summary = summarize(rows)
+        line = ', '.join(f'{status}: {count}' for status, count in summary.items())
+        if summary['invalid'] and not options['skip_invalid']:
+            raise CommandError(f'В CSV есть строки с ошибками, ничего не создано ({line})')
+        style = self.style.SUCCESS if not summary['failed'] else self.style.WARNING
+        self.stdout.write(style(line))
@@ -0,0 +1,35 @@
+"""
+Потоковая выгрузка кампаний, потоков и распределения share в CSV или NDJSON
+"""
+from django.core.management.base import BaseCommand
+from campaigns.services.export import DATASETS, EXPORT_FORMATS, iter_export
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает кампании, потоки или распределение share по офферам в CSV или NDJSON. '
+        'Строки читаются курсором пачками, память не зависит от объёма данных'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(DATASETS), help='Набор данных')
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv', help='Формат выгрузки')
+        parser.add_argument('--output', help='Файл для выгрузки (по умолчанию stdout)')
+        parser.add_argument('--include-deleted', action='store_true', help='Включить удалённые кампании')
+        parser.add_argument('--chunk-size', type=int, help='Строк в пачке (по умолчанию EXPORT_CHUNK_SIZE)')
+        parser.add_argument('--database', default=None, help='Алиас БД для чтения (например, replica)')
+
+    def handle(self, *args, **options):
+        chunks = iter_export(
+            options['dataset'],
+            options['format'],
+            include_deleted=options['include_deleted'],
+            using=options['database'],
+            chunk_size=options['chunk_size'],
+        )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as f:
+                f.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
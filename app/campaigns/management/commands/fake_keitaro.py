@@ -0,0 +1,55 @@
+"""
+Запуск локальной имитации Keitaro API с синтетическим аккаунтом
+"""
+from django.core.management.base import BaseCommand
+from campaigns.testing import FakeKeitaroServer, SyntheticAccount
+
+
+class Command(BaseCommand):
+    help = 'Запускает имитацию Keitaro Admin API (для нагрузочных тестов и бенчмарков без реального Keitaro)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Адрес для прослушивания')
+        parser.add_argument('--port', type=int, default=8899, help='Порт')
+        parser.add_argument('--campaigns', type=int, default=100, help='Количество кампаний')
+        parser.add_argument('--streams', type=int, default=5, help='Потоков в кампании')
+        parser.add_argument('--offers', type=int, default=500, help='Размер каталога офферов')
+        parser.add_argument('--offers-per-stream', type=int, default=5, help='Офферов в потоке')
+        parser.add_argument('--seed', type=int, default=1, help='Seed генератора данных')
+        parser.add_argument('--api-key', action='append', dest='api_keys',
+                            help='Допустимый API ключ (можно несколько; по умолчанию любой)')
+        parser.add_argument('--latency-ms', type=float, default=0, help='Задержка ответа, мс')
+        parser.add_argument('--jitter-ms', type=float, default=0, help='Разброс задержки, мс')
+        parser.add_argument('--error-rate', type=float, default=0, help='Доля ответов с ошибкой (0..1)')
+        parser.add_argument('--error-status', type=int, default=503, help='HTTP статус ошибки')
+
+    def handle(self, *args, **options):
+        account = SyntheticAccount(
+            campaigns=options['campaigns'],
+            streams_per_campaign=options['streams'],
+            offers=options['offers'],
+            offers_per_stream=options['offers_per_stream'],
+            seed=options['seed'],
+            api_keys=options['api_keys'],
+        )
+        server = FakeKeitaroServer(
+            account,
+            host=options['host'],
+            port=options['port'],
+            latency=options['latency_ms'] / 1000,
+            jitter=options['jitter_ms'] / 1000,
+            error_rate=options['error_rate'],
+            error_status=options['error_status'],
+            seed=options['seed'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Fake Keitaro: {server.url} '
+            f'({len(account.campaigns)} кампаний, {len(account.streams)} потоков, {len(account.offers)} офферов)'
+        ))
+        self.stdout.write(f'Укажите KEITARO_URL={server.url}. Остановка: Ctrl+C')
+        try:
+            server.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.httpd.server_close()
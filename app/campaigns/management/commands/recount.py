@@ -0,0 +1,30 @@
+"""
+Сверка и исправление денормализованных счётчиков и снимков офферов потоков
+"""
+from django.core.management.base import BaseCommand, CommandError
+from campaigns.services.counters import recount
+from campaigns.services.snapshots import check_snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет Campaign.flows_count, Flow.active_offers_count, Flow.total_offers_count и снимки '
+        'офферов Flow.offers_snapshot с фактическими данными и исправляет расхождения'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Только проверить: при расхождениях завершиться с ошибкой, ничего не меняя')
+
+    def handle(self, *args, **options):
+        stale = recount(fix=not options['check'])
+        stale['snapshots'] = check_snapshots(fix=not options['check'])
+        summary = (f'кампаний: {stale["campaigns"]}, потоков: {stale["flows"]}, '
+                   f'снимков потоков: {stale["snapshots"]}')
+
+        if not any(stale.values()):
+            self.stdout.write(self.style.SUCCESS('Счётчики и снимки совпадают с данными'))
+        elif options['check']:
+            raise CommandError(f'Счётчики или снимки расходятся с данными ({summary})')
+        else:
+            self.stdout.write(self.style.WARNING(f'Исправлены счётчики и снимки ({summary})'))
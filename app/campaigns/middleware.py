@@ -0,0 +1,193 @@
+"""
+Middleware трассировки вызовов Keitaro и профилирования запросов
+"""
+import cProfile
+import logging
+import pstats
+import threading
+import time
+from contextlib import ExitStack
+from typing import List
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from config.middleware import QueryCounter
+from .services.profiling import ProfileStore
+from .services.tracing import KeitaroCall, tracer
+
+logger = logging.getLogger(__name__)
+
+
+class KeitaroTracingMiddleware:
+    """
+    Разбивка времени запроса по вызовам Keitaro
+
+    Добавляет заголовки X-Keitaro-Calls и X-Keitaro-Time-Ms. Если суммарное время
+    вызовов Keitaro превысило KEITARO_SLOW_CALL_MS, пишет в лог список вызовов запроса
+    (вместе с ID запроса это позволяет отличить медленный Keitaro от медленной БД).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with tracer.collect() as calls:
+            response = self.get_response(request)
+        return self._report(request, response, calls)
+
+    async def __acall__(self, request):
+        with tracer.collect() as calls:
+            response = await self.get_response(request)
+        return self._report(request, response, calls)
+
+    @staticmethod
+    def _report(request, response, calls: List[KeitaroCall]):
+        total_ms = sum(call.duration_ms for call in calls)
+        if getattr(settings, 'DIAGNOSTIC_HEADERS', True):
+            response['X-Keitaro-Calls'] = str(len(calls))
+            response['X-Keitaro-Time-Ms'] = f'{total_ms:.1f}'
+
+        threshold_ms = getattr(settings, 'KEITARO_SLOW_CALL_MS', 1000)
+        if calls and threshold_ms and total_ms >= threshold_ms:
+            logger.warning(
+                'Медленный запрос %s %s: %d вызовов Keitaro, %.1f мс: %s',
+                request.method, request.path, len(calls), total_ms,
+                '; '.join(f'{call.method} {call.endpoint} {call.status or call.error or "-"} '
+                          f'{call.duration_ms:.0f} мс' for call in calls),
+            )
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Профилирование отдельного запроса по запросу staff пользователя
+
+    Включается заголовком "X-Profile: 1" или параметром ?_profile=1. Запрос выполняется
+    под cProfile, профиль вместе со временем SQL и Keitaro сохраняется в ProfileStore,
+    имя профиля возвращается в заголовке X-Profile-Id. Одновременно профилируется
+    только один запрос процесса (cProfile не поддерживает вложенное профилирование).
+    Должен стоять после AuthMiddleware.
+    """
+
+    _lock = threading.Lock()
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _requested(self, request) -> bool:
+        if not getattr(settings, 'PROFILING_ENABLED', True):
+            return False
+        flag = request.headers.get('X-Profile') or request.GET.get('_profile')
+        if flag not in ('1', 'true', 'yes'):
+            return False
+        user = getattr(request, 'user', None)
+        return bool(user and user.is_active and user.is_staff)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self._requested(request):
+            return self.get_response(request)
+
+        if not self._lock.acquire(blocking=False):
+            response = self.get_response(request)
+            response['X-Profile-Id'] = 'busy'
+            return response
+
+        try:
+            profiler = cProfile.Profile()
+            counter = QueryCounter()
+            with ExitStack() as stack:
+                counter.install(stack)
+                calls = stack.enter_context(tracer.collect())
+                started = time.perf_counter()
+                try:
+                    profiler.enable()
+                except ValueError:
+                    # Уже активен другой профилировщик (отладчик, coverage)
+                    logger.warning('Профилирование недоступно: активен другой профилировщик')
+                    return self.get_response(request)
+                try:
+                    response = self.get_response(request)
+                finally:
+                    profiler.disable()
+                duration = time.perf_counter() - started
+        finally:
+            self._lock.release()
+
+        return self._save(request, response, profiler, counter, calls, duration)
+
+    async def __acall__(self, request):
+        """
+        Под ASGI профилируется поток event loop: в профиль попадает и работа
+        параллельных запросов этого воркера, а SQL выполняется в отдельном потоке
+        и виден только как время ожидания (его число и время - в метаданных профиля)
+        """
+        if not self._requested(request):
+            return await self.get_response(request)
+
+        if not self._lock.acquire(blocking=False):
+            response = await self.get_response(request)
+            response['X-Profile-Id'] = 'busy'
+            return response
+
+        try:
+            profiler = cProfile.Profile()
+            counter = QueryCounter()
+            stack = ExitStack()
+            await sync_to_async(counter.install)(stack)
+            try:
+                with tracer.collect() as calls:
+                    started = time.perf_counter()
+                    try:
+                        profiler.enable()
+                    except ValueError:
+                        logger.warning('Профилирование недоступно: активен другой профилировщик')
+                        return await self.get_response(request)
+                    try:
+                        response = await self.get_response(request)
+                    finally:
+                        profiler.disable()
+                    duration = time.perf_counter() - started
+            finally:
+                await sync_to_async(stack.close)()
+        finally:
+            self._lock.release()
+
+        return self._save(request, response, profiler, counter, calls, duration)
+
+    @staticmethod
+    def _save(request, response, profiler: cProfile.Profile, counter: QueryCounter,
+              calls: List[KeitaroCall], duration: float):
+        name = ProfileStore().save(pstats.Stats(profiler), {
+            'request_id': getattr(request, 'request_id', ''),
+            'created_at': timezone.localtime().strftime('%Y-%m-%d %H:%M:%S'),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'view': request.resolver_match.view_name if request.resolver_match else '',
+            'status': response.status_code,
+            'user_id': request.user.id,
+            'duration_ms': round(duration * 1000, 2),
+            'sql_queries': counter.count,
+            'sql_ms': round(counter.duration * 1000, 2),
+            'keitaro_calls': len(calls),
+            'keitaro_ms': round(sum(call.duration_ms for call in calls), 2),
+            'keitaro': [
+                {'method': call.method, 'endpoint': call.endpoint, 'status': call.status,
+                 'duration_ms': round(call.duration_ms, 2), 'retries': call.retries}
+                for call in calls
+            ],
+        })
+        response['X-Profile-Id'] = name
+        return response
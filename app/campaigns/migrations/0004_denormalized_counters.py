@@ -0,0 +1,48 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:15
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def _count(queryset, field):
+    counted = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(count=Count('pk'))
+    return Coalesce(Subquery(counted.values('count')), Value(0))
+
+
+def fill_counters(apps, schema_editor):
+    """Начальные значения счётчиков по существующим данным"""
+    Campaign = apps.get_model('campaigns', 'Campaign')
+    Flow = apps.get_model('campaigns', 'Flow')
+    FlowOffer = apps.get_model('campaigns', 'FlowOffer')
+    Flow.objects.update(
+        active_offers_count=_count(FlowOffer.objects.filter(state='active'), 'flow'),
+        total_offers_count=_count(FlowOffer.objects.all(), 'flow'),
+    )
+    Campaign.objects.update(flows_count=_count(Flow.objects.all(), 'campaign'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0003_remove_campaign_campaigns_user_id_358125_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='flows_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Потоков'),
+        ),
+        migrations.AddField(
+            model_name='flow',
+            name='active_offers_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Активных офферов'),
+        ),
+        migrations.AddField(
+            model_name='flow',
+            name='total_offers_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Всего офферов'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0004_denormalized_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='campaign',
+            name='campaigns_state_3fa02d_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='flowoffer',
+            name='flow_offers_flow_id_6df4a0_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='offer',
+            name='offers_user_id_ab9c22_idx',
+        ),
+        migrations.AddIndex(
+            model_name='campaign',
+            index=models.Index(condition=models.Q(('state', 'deleted'), _negated=True), fields=['-created_at'], name='campaigns_live_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flowoffer',
+            index=models.Index(condition=models.Q(('state', 'active')), fields=['flow'], name='flow_offers_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(condition=models.Q(('state', 'active')), fields=['user', 'name'], name='offers_user_active_name_idx'),
+        ),
+    ]
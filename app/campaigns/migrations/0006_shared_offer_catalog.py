@@ -0,0 +1,45 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0005_query_shape_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OfferVisibility',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('synced_at', models.DateTimeField(verbose_name='Синхронизировано')),
+            ],
+            options={
+                'verbose_name': 'Доступ к офферу',
+                'verbose_name_plural': 'Доступ к офферам',
+                'db_table': 'offer_visibility',
+            },
+        ),
+        migrations.AddField(
+            model_name='offervisibility',
+            name='offer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='visibility', to='campaigns.offer', verbose_name='Оффер'),
+        ),
+        migrations.AddField(
+            model_name='offervisibility',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='offer_visibility', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+        migrations.AddField(
+            model_name='offer',
+            name='instance',
+            # Пустое значение только для добавления столбца: существующие офферы заполняет 0007
+            field=models.CharField(default='', max_length=255, verbose_name='Инстанс Keitaro'),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:19
+
+from django.conf import settings
+from django.db import migrations
+from django.utils import timezone
+
+
+def fill_instance(apps, schema_editor):
+    """
+    Инстанс Keitaro существующих офферов - KEITARO_URL на момент миграции
+
+    Без KEITARO_URL офферы получили бы пустой инстанс, перестали быть видны пользователям
+    и были бы созданы заново при следующей синхронизации - поэтому миграция прерывается.
+    """
+    Offer = apps.get_model('campaigns', 'Offer')
+    if not Offer.objects.exists():
+        return
+    instance = (getattr(settings, 'KEITARO_URL', '') or '').rstrip('/').lower()
+    if not instance:
+        raise RuntimeError(
+            'KEITARO_URL не задан: нельзя определить инстанс Keitaro существующих офферов. '
+            'Запустите migrate с настройками приложения (KEITARO_URL)'
+        )
+    Offer.objects.update(instance=instance)
+
+
+def copy_visibility(apps, schema_editor):
+    """Владелец оффера получает к нему доступ: строки каталога уже уникальны по keitaro_id"""
+    Offer = apps.get_model('campaigns', 'Offer')
+    OfferVisibility = apps.get_model('campaigns', 'OfferVisibility')
+    now = timezone.now()
+    OfferVisibility.objects.bulk_create(
+        (OfferVisibility(user_id=user_id, offer_id=offer_id, synced_at=now)
+         for offer_id, user_id in Offer.objects.values_list('id', 'user_id').iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    # Отдельная миграция (своя транзакция): в PostgreSQL ALTER TABLE в одной транзакции
+    # со вставкой строк с отложенными внешними ключами падает с "pending trigger events"
+
+    dependencies = [
+        ('campaigns', '0006_shared_offer_catalog'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_instance, migrations.RunPython.noop),
+        migrations.RunPython(copy_visibility, migrations.RunPython.noop),
+    ]
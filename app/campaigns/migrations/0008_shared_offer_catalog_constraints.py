@@ -0,0 +1,49 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0007_copy_offer_visibility'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='offer',
+            name='offers_keitaro_793cdd_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='offer',
+            name='offers_user_active_name_idx',
+        ),
+        migrations.RemoveField(
+            model_name='offer',
+            name='user',
+        ),
+        migrations.AlterField(
+            model_name='offer',
+            name='keitaro_id',
+            field=models.IntegerField(verbose_name='ID в Keitaro'),
+        ),
+        migrations.AddField(
+            model_name='offer',
+            name='users',
+            field=models.ManyToManyField(related_name='offers', through='campaigns.OfferVisibility', to=settings.AUTH_USER_MODEL, verbose_name='Доступен пользователям'),
+        ),
+        migrations.AddIndex(
+            model_name='offer',
+            index=models.Index(condition=models.Q(('state', 'active')), fields=['instance', 'name'], name='offers_active_name_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='offer',
+            constraint=models.UniqueConstraint(fields=('instance', 'keitaro_id'), name='offers_instance_keitaro_id_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='offervisibility',
+            constraint=models.UniqueConstraint(fields=('user', 'offer'), name='offer_visibility_user_offer_uniq'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:22
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_removed_at(apps, schema_editor):
+    """Для уже удалённых строк срок хранения отсчитывается от последнего изменения"""
+    Campaign = apps.get_model('campaigns', 'Campaign')
+    FlowOffer = apps.get_model('campaigns', 'FlowOffer')
+    Campaign.objects.filter(state='deleted').update(deleted_at=F('synced_at'))
+    FlowOffer.objects.filter(state='disabled').update(disabled_at=F('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0008_shared_offer_catalog_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('campaign', 'Кампания'), ('flow_offer', 'Оффер в потоке')], max_length=20, verbose_name='Тип')),
+                ('object_id', models.BigIntegerField(verbose_name='ID в рабочей таблице')),
+                ('campaign_keitaro_id', models.IntegerField(verbose_name='ID кампании в Keitaro')),
+                ('payload', models.BinaryField(verbose_name='Данные (JSON, zlib)')),
+                ('removed_at', models.DateTimeField(verbose_name='Удалено')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Архивировано')),
+            ],
+            options={
+                'verbose_name': 'Архивная запись',
+                'verbose_name_plural': 'Архив',
+                'db_table': 'archive',
+                'ordering': ['-archived_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Удалена'),
+        ),
+        migrations.AddField(
+            model_name='flowoffer',
+            name='disabled_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Отключен'),
+        ),
+        migrations.RunPython(fill_removed_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='campaign',
+            index=models.Index(condition=models.Q(('state', 'deleted')), fields=['deleted_at'], name='campaigns_deleted_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='flowoffer',
+            index=models.Index(condition=models.Q(('state', 'disabled')), fields=['disabled_at'], name='flow_offers_disabled_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedrecord',
+            index=models.Index(fields=['kind', 'campaign_keitaro_id'], name='archive_kind_77c460_idx'),
+        ),
+    ]
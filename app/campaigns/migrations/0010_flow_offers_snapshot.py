@@ -0,0 +1,39 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:26
+
+from django.db import migrations, models
+
+
+def fill_snapshots(apps, schema_editor):
+    """Начальные снимки офферов потоков (формат как в campaigns.services.snapshots)"""
+    Flow = apps.get_model('campaigns', 'Flow')
+    FlowOffer = apps.get_model('campaigns', 'FlowOffer')
+    snapshots = {}
+    rows = FlowOffer.objects.order_by('flow_id', '-share', 'pk').values_list(
+        'flow_id', 'pk', 'offer__keitaro_id', 'offer__name', 'share', 'is_pinned', 'state',
+    )
+    for flow_id, pk, offer_id, offer_name, share, is_pinned, state in rows.iterator():
+        snapshots.setdefault(flow_id, []).append({
+            'id': pk, 'offer_id': offer_id, 'offer_name': offer_name,
+            'share': share, 'is_pinned': is_pinned, 'state': state,
+        })
+    Flow.objects.bulk_update(
+        [Flow(pk=flow_id, offers_snapshot=snapshot) for flow_id, snapshot in snapshots.items()],
+        ['offers_snapshot'],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0009_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flow',
+            name='offers_snapshot',
+            field=models.JSONField(blank=True, default=list, verbose_name='Снимок офферов'),
+        ),
+        migrations.RunPython(fill_snapshots, migrations.RunPython.noop),
+    ]
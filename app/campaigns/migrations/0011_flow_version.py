@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-19 01:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0010_flow_offers_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flow',
+            name='version',
+            field=models.PositiveIntegerField(default=1, verbose_name='Версия'),
+        ),
+    ]
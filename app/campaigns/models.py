@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Q
 from django.conf import settings
 
 
@@ -10,6 +11,10 @@ class Campaign(models.Model):
     alias = models.CharField(max_length=255, blank=True, verbose_name='Алиас')
     state = models.CharField(max_length=50, default='active', verbose_name='Состояние')
     type = models.CharField(max_length=50, default='position', verbose_name='Тип')
+    # Счётчик поддерживается сервисами (services/counters.py), сверяется командой recount
+    flows_count = models.PositiveIntegerField(default=0, verbose_name='Потоков')
+    # Когда синхронизация пометила кампанию удалённой: от этой даты отсчитывается срок хранения до архивации
+    deleted_at = models.DateTimeField(null=True, blank=True, verbose_name='Удалена')
     synced_at = models.DateTimeField(auto_now=True, verbose_name='Синхронизировано')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
     
@@ -20,7 +25,11 @@ class Campaign(models.Model):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['keitaro_id']),
-            models.Index(fields=['state']),
+            # Список кампаний: exclude(state='deleted').order_by('-created_at') читается
+            # по индексу в нужном порядке, удалённые кампании в индекс не попадают
+            models.Index(fields=['-created_at'], condition=~Q(state='deleted'), name='campaigns_live_created_idx'),
+            # Архивация (manage.py archive): удалённые кампании старше срока хранения
+            models.Index(fields=['deleted_at'], condition=Q(state='deleted'), name='campaigns_deleted_at_idx'),
         ]
     
     def __str__(self):
@@ -41,6 +50,15 @@ class Flow(models.Model):
     type = models.CharField(max_length=50, default='offers', verbose_name='Тип потока')
     position = models.IntegerField(default=0, verbose_name='Позиция')
     state = models.CharField(max_length=50, default='active', verbose_name='Состояние')
+    # Счётчики офферов потока (FlowOffer): поддерживаются сервисами, сверяются командой recount
+    active_offers_count = models.PositiveIntegerField(default=0, verbose_name='Активных офферов')
+    total_offers_count = models.PositiveIntegerField(default=0, verbose_name='Всего офферов')
+    # Офферы потока в порядке показа (services/snapshots.py): карточка кампании читает
+    # только таблицу потоков. Переписывается вместе с офферами потока, сверяется командой recount
+    offers_snapshot = models.JSONField(default=list, blank=True, verbose_name='Снимок офферов')
+    # Версия офферов потока: увеличивается при каждом их изменении, изменения из интерфейса
+    # передают увиденную версию и при расхождении получают 409 (services/versions.py)
+    version = models.PositiveIntegerField(default=1, verbose_name='Версия')
     synced_at = models.DateTimeField(auto_now=True, verbose_name='Синхронизировано')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
     
@@ -59,29 +77,54 @@ class Flow(models.Model):
         return f'{self.name} (Campaign: {self.campaign.name})'
 
 
+def keitaro_instance() -> str:
+    """Инстанс Keitaro, с которым работает приложение (KEITARO_URL без завершающего /)"""
+    return settings.KEITARO_URL.rstrip('/').lower()
+
+
+class OfferQuerySet(models.QuerySet):
+    
+    def visible_to(self, user) -> 'OfferQuerySet':
+        """Офферы текущего инстанса Keitaro, доступные пользователю (его API ключу)"""
+        return self.filter(instance=keitaro_instance(), visibility__user=user)
+
+
 class Offer(models.Model):
-    """Оффер (кэшированный из Keitaro)"""
+    """
+    Оффер из общего каталога инстанса Keitaro
     
-    keitaro_id = models.IntegerField(unique=True, verbose_name='ID в Keitaro')
-    user = models.ForeignKey(
+    Каталог один на инстанс: пользователи с ключами к одному Keitaro разделяют строки
+    офферов, а доступные каждому пользователю офферы хранятся в OfferVisibility.
+    """
+    
+    # Без значения по умолчанию: инстанс (keitaro_instance()) всегда задаётся явно при создании оффера
+    instance = models.CharField(max_length=255, verbose_name='Инстанс Keitaro')
+    keitaro_id = models.IntegerField(verbose_name='ID в Keitaro')
+    users = models.ManyToManyField(
         settings.AUTH_USER_MODEL,
-        on_delete=models.CASCADE,
+        through='OfferVisibility',
         related_name='offers',
-        verbose_name='Пользователь'
+        verbose_name='Доступен пользователям'
     )
     name = models.CharField(max_length=255, verbose_name='Название')
     state = models.CharField(max_length=50, default='active', verbose_name='Состояние')
     cached_at = models.DateTimeField(auto_now=True, verbose_name='Кэшировано')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
     
+    objects = OfferQuerySet.as_manager()
+    
     class Meta:
         verbose_name = 'Оффер'
         verbose_name_plural = 'Офферы'
         db_table = 'offers'
         ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(fields=['instance', 'keitaro_id'], name='offers_instance_keitaro_id_uniq'),
+        ]
         indexes = [
-            models.Index(fields=['keitaro_id']),
-            models.Index(fields=['user', 'state']),
+            # Автодополнение: visible_to(user).filter(state='active', name__icontains).order_by('name') -
+            # активные офферы инстанса уже отсортированы по имени, доступность проверяется по OfferVisibility
+            models.Index(fields=['instance', 'name'], condition=Q(state='active'), name='offers_active_name_idx'),
             models.Index(fields=['name']),
         ]
     
@@ -89,6 +132,36 @@ class Offer(models.Model):
         return f'{self.name} (ID: {self.keitaro_id})'
 
 
+class OfferVisibility(models.Model):
+    """Оффер каталога, доступный пользователю (виден в списке офферов по его API ключу)"""
+    
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='offer_visibility',
+        verbose_name='Пользователь'
+    )
+    offer = models.ForeignKey(
+        Offer,
+        on_delete=models.CASCADE,
+        related_name='visibility',
+        verbose_name='Оффер'
+    )
+    # Время синхронизации, в которую оффер был в списке: отметки старше синхронизации удаляются
+    synced_at = models.DateTimeField(verbose_name='Синхронизировано')
+    
+    class Meta:
+        verbose_name = 'Доступ к офферу'
+        verbose_name_plural = 'Доступ к офферам'
+        db_table = 'offer_visibility'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'offer'], name='offer_visibility_user_offer_uniq'),
+        ]
+    
+    def __str__(self):
+        return f'{self.user} → {self.offer}'
+
+
 class FlowOffer(models.Model):
     """Связь потока и оффера (распределение офферов в потоке)"""
     
@@ -130,6 +203,8 @@ class FlowOffer(models.Model):
         blank=True,
         verbose_name='ID связи в Keitaro'
     )
+    # Когда оффер отключили (в приложении или синхронизацией): от этой даты отсчитывается срок хранения
+    disabled_at = models.DateTimeField(null=True, blank=True, verbose_name='Отключен')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Обновлено')
     
@@ -140,9 +215,47 @@ class FlowOffer(models.Model):
         unique_together = [['flow', 'offer']]
         ordering = ['flow', '-share']
         indexes = [
-            models.Index(fields=['flow', 'state']),
+            # Пересчёт share и отправка в Keitaro: flow_offers.filter(state='active').
+            # Отключённые офферы потока находятся по unique (flow, offer)
+            models.Index(fields=['flow'], condition=Q(state='active'), name='flow_offers_active_idx'),
+            # Архивация: отключённые офферы старше срока хранения
+            models.Index(fields=['disabled_at'], condition=Q(state='disabled'), name='flow_offers_disabled_at_idx'),
             models.Index(fields=['keitaro_offer_stream_id']),
         ]
     
     def __str__(self):
         return f'{self.offer.name} в {self.flow.name} ({self.share}%)'
+
+
+class ArchivedRecord(models.Model):
+    """
+    Архивная запись: удалённая кампания или отключённый оффер потока
+    
+    Строки, которые дольше срока хранения помечены удалёнными, переносятся из рабочих
+    таблиц в сжатый JSON (payload, zlib): кампания - вместе с потоками и офферами потоков.
+    Запись восстанавливается командой archive --restore (services/archive.py).
+    """
+    
+    KIND_CHOICES = [
+        ('campaign', 'Кампания'),
+        ('flow_offer', 'Оффер в потоке'),
+    ]
+    
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name='Тип')
+    object_id = models.BigIntegerField(verbose_name='ID в рабочей таблице')
+    campaign_keitaro_id = models.IntegerField(verbose_name='ID кампании в Keitaro')
+    payload = models.BinaryField(verbose_name='Данные (JSON, zlib)')
+    removed_at = models.DateTimeField(verbose_name='Удалено')
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name='Архивировано')
+    
+    class Meta:
+        verbose_name = 'Архивная запись'
+        verbose_name_plural = 'Архив'
+        db_table = 'archive'
+        ordering = ['-archived_at']
+        indexes = [
+            models.Index(fields=['kind', 'campaign_keitaro_id']),
+        ]
+    
+    def __str__(self):
+        return f'{self.get_kind_display()} #{self.object_id} (кампания {self.campaign_keitaro_id})'
@@ -2,8 +2,9 @@
 Сервисы для работы с Keitaro API и бизнес-логикой
 """
 from .client import KeitaroClient
+from .async_client import AsyncKeitaroClient
 from .calculator import ShareCalculator, MIN_SHARE_PERCENT
 from .sync_service import KeitaroSyncService
 
-__all__ = ['KeitaroClient', 'ShareCalculator', 'KeitaroSyncService', 'MIN_SHARE_PERCENT']
+__all__ = ['KeitaroClient', 'AsyncKeitaroClient', 'ShareCalculator', 'KeitaroSyncService', 'MIN_SHARE_PERCENT']
 
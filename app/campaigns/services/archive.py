@@ -0,0 +1,376 @@
+"""
+Архивация удалённых кампаний и отключённых офферов потоков
+
+Синхронизация не удаляет строки, а помечает их: кампании - state='deleted' (deleted_at),
+офферы потоков - state='disabled' (disabled_at). Строки, помеченные раньше срока хранения
+ARCHIVE_RETENTION_DAYS, переносятся в таблицу archive сжатым JSON: кампания - одной записью
+вместе с потоками и офферами потоков, отключённый оффер потока - отдельной записью.
+Архивные записи можно вернуть в рабочие таблицы (restore).
+"""
+import json
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Count, Q, QuerySet, Sum
+from django.db.models.functions import Length
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from config.exceptions import ArchiveRestoreException
+from ..models import ArchivedRecord, Campaign, Flow, FlowOffer, Offer
+from .counters import adjust_flow_counters, refresh_flow_counters
+from .snapshots import refresh_flow_snapshots
+from .versions import bump_flow_versions
+
+ARCHIVE_BATCH_SIZE = 200
+# Таблицы, размер которых показывает отчёт
+REPORT_TABLES = ['campaigns', 'flows', 'flow_offers', 'archive']
+
+
+def encode_payload(data: Dict) -> bytes:
+    """Сжатый JSON архивной записи (даты - ISO 8601 с микросекундами, DjangoJSONEncoder их округляет)"""
+    payload = json.dumps(data, default=lambda value: value.isoformat(), separators=(',', ':'))
+    return zlib.compress(payload.encode('utf-8'))
+
+
+def decode_payload(payload) -> Dict:
+    """Данные архивной записи (PostgreSQL возвращает bytea как memoryview)"""
+    return json.loads(zlib.decompress(bytes(payload)))
+
+
+def retention_cutoff(days: Optional[int] = None) -> datetime:
+    """Строки, помеченные удалёнными раньше этого момента, архивируются"""
+    if days is None:
+        days = settings.ARCHIVE_RETENTION_DAYS
+    return timezone.now() - timedelta(days=days)
+
+
+def expired_campaigns(cutoff: datetime) -> QuerySet:
+    """Удалённые кампании старше срока хранения"""
+    return Campaign.objects.filter(state='deleted', deleted_at__lt=cutoff)
+
+
+def expired_flow_offers(cutoff: datetime) -> QuerySet:
+    """Отключённые офферы потоков старше срока хранения (офферы удалённых кампаний архивируются с кампанией)"""
+    return FlowOffer.objects.filter(state='disabled', disabled_at__lt=cutoff).exclude(flow__campaign__state='deleted')
+
+
+def _offer_data(offer: Offer) -> Dict:
+    return {'instance': offer.instance, 'keitaro_id': offer.keitaro_id, 'name': offer.name}
+
+
+def _flow_offer_data(flow_offer: FlowOffer) -> Dict:
+    return {
+        'offer': _offer_data(flow_offer.offer),
+        'share': flow_offer.share,
+        'is_pinned': flow_offer.is_pinned,
+        'state': flow_offer.state,
+        'keitaro_offer_stream_id': flow_offer.keitaro_offer_stream_id,
+        'disabled_at': flow_offer.disabled_at,
+        'created_at': flow_offer.created_at,
+    }
+
+
+def _campaign_data(campaign: Campaign) -> Dict:
+    return {
+        'keitaro_id': campaign.keitaro_id,
+        'name': campaign.name,
+        'alias': campaign.alias,
+        'state': campaign.state,
+        'type': campaign.type,
+        'deleted_at': campaign.deleted_at,
+        'created_at': campaign.created_at,
+        'flows': [
+            {
+                'keitaro_id': flow.keitaro_id,
+                'name': flow.name,
+                'type': flow.type,
+                'position': flow.position,
+                'state': flow.state,
+                'flow_offers': [_flow_offer_data(fo) for fo in flow.flow_offers.all()],
+            }
+            for flow in campaign.flows.all()
+        ],
+    }
+
+
+def archive_campaigns(cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """
+    Перенос удалённых кампаний (с потоками и офферами потоков) в архив
+
+    Каждая пачка переносится в своей транзакции: строки блокируются, записываются
+    в архив и удаляются из рабочих таблиц.
+
+    Args:
+        cutoff: Граница срока хранения
+        batch_size: Кампаний в пачке
+
+    Returns:
+        Количество архивированных кампаний
+    """
+    archived = 0
+    while True:
+        with transaction.atomic():
+            ids = list(expired_campaigns(cutoff).select_for_update().order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return archived
+            campaigns = Campaign.objects.filter(pk__in=ids).prefetch_related('flows__flow_offers__offer')
+            ArchivedRecord.objects.bulk_create([
+                ArchivedRecord(
+                    kind='campaign',
+                    object_id=campaign.pk,
+                    campaign_keitaro_id=campaign.keitaro_id,
+                    payload=encode_payload(_campaign_data(campaign)),
+                    removed_at=campaign.deleted_at,
+                )
+                for campaign in campaigns
+            ])
+            Campaign.objects.filter(pk__in=ids).delete()
+            archived += len(ids)
+
+
+def archive_flow_offers(cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """
+    Перенос отключённых офферов потоков в архив
+
+    Счётчики офферов затронутых потоков пересчитываются в той же транзакции.
+
+    Args:
+        cutoff: Граница срока хранения
+        batch_size: Офферов в пачке
+
+    Returns:
+        Количество архивированных офферов потоков
+    """
+    archived = 0
+    while True:
+        with transaction.atomic():
+            ids = list(expired_flow_offers(cutoff).select_for_update().order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return archived
+            flow_offers = list(FlowOffer.objects.filter(pk__in=ids).select_related('flow__campaign', 'offer'))
+            ArchivedRecord.objects.bulk_create([
+                ArchivedRecord(
+                    kind='flow_offer',
+                    object_id=fo.pk,
+                    campaign_keitaro_id=fo.flow.campaign.keitaro_id,
+                    payload=encode_payload({'flow_keitaro_id': fo.flow.keitaro_id, **_flow_offer_data(fo)}),
+                    removed_at=fo.disabled_at,
+                )
+                for fo in flow_offers
+            ])
+            FlowOffer.objects.filter(pk__in=ids).delete()
+            flows = Flow.objects.filter(pk__in={fo.flow_id for fo in flow_offers})
+            refresh_flow_counters(flows)
+            refresh_flow_snapshots(flows)
+            bump_flow_versions(flows)
+            archived += len(ids)
+
+
+def archive(days: Optional[int] = None, batch_size: int = ARCHIVE_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Архивация всех строк старше срока хранения
+
+    Args:
+        days: Срок хранения в днях (по умолчанию ARCHIVE_RETENTION_DAYS)
+        batch_size: Строк в пачке
+
+    Returns:
+        Количество архивированных кампаний и офферов потоков
+    """
+    cutoff = retention_cutoff(days)
+    # Сначала кампании: их офферы архивируются вместе с ними, а не отдельными записями
+    return {
+        'campaigns': archive_campaigns(cutoff, batch_size),
+        'flow_offers': archive_flow_offers(cutoff, batch_size),
+    }
+
+
+def _get_offer(data: Dict) -> Offer:
+    """Оффер каталога для восстановленной строки (создаётся, если его уже нет в каталоге)"""
+    offer, _ = Offer.objects.get_or_create(
+        instance=data['instance'],
+        keitaro_id=data['keitaro_id'],
+        defaults={'name': data['name']},
+    )
+    return offer
+
+
+def _restore_campaign(record: ArchivedRecord) -> Campaign:
+    data = decode_payload(record.payload)
+    if Campaign.objects.filter(keitaro_id=record.campaign_keitaro_id).exists():
+        raise ArchiveRestoreException(f'Кампания {record.campaign_keitaro_id} уже есть в рабочей таблице')
+
+    # Срок хранения восстановленной кампании отсчитывается заново
+    campaign = Campaign.objects.create(
+        keitaro_id=data['keitaro_id'],
+        name=data['name'],
+        alias=data['alias'],
+        state=data['state'],
+        type=data['type'],
+        deleted_at=timezone.now() if data['state'] == 'deleted' else None,
+        flows_count=len(data['flows']),
+    )
+    # created_at задаёт порядок списка кампаний (auto_now_add при создании не переопределить)
+    Campaign.objects.filter(pk=campaign.pk).update(created_at=parse_datetime(data['created_at']))
+
+    flows = Flow.objects.bulk_create([
+        Flow(
+            campaign=campaign,
+            keitaro_id=flow_data['keitaro_id'],
+            name=flow_data['name'],
+            type=flow_data['type'],
+            position=flow_data['position'],
+            state=flow_data['state'],
+            active_offers_count=sum(fo['state'] == 'active' for fo in flow_data['flow_offers']),
+            total_offers_count=len(flow_data['flow_offers']),
+        )
+        for flow_data in data['flows']
+    ])
+    FlowOffer.objects.bulk_create([
+        FlowOffer(
+            flow=flow,
+            offer=_get_offer(fo['offer']),
+            share=fo['share'],
+            is_pinned=fo['is_pinned'],
+            state=fo['state'],
+            keitaro_offer_stream_id=fo['keitaro_offer_stream_id'],
+            disabled_at=timezone.now() if fo['state'] == 'disabled' else None,
+        )
+        for flow, flow_data in zip(flows, data['flows'])
+        for fo in flow_data['flow_offers']
+    ])
+    refresh_flow_snapshots(campaign.flows.all())
+    return campaign
+
+
+def _restore_flow_offer(record: ArchivedRecord) -> FlowOffer:
+    data = decode_payload(record.payload)
+    flow = Flow.objects.filter(
+        campaign__keitaro_id=record.campaign_keitaro_id,
+        keitaro_id=data['flow_keitaro_id'],
+    ).first()
+    if flow is None:
+        raise ArchiveRestoreException(
+            f'Поток {data["flow_keitaro_id"]} кампании {record.campaign_keitaro_id} не найден: '
+            f'сначала восстановите кампанию'
+        )
+    offer = _get_offer(data['offer'])
+    if FlowOffer.objects.filter(flow=flow, offer=offer).exists():
+        raise ArchiveRestoreException(f'Оффер {offer.keitaro_id} уже есть в потоке {flow.keitaro_id}')
+
+    # Оффер возвращается отключённым, срок хранения отсчитывается заново
+    flow_offer = FlowOffer.objects.create(
+        flow=flow,
+        offer=offer,
+        share=0,
+        is_pinned=data['is_pinned'],
+        state='disabled',
+        keitaro_offer_stream_id=data['keitaro_offer_stream_id'],
+        disabled_at=timezone.now(),
+    )
+    adjust_flow_counters(flow, total=1)
+    refresh_flow_snapshots(Flow.objects.filter(pk=flow.pk))
+    bump_flow_versions(Flow.objects.filter(pk=flow.pk))
+    return flow_offer
+
+
+@transaction.atomic
+def restore(record: ArchivedRecord):
+    """
+    Возврат архивной записи в рабочие таблицы (запись удаляется из архива)
+
+    Args:
+        record: Архивная запись
+
+    Returns:
+        Восстановленная кампания или оффер потока
+
+    Raises:
+        ArchiveRestoreException: Если строка уже есть в рабочих таблицах или её поток не найден
+    """
+    if record.kind == 'campaign':
+        restored = _restore_campaign(record)
+    else:
+        restored = _restore_flow_offer(record)
+    record.delete()
+    return restored
+
+
+@transaction.atomic
+def restore_campaign(keitaro_id: int) -> int:
+    """
+    Восстановление кампании и её отдельно архивированных офферов потоков
+
+    Args:
+        keitaro_id: ID кампании в Keitaro
+
+    Returns:
+        Количество восстановленных записей
+
+    Raises:
+        ArchiveRestoreException: Если записей нет или восстановление невозможно
+    """
+    records = list(ArchivedRecord.objects.filter(campaign_keitaro_id=keitaro_id).order_by('kind', 'pk'))
+    if not records:
+        raise ArchiveRestoreException(f'В архиве нет записей кампании {keitaro_id}')
+    # 'campaign' < 'flow_offer': потоки появляются раньше, чем в них возвращаются офферы
+    for record in records:
+        restore(record)
+    return len(records)
+
+
+def _table_sizes(tables: Iterable[str]) -> Dict[str, int]:
+    """Размер таблиц с индексами в байтах (PostgreSQL, SQLite с dbstat; иначе пусто)"""
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT pg_total_relation_size(%s)'
+    elif connection.vendor == 'sqlite':
+        sql = 'SELECT SUM(pgsize) FROM dbstat WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name = %s)'
+    else:
+        return {}
+    sizes = {}
+    try:
+        with connection.cursor() as cursor:
+            for table in tables:
+                cursor.execute(sql, [table])
+                sizes[table] = cursor.fetchone()[0] or 0
+    except DatabaseError:
+        # SQLite без модуля dbstat
+        return {}
+    return sizes
+
+
+def report(days: Optional[int] = None) -> Dict:
+    """
+    Отчёт о размере рабочих таблиц и архива
+
+    Args:
+        days: Срок хранения в днях (по умолчанию ARCHIVE_RETENTION_DAYS)
+
+    Returns:
+        Словарь: строки рабочих таблиц (всего, помеченных, старше срока), записи
+        и объём архива по типам, размер таблиц в байтах
+    """
+    cutoff = retention_cutoff(days)
+    campaigns = Campaign.objects.aggregate(total=Count('pk'), removed=Count('pk', filter=Q(state='deleted')))
+    campaigns['expired'] = expired_campaigns(cutoff).count()
+    flow_offers = FlowOffer.objects.aggregate(total=Count('pk'), removed=Count('pk', filter=Q(state='disabled')))
+    flow_offers['expired'] = expired_flow_offers(cutoff).count()
+
+    archived: Dict[str, Dict[str, int]] = {
+        kind: {'records': 0, 'payload_bytes': 0} for kind, _ in ArchivedRecord.KIND_CHOICES
+    }
+    rows = ArchivedRecord.objects.order_by().values('kind').annotate(
+        records=Count('pk'), payload_bytes=Sum(Length('payload')),
+    )
+    for row in rows:
+        archived[row['kind']] = {'records': row['records'], 'payload_bytes': row['payload_bytes'] or 0}
+
+    return {
+        'retention_days': settings.ARCHIVE_RETENTION_DAYS if days is None else days,
+        'campaigns': campaigns,
+        'flow_offers': flow_offers,
+        'archive': archived,
+        'table_bytes': _table_sizes(REPORT_TABLES),
+    }
@@ -0,0 +1,254 @@
+"""
+Асинхронный клиент Keitaro API (httpx) для async views
+"""
+import asyncio
+import json
+import ssl
+from functools import lru_cache
+from typing import Any, Dict, Optional
+import certifi
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from config.exceptions import (KeitaroAPIException, KeitaroAuthException, KeitaroConnectionException,
+                               KeitaroRequestNotSentException)
+from .base_client import BaseKeitaroClient
+from .cache import LRUResponseCache, cache_ttl, get_response_cache, read_tags, write_tags
+from .rate_limit import get_bucket
+from .resilience import endpoint_class, get_timeout
+from .singleflight import async_flight_group, flight_group
+from .tracing import KeitaroCall, tracer
+
+
+@lru_cache(maxsize=None)
+def _ssl_context() -> ssl.SSLContext:
+    """
+    SSL контекст процесса (те же корневые сертификаты, что у requests)
+
+    Загрузка сертификатов занимает ~15 мс CPU, а клиент создаётся на каждый запрос.
+    """
+    return ssl.create_default_context(cafile=certifi.where())
+
+
+class AsyncKeitaroClient(BaseKeitaroClient):
+    """
+    Асинхронный клиент Keitaro API
+
+    Ожидание ответа Keitaro не занимает поток: один ASGI воркер обслуживает
+    много одновременных медленных вызовов. Политики те же, что у KeitaroClient:
+    таймауты по классу endpoint, повторы GET, circuit breaker, общий rate limit,
+    кэш ответов, объединение одинаковых GET и трассировка.
+
+    Методы API - те же, что у KeitaroClient (общая база BaseKeitaroClient), но
+    возвращают корутины. Потокового чтения (iter_*) нет. Клиент держит пул
+    соединений httpx, поэтому используется как async context manager:
+
+        async with AsyncKeitaroClient(url, api_key) as client:
+            stream = await client.get_stream(5)
+    """
+
+    def __init__(self, base_url: str, api_key: str):
+        """
+        Инициализация клиента
+
+        Args:
+            base_url: URL Keitaro инстанса
+            api_key: API ключ для аутентификации
+        """
+        super().__init__(base_url, api_key)
+        self.session = httpx.AsyncClient(headers=self.headers, verify=_ssl_context())
+
+    async def __aenter__(self) -> 'AsyncKeitaroClient':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        """Закрытие соединений клиента"""
+        await self.session.aclose()
+
+    @staticmethod
+    async def _cache_call(cache, name: str, *args) -> Any:
+        """
+        Вызов метода кэша ответов
+
+        In-memory кэш вызывается напрямую, остальные бэкенды (Django cache:
+        БД, Redis) - через sync_to_async, чтобы не блокировать event loop.
+        """
+        method = getattr(cache, name)
+        if isinstance(cache, LRUResponseCache):
+            return method(*args)
+        return await sync_to_async(method, thread_sensitive=False)(*args)
+
+    async def _make_request(self, method: str, endpoint: str, **kwargs) -> Any:
+        """
+        Выполнение HTTP запроса к API (кэш, объединение GET, инвалидация после записи)
+
+        Args:
+            method: HTTP метод (GET, POST, PUT, DELETE)
+            endpoint: API endpoint (без /admin_api/v1)
+            **kwargs: Дополнительные параметры для httpx (params, json)
+
+        Returns:
+            JSON ответ от API
+
+        Raises:
+            KeitaroAPIException: При ошибках API
+        """
+        url = self._url(endpoint)
+        cache = get_response_cache()
+        ttl = cache_ttl(method, endpoint) if cache else 0
+
+        if ttl:
+            key = self._cache_key(method, endpoint, **kwargs)
+            content = await self._cache_call(cache, 'get', key)
+            if content is None:
+                content = await self._fetch(method, endpoint, url, **kwargs)
+                await self._cache_call(cache, 'set', key, content, ttl, read_tags(endpoint))
+        else:
+            content = await self._fetch(method, endpoint, url, **kwargs)
+
+        if self._is_write(method, endpoint):
+            flight_group.forget()
+            if cache:
+                await self._cache_call(cache, 'invalidate', *write_tags(method, endpoint, kwargs.get('json')))
+
+        # Некоторые endpoints возвращают пустой ответ
+        if not content:
+            return {}
+
+        return json.loads(content)
+
+    async def _fetch(self, method: str, endpoint: str, url: str, **kwargs) -> bytes:
+        """
+        Получение тела ответа с объединением одинаковых параллельных GET запросов
+
+        Returns:
+            Тело ответа (bytes)
+        """
+        if method.upper() != 'GET' or not getattr(settings, 'KEITARO_SINGLEFLIGHT', True):
+            return await self._request_content(method, endpoint, url, **kwargs)
+
+        return await async_flight_group.do(
+            self._flight_key(url, kwargs.get('params')),
+            lambda: self._request_content(method, endpoint, url, **kwargs),
+        )
+
+    async def _request_content(self, method: str, endpoint: str, url: str, **kwargs) -> bytes:
+        """
+        HTTP вызов с трассировкой (статус, размер, время, повторы, ID запроса)
+
+        Returns:
+            Тело ответа (bytes)
+        """
+        with tracer.trace(method, endpoint) as call:
+            response = await self._perform_request(method, endpoint, url, call=call, **kwargs)
+            call.bytes = len(response.content)
+            return response.content
+
+    async def invalidate_cache(self, *endpoints: str):
+        """
+        Сброс кэша ответов для endpoints (например, перед явной синхронизацией)
+
+        Args:
+            *endpoints: Endpoints или их шаблоны ('campaigns/5/streams', 'offers')
+        """
+        flight_group.forget()
+        cache = get_response_cache()
+        if cache:
+            await self._cache_call(cache, 'invalidate', *(endpoint.strip('/') for endpoint in endpoints))
+
+    @staticmethod
+    def coalescing_stats() -> Dict:
+        """Счётчики объединения GET запросов async клиента (по процессу)"""
+        return async_flight_group.stats()
+
+    async def _perform_request(self, method: str, endpoint: str, url: str, call: Optional[KeitaroCall] = None,
+                               **kwargs) -> httpx.Response:
+        """
+        Выполнение запроса с таймаутами, повторами и circuit breaker
+
+        Те же правила, что у KeitaroClient._perform_request; ожидание токена
+        rate limit и пауза между повторами не блокируют event loop.
+
+        Args:
+            call: Трассируемый вызов: в него записываются статус и число повторов
+
+        Returns:
+            Ответ httpx
+
+        Raises:
+            KeitaroAPIException: При ошибках API
+            KeitaroCircuitOpenException: Если Keitaro временно считается недоступным
+            KeitaroRateLimitException: Если лимит запросов исчерпан
+        """
+        cls = endpoint_class(method, endpoint)
+        connect_timeout, read_timeout = get_timeout(cls)
+        timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        bucket = get_bucket(self.base_url, cls)
+        attempts = self.retry_policy.attempts_for(method)
+
+        for attempt in range(attempts):
+            if bucket:
+                await bucket.aacquire()
+            self.breaker.before_request()
+            if call:
+                call.retries = attempt
+            try:
+                response = await self._send(method, url, timeout, **kwargs)
+                if call:
+                    call.status = response.status_code
+                self._check_status(response, endpoint)
+            except KeitaroConnectionException:
+                self.breaker.record_failure()
+                if attempt + 1 >= attempts:
+                    raise
+                await asyncio.sleep(self.retry_policy.delay(attempt))
+                continue
+            except KeitaroAPIException:
+                # Keitaro ответил (4xx) - сервис доступен
+                self.breaker.record_success()
+                raise
+
+            self.breaker.record_success()
+            return response
+
+    async def _send(self, method: str, url: str, timeout: httpx.Timeout, **kwargs) -> httpx.Response:
+        """
+        Отправка одного HTTP запроса
+
+        Raises:
+            KeitaroRequestNotSentException: Соединение не установлено (запрос не отправлен)
+            KeitaroConnectionException: При таймауте ответа или обрыве соединения
+        """
+        try:
+            return await self.session.request(method=method, url=url, timeout=timeout, **kwargs)
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+            raise KeitaroRequestNotSentException('Не удалось подключиться к Keitaro')
+        except httpx.TimeoutException:
+            raise KeitaroConnectionException('Превышено время ожидания ответа от Keitaro')
+        except httpx.TransportError:
+            raise KeitaroConnectionException('Соединение с Keitaro прервано')
+        except httpx.HTTPError as e:
+            raise KeitaroConnectionException(f'Ошибка при запросе к Keitaro: {str(e)}')
+
+    async def validate_api_key(self) -> bool:
+        """
+        Проверка валидности API ключа
+
+        Returns:
+            True если ключ валиден, False иначе
+
+        Raises:
+            KeitaroConnectionException: Если сервис Keitaro недоступен
+        """
+        try:
+            await self.get_campaigns(limit=1)
+            return True
+        except KeitaroAuthException:
+            return False
+        except KeitaroConnectionException:
+            raise
+        except KeitaroAPIException:
+            raise KeitaroConnectionException('Не удалось проверить API ключ из-за ошибки сервиса')
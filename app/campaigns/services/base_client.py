@@ -0,0 +1,290 @@
+"""
+Общая часть синхронного и асинхронного клиентов Keitaro API
+
+Построение URL и тел запросов, область кэша (API ключ), ключи кэша и объединения
+запросов, circuit breaker, политика повторов и разбор HTTP статусов не зависят
+от того, как отправляется запрос (requests или httpx).
+"""
+import abc
+import hashlib
+from typing import Any, Dict, List, Tuple
+from config.exceptions import KeitaroAPIException, KeitaroAuthException, KeitaroConnectionException
+from .cache import CACHEABLE_POSTS, cache_key, get_response_cache
+from .resilience import RetryPolicy, endpoint_template, get_breaker
+from .tracing import tracer
+
+
+class BaseKeitaroClient(abc.ABC):
+    """
+    База клиентов Keitaro API
+
+    Методы API формируют запрос и возвращают результат self._make_request: у
+    KeitaroClient это данные ответа, у AsyncKeitaroClient - корутина, которую
+    нужно дождаться. Отправку запроса реализуют наследники.
+    """
+
+    def __init__(self, base_url: str, api_key: str):
+        """
+        Инициализация клиента
+
+        Args:
+            base_url: URL Keitaro инстанса
+            api_key: API ключ для аутентификации
+        """
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.api_base = f"{self.base_url}/admin_api/v1"
+        self.headers = {
+            'Api-Key': self.api_key,
+            'Content-Type': 'application/json',
+        }
+        self.retry_policy = RetryPolicy()
+        self.breaker = get_breaker(self.base_url)
+        # Область видимости данных: разные ключи могут видеть разные объекты
+        self.scope = hashlib.sha256(self.api_key.encode()).hexdigest()[:16]
+
+    @abc.abstractmethod
+    def _make_request(self, method: str, endpoint: str, **kwargs) -> Any:
+        """
+        Выполнение HTTP запроса к API
+
+        Args:
+            method: HTTP метод (GET, POST, PUT, DELETE)
+            endpoint: API endpoint (без /admin_api/v1)
+            **kwargs: Параметры запроса (params, json)
+
+        Returns:
+            JSON ответ от API (у асинхронного клиента - корутина)
+        """
+
+    def _url(self, endpoint: str) -> str:
+        """Полный URL endpoint"""
+        return f"{self.api_base}/{endpoint.lstrip('/')}"
+
+    def _cache_key(self, method: str, endpoint: str, **kwargs) -> str:
+        """Ключ кэша ответов для запроса в области API ключа клиента"""
+        return cache_key(self.scope, method, endpoint, kwargs.get('params'), kwargs.get('json'))
+
+    def _flight_key(self, url: str, params: Dict = None) -> Tuple:
+        """Ключ объединения одинаковых GET запросов: URL, параметры и область API ключа"""
+        return url, tuple(sorted((k, repr(v)) for k, v in (params or {}).items())), self.scope
+
+    @staticmethod
+    def _is_write(method: str, endpoint: str) -> bool:
+        """Запрос меняет данные Keitaro (после него сбрасываются кэш и микро-кэш)"""
+        return method.upper() != 'GET' and endpoint_template(endpoint) not in CACHEABLE_POSTS
+
+    def _check_status(self, response, endpoint: str):
+        """
+        Обработка ошибок по HTTP статусу ответа (requests или httpx)
+
+        Raises:
+            KeitaroAuthException: 401
+            KeitaroConnectionException: 5xx
+            KeitaroAPIException: Остальные 4xx
+        """
+        if response.status_code == 401:
+            raise KeitaroAuthException('Неверный API ключ или доступ запрещён')
+        elif response.status_code == 404:
+            raise KeitaroAPIException(f'Ресурс не найден: {endpoint}')
+        elif response.status_code >= 500:
+            raise KeitaroConnectionException(f'Ошибка сервера Keitaro: {response.status_code}')
+        elif response.status_code >= 400:
+            raise KeitaroAPIException(f'Ошибка запроса: {response.status_code} - {response.text}')
+
+    @property
+    def is_available(self) -> bool:
+        """
+        Доступен ли Keitaro по мнению circuit breaker
+
+        Views используют это, чтобы сразу отдать локальные данные,
+        не дожидаясь таймаута.
+        """
+        return self.breaker.allows_requests()
+
+    @staticmethod
+    def cache_stats() -> Dict:
+        """Счётчики кэша ответов процесса (пустой dict, если кэш отключён)"""
+        cache = get_response_cache()
+        return cache.stats() if cache else {}
+
+    @staticmethod
+    def trace_stats() -> Dict:
+        """Гистограммы задержек вызовов Keitaro по endpoint (по процессу)"""
+        return tracer.stats()
+
+    @staticmethod
+    def _page_params(offset: int = 0, limit: int = 100) -> Dict:
+        """Параметры пагинации списка (нулевые значения не передаются)"""
+        params = {}
+        if offset:
+            params['offset'] = offset
+        if limit:
+            params['limit'] = limit
+        return params
+
+    def get_campaigns(self, offset: int = 0, limit: int = 100) -> List[Dict]:
+        """
+        Получение списка кампаний
+
+        Args:
+            offset: Смещение для пагинации
+            limit: Количество записей
+
+        Returns:
+            Список кампаний
+        """
+        return self._make_request('GET', 'campaigns', params=self._page_params(offset, limit))
+
+    def get_campaign(self, campaign_id: int) -> Dict:
+        """
+        Получение деталей кампании
+
+        Args:
+            campaign_id: ID кампании в Keitaro
+
+        Returns:
+            Данные кампании
+        """
+        return self._make_request('GET', f'campaigns/{campaign_id}')
+
+    def get_offer(self, offer_id: int) -> Dict:
+        """
+        Получение деталей оффера
+
+        Args:
+            offer_id: ID оффера в Keitaro
+
+        Returns:
+            Данные оффера
+        """
+        return self._make_request('GET', f'offers/{offer_id}')
+
+    def get_offers(self) -> List[Dict]:
+        """
+        Получение списка всех офферов
+
+        Returns:
+            Список офферов
+        """
+        return self._make_request('GET', 'offers')
+
+    def get_streams(self, campaign_id: int) -> List[Dict]:
+        """
+        Получение потоков (streams) кампании
+
+        Args:
+            campaign_id: ID кампании в Keitaro
+
+        Returns:
+            Список потоков с офферами
+        """
+        return self._make_request('GET', f'campaigns/{campaign_id}/streams')
+
+    def get_stream(self, stream_id: int) -> Dict:
+        """
+        Получение деталей потока
+
+        Args:
+            stream_id: ID потока в Keitaro
+
+        Returns:
+            Данные потока
+        """
+        return self._make_request('GET', f'streams/{stream_id}')
+
+    def update_stream(self, stream_id: int, data: Dict) -> Dict:
+        """
+        Обновление потока (включая offers)
+
+        Args:
+            stream_id: ID потока в Keitaro
+            data: Данные для обновления
+
+        Returns:
+            Обновлённые данные потока
+        """
+        return self._make_request('PUT', f'streams/{stream_id}', json=data)
+
+    def create_campaign(self, name: str, alias: str = None) -> Dict:
+        """
+        Создание кампании в Keitaro
+
+        Args:
+            name: Название кампании
+            alias: Алиас кампании (если не указан, генерируется из названия)
+
+        Returns:
+            Данные созданной кампании
+        """
+        if not alias:
+            # Генерируем alias из названия (латиница, нижний регистр, без пробелов)
+            alias = ''.join(c.lower() if c.isalnum() else '_' for c in name)[:50]
+
+        data = {
+            'name': name,
+            'alias': alias,
+            'state': 'active',
+            'type': 'position'
+        }
+
+        return self._make_request('POST', 'campaigns', json=data)
+
+    def create_stream(self, campaign_id: int, name: str, action_type: str,
+                      schema: str = 'redirect', stream_type: str = 'regular',
+                      action_payload: str = '', action_options: Dict = None,
+                      filters: List[Dict] = None, offers: List[Dict] = None,
+                      position: int = 0) -> Dict:
+        """
+        Создание потока в Keitaro
+
+        Args:
+            campaign_id: ID кампании
+            name: Название потока
+            action_type: Тип действия ('http', 'campaign', и т.д.)
+            schema: Схема потока ('redirect', 'landings')
+            stream_type: Тип потока ('regular', 'forced', 'default')
+            action_payload: Payload действия (обычно пустая строка для redirect)
+            action_options: Опции действия (например, {"url": "https://google.com"})
+            filters: Список фильтров (для гео-таргетинга и т.д.)
+            offers: Список офферов (для schema='landings')
+            position: Позиция потока
+
+        Returns:
+            Данные созданного потока
+        """
+        data = {
+            'campaign_id': campaign_id,
+            'name': name,
+            'type': stream_type,
+            'schema': schema,
+            'action_type': action_type,
+            'action_payload': action_payload,
+            'state': 'active',
+            'position': position,
+            'collect_clicks': True,
+            'filter_or': False
+        }
+
+        if action_options:
+            data['action_options'] = action_options
+
+        if filters:
+            data['filters'] = filters
+
+        if offers:
+            data['offers'] = offers
+
+        return self._make_request('POST', 'streams', json=data)
+
+    def get_report(self, params: Dict) -> Dict:
+        """
+        Построение отчёта (для статистики)
+
+        Args:
+            params: Параметры отчёта (columns, metrics, filters, range)
+
+        Returns:
+            Данные отчёта
+        """
+        return self._make_request('POST', 'report/build', json=params)
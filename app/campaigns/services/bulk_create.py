@@ -0,0 +1,398 @@
+"""
+Массовое создание кампаний из CSV
+
+Строка CSV - название кампании, гео-коды и ID оффера. Сначала проверяется весь файл
+(формат, дубли названий, доступность офферов - недостающие загружаются по ID), и только
+потом начинается создание в Keitaro: кампании создаются параллельно (не больше concurrency строк
+одновременно), каждый вызов строки повторяется при ошибке подключения. Повтор не создаёт
+дубликат: если запрос мог дойти до Keitaro (таймаут ответа, 5xx), перед повтором кампания
+или поток ищутся в Keitaro, и найденный объект используется вместо нового. Локальные строки
+Campaign вставляются одним bulk_create в конце. Используется view массового создания и командой bulk_create_campaigns.
+"""
+import asyncio
+import csv
+import io
+import re
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from ..models import Campaign
+from .async_client import AsyncKeitaroClient
+from .resilience import RetryPolicy
+from .sync_service import KeitaroSyncService
+from config.exceptions import (KeitaroAPIException, KeitaroCircuitOpenException, KeitaroConnectionException,
+                               KeitaroRequestNotSentException)
+
+CSV_COLUMNS = ('name', 'geo_codes', 'offer_id')
+GEO_CODE_RE = re.compile(r'^[A-Z]{2}$')
+NAME_MAX_LENGTH = Campaign._meta.get_field('name').max_length
+INSERT_BATCH_SIZE = 500
+# Размер страницы списка кампаний при поиске кампании по названию
+LOOKUP_PAGE_SIZE = 100
+
+
+def parse_geo_codes(value: str) -> List[str]:
+    """Гео-коды из строки (через запятую, точку с запятой или пробел) в верхнем регистре"""
+    return [code.upper() for code in re.split(r'[,;\s]+', value or '') if code]
+
+
+def campaign_streams(campaign_id: int, geo_codes: List[str], offer_id: int) -> List[Dict]:
+    """
+    Параметры create_stream для потоков новой кампании
+
+    Первый поток отправляет трафик указанных стран на Google, второй (forced)
+    отправляет весь остальной трафик на оффер со share 100.
+
+    Args:
+        campaign_id: ID кампании в Keitaro
+        geo_codes: Гео-коды стран
+        offer_id: ID оффера в Keitaro
+
+    Returns:
+        Список kwargs для AsyncKeitaroClient.create_stream (позиции заданы явно)
+    """
+    # Название первого потока: "US, GB, DE +2 → Google" (первые 3 кода для краткости)
+    geo_title = ', '.join(geo_codes[:3])
+    if len(geo_codes) > 3:
+        geo_title += f' +{len(geo_codes) - 3}'
+
+    return [{
+        # Гео-таргетинг на указанные страны, редирект на Google.
+        # Фильтр использует name='country' (не 'country_code')
+        'campaign_id': campaign_id,
+        'name': f'{geo_title} → Google',
+        'action_type': 'http',
+        'schema': 'redirect',
+        'stream_type': 'regular',
+        'action_payload': '',  # Пустая строка для redirect
+        'action_options': {'url': 'https://www.google.com'},  # URL в action_options
+        'filters': [{'name': 'country', 'mode': 'accept', 'payload': geo_codes}],
+        'position': 0,
+    }, {
+        # Редирект на оффер: schema='landings', action_type='campaign', type='forced'
+        'campaign_id': campaign_id,
+        'name': 'All → Offers',
+        'action_type': 'campaign',
+        'schema': 'landings',
+        'stream_type': 'forced',
+        'action_payload': '',
+        'action_options': None,
+        'filters': [],  # Без фильтров - ловит всех
+        'offers': [{'offer_id': offer_id, 'share': 100, 'state': 'active'}],
+        'position': 1,
+    }]
+
+
+@dataclass
+class BulkRow:
+    """Строка CSV и её исход"""
+    line: int
+    name: str
+    geo_codes: List[str]
+    offer_id: Optional[int]
+    # invalid - не прошла проверку, pending - ждёт создания, created - создана, failed - ошибка Keitaro
+    status: str = 'pending'
+    errors: List[str] = field(default_factory=list)
+    keitaro_id: Optional[int] = None
+    campaign_id: Optional[int] = None
+    attempts: int = 0
+    campaign_data: Dict = field(default_factory=dict, repr=False)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'line': self.line,
+            'name': self.name,
+            'geo_codes': self.geo_codes,
+            'offer_id': self.offer_id,
+            'status': self.status,
+            'errors': self.errors,
+            'keitaro_id': self.keitaro_id,
+            'campaign_id': self.campaign_id,
+            'attempts': self.attempts,
+        }
+
+
+def summarize(rows: Iterable[BulkRow]) -> Dict[str, int]:
+    """Количество строк по статусам"""
+    summary = {'created': 0, 'failed': 0, 'invalid': 0, 'skipped': 0}
+    for row in rows:
+        summary[row.status] = summary.get(row.status, 0) + 1
+    return summary
+
+
+class BulkCampaignCreator:
+    """Конвейер массового создания кампаний: разбор и проверка CSV, создание в Keitaro, вставка в БД"""
+
+    def __init__(self, user, concurrency: Optional[int] = None, retries: Optional[int] = None):
+        """
+        Args:
+            user: Пользователь (его API ключ и видимые ему офферы)
+            concurrency: Строк, создаваемых одновременно (по умолчанию BULK_CREATE_CONCURRENCY)
+            retries: Повторов вызова Keitaro при ошибке подключения (по умолчанию BULK_CREATE_RETRIES)
+        """
+        self.user = user
+        self.concurrency = max(1, concurrency or settings.BULK_CREATE_CONCURRENCY)
+        self.retries = max(0, retries if retries is not None else settings.BULK_CREATE_RETRIES)
+        self.retry_policy = RetryPolicy()
+
+    @staticmethod
+    def parse(text: str) -> List[BulkRow]:
+        """
+        Разбор CSV и проверка формата строк (без обращения к БД и Keitaro)
+
+        Args:
+            text: Содержимое CSV с заголовком name,geo_codes,offer_id
+
+        Returns:
+            Строки; ошибки формата записаны в errors со статусом invalid
+
+        Raises:
+            ValueError: Нет нужных колонок, нет строк или их больше BULK_CREATE_MAX_ROWS
+        """
+        reader = csv.DictReader(io.StringIO(text.lstrip('\ufeff')))
+        header = [column.strip().lower() for column in reader.fieldnames or []]
+        missing = [column for column in CSV_COLUMNS if column not in header]
+        if missing:
+            raise ValueError(f'В CSV нет колонок: {", ".join(missing)}')
+        reader.fieldnames = header
+
+        rows: List[BulkRow] = []
+        seen_names: Dict[str, int] = {}
+        for values in reader:
+            if not any((values[column] or '').strip() for column in CSV_COLUMNS):
+                continue  # Пустые строки пропускаются
+            if len(rows) >= settings.BULK_CREATE_MAX_ROWS:
+                raise ValueError(f'Не больше {settings.BULK_CREATE_MAX_ROWS} строк за один раз')
+
+            name = (values['name'] or '').strip()
+            offer_id = (values['offer_id'] or '').strip()
+            row = BulkRow(
+                line=reader.line_num,
+                name=name,
+                geo_codes=parse_geo_codes(values['geo_codes']),
+                offer_id=int(offer_id) if offer_id.isdigit() else None,
+            )
+
+            if not name:
+                row.errors.append('Не указано название кампании')
+            elif len(name) > NAME_MAX_LENGTH:
+                row.errors.append(f'Название длиннее {NAME_MAX_LENGTH} символов')
+            elif name in seen_names:
+                row.errors.append(f'Название повторяет строку {seen_names[name]}')
+            else:
+                seen_names[name] = row.line
+
+            if not row.geo_codes:
+                row.errors.append('Укажите хотя бы один гео-код страны')
+            invalid_codes = [code for code in row.geo_codes if not GEO_CODE_RE.match(code)]
+            if invalid_codes:
+                row.errors.append(f'Некорректные гео-коды: {", ".join(invalid_codes)}')
+
+            if row.offer_id is None:
+                row.errors.append('ID оффера должен быть целым числом')
+
+            if row.errors:
+                row.status = 'invalid'
+            rows.append(row)
+
+        if not rows:
+            raise ValueError('В CSV нет строк')
+        return rows
+
+    async def validate_offers(self, rows: List[BulkRow], client: AsyncKeitaroClient):
+        """
+        Проверка, что офферы строк доступны пользователю
+
+        Офферы, которых нет в локальном каталоге, загружаются по ID (ensure_offers)
+        одним проходом на весь файл, а не на каждую строку.
+
+        Args:
+            rows: Строки после parse
+            client: Открытый асинхронный клиент
+
+        Raises:
+            KeitaroConnectionException: Keitaro недоступен
+        """
+        # Проверяются и строки с ошибками формата: в ответе сразу все ошибки строки
+        offer_ids = {row.offer_id for row in rows if row.offer_id is not None}
+        if not offer_ids:
+            return
+
+        missing = set(await KeitaroSyncService(self.user).aensure_offers(offer_ids, client))
+        for row in rows:
+            if row.offer_id in missing:
+                row.errors.append(f'Оффер {row.offer_id} не найден')
+                row.status = 'invalid'
+
+    async def run(self, rows: List[BulkRow], client: AsyncKeitaroClient) -> List[BulkRow]:
+        """
+        Создание проверенных строк в Keitaro и вставка кампаний в локальную БД
+
+        Args:
+            rows: Строки после parse и validate_offers (создаются только строки pending)
+            client: Открытый асинхронный клиент
+
+        Returns:
+            Те же строки с исходом (status, errors, keitaro_id, campaign_id, attempts)
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def create(row: BulkRow):
+            async with semaphore:
+                await self._create_row(row, client)
+
+        await asyncio.gather(*(create(row) for row in rows if row.status == 'pending'))
+        await sync_to_async(self._insert_campaigns)(rows)
+        return rows
+
+    async def _create_row(self, row: BulkRow, client: AsyncKeitaroClient):
+        """Кампания и её потоки в Keitaro; ошибка записывается в строку, а не поднимается"""
+        try:
+            row.campaign_data = await self._with_retry(
+                row, lambda: client.create_campaign(row.name), lambda: self._find_campaign(client, row.name),
+            )
+            row.keitaro_id = row.campaign_data['id']
+        except KeitaroAPIException as e:
+            row.status = 'failed'
+            row.errors.append(f'Ошибка Keitaro API: {str(e)}')
+            return
+
+        # Потоки независимы (позиции заданы явно) - создаём их параллельно; каждый повторяется отдельно,
+        # поэтому уже созданный поток не дублируется при повторе соседнего
+        results = await asyncio.gather(*(
+            self._with_retry(
+                row,
+                lambda params=params: client.create_stream(**params),
+                lambda params=params: self._find_stream(client, params),
+            )
+            for params in campaign_streams(row.keitaro_id, row.geo_codes, row.offer_id)
+        ), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            # Кампания уже есть в Keitaro: она сохраняется локально, чтобы её можно было найти и удалить
+            row.status = 'failed'
+            row.errors.extend(f'Поток не создан: {str(error)}' for error in errors)
+            return
+
+        row.status = 'created'
+
+    async def _with_retry(self, row: BulkRow, call: Callable[[], Awaitable[Any]],
+                          lookup: Callable[[], Awaitable[Optional[Dict]]]) -> Any:
+        """
+        Создание объекта в Keitaro с повторами при ошибке подключения
+
+        POST запросы клиент сам не повторяет. Повторяется только шаг, который не удался.
+        Если соединение не было установлено, запрос не дошёл до Keitaro и повторяется сразу.
+        После таймаута ответа или 5xx объект мог быть создан: перед повтором он ищется
+        через lookup, и найденный объект возвращается вместо создания дубликата. При открытом
+        circuit breaker повторять бессмысленно - ошибка возвращается сразу.
+
+        Args:
+            row: Строка (в ней считаются попытки)
+            call: Создание объекта
+            lookup: Поиск объекта, созданного неудачной попыткой (None - не найден)
+
+        Returns:
+            Данные созданного или найденного объекта
+        """
+        for attempt in range(self.retries + 1):
+            row.attempts += 1
+            try:
+                return await call()
+            except KeitaroCircuitOpenException:
+                raise
+            except KeitaroRequestNotSentException:
+                if attempt >= self.retries:
+                    raise
+            except KeitaroConnectionException:
+                existing = await lookup()
+                if existing is not None:
+                    return existing
+                if attempt >= self.retries:
+                    raise
+            await asyncio.sleep(self.retry_policy.delay(attempt))
+
+    @staticmethod
+    async def _find_campaign(client: AsyncKeitaroClient, name: str) -> Optional[Dict]:
+        """
+        Кампания Keitaro с названием name, которой ещё нет в локальной БД
+
+        Кампании с тем же названием, уже известные локально, созданы не этим запросом.
+        Список читается постранично, мимо кэша ответов.
+        """
+        known = {
+            keitaro_id async for keitaro_id in Campaign.objects.filter(name=name).values_list('keitaro_id', flat=True)
+        }
+        await client.invalidate_cache('campaigns')
+        offset = 0
+        while True:
+            page = await client.get_campaigns(offset=offset, limit=LOOKUP_PAGE_SIZE)
+            for campaign_data in page:
+                if campaign_data.get('name') == name and campaign_data.get('id') not in known:
+                    return campaign_data
+            if len(page) < LOOKUP_PAGE_SIZE:
+                return None
+            offset += LOOKUP_PAGE_SIZE
+
+    @staticmethod
+    async def _find_stream(client: AsyncKeitaroClient, params: Dict) -> Optional[Dict]:
+        """Поток кампании с названием и позицией из параметров create_stream"""
+        campaign_id = params['campaign_id']
+        await client.invalidate_cache(f'campaigns/{campaign_id}/streams')
+        for stream_data in await client.get_streams(campaign_id):
+            if (stream_data.get('name'), stream_data.get('position')) == (params['name'], params['position']):
+                return stream_data
+        return None
+
+    @staticmethod
+    def _insert_campaigns(rows: List[BulkRow]):
+        """Вставка созданных в Keitaro кампаний одним bulk_create"""
+        created = [row for row in rows if row.keitaro_id is not None]
+        if not created:
+            return
+
+        # ignore_conflicts: параллельная синхронизация могла уже сохранить кампанию
+        Campaign.objects.bulk_create([
+            Campaign(
+                keitaro_id=row.keitaro_id,
+                name=row.campaign_data.get('name', row.name),
+                alias=row.campaign_data.get('alias', ''),
+                state=row.campaign_data.get('state', 'active'),
+            ) for row in created
+        ], batch_size=INSERT_BATCH_SIZE, ignore_conflicts=True)
+
+        # С ignore_conflicts bulk_create не возвращает ID - читаем их одним запросом
+        ids = dict(Campaign.objects.filter(keitaro_id__in=[row.keitaro_id for row in created])
+                   .values_list('keitaro_id', 'pk'))
+        for row in created:
+            row.campaign_id = ids.get(row.keitaro_id)
+
+    async def create_from_csv(self, text: str, skip_invalid: bool = False) -> List[BulkRow]:
+        """
+        Полный конвейер: разбор, проверка и создание
+
+        Если есть строки с ошибками и skip_invalid не задан, в Keitaro ничего не создаётся,
+        а строки возвращаются с ошибками проверки; остальные строки получают статус skipped.
+
+        Args:
+            text: Содержимое CSV
+            skip_invalid: Создать корректные строки, пропустив строки с ошибками
+
+        Returns:
+            Строки с исходом
+
+        Raises:
+            ValueError: Ошибка формата файла (см. parse)
+            KeitaroConnectionException: Keitaro недоступен при проверке офферов
+        """
+        rows = self.parse(text)
+        async with AsyncKeitaroClient(settings.KEITARO_URL, self.user.api_key) as client:
+            await self.validate_offers(rows, client)
+            if not skip_invalid and any(row.status == 'invalid' for row in rows):
+                for row in rows:
+                    if row.status == 'pending':
+                        row.status = 'skipped'
+                return rows
+            return await self.run(rows, client)
+
@@ -0,0 +1,286 @@
+"""
+Кэш ответов Keitaro API с TTL по endpoint и инвалидацией по тегам
+"""
+import abc
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from django.conf import settings
+from django.utils.module_loading import import_string
+from config import metrics
+from .resilience import endpoint_template
+
+# POST запросы, которые только читают данные и могут кэшироваться
+CACHEABLE_POSTS = {'report/build'}
+
+
+def cache_ttl(method: str, endpoint: str) -> float:
+    """
+    TTL кэша для запроса
+
+    Args:
+        method: HTTP метод
+        endpoint: API endpoint (без /admin_api/v1)
+
+    Returns:
+        TTL в секундах (0 - запрос не кэшируется)
+    """
+    template = endpoint_template(endpoint)
+    if method.upper() != 'GET' and template not in CACHEABLE_POSTS:
+        return 0
+    return getattr(settings, 'KEITARO_CACHE_TTLS', {}).get(template, 0)
+
+
+def cache_key(scope: str, method: str, endpoint: str, params: Dict = None, payload: Any = None) -> str:
+    """Ключ кэша: область API ключа, метод, endpoint, параметры и тело запроса"""
+    raw = json.dumps([scope, method.upper(), endpoint.strip('/'), params or {}, payload],
+                     sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def read_tags(endpoint: str) -> List[str]:
+    """
+    Теги записи кэша для чтения endpoint
+
+    Конкретный ресурс ('campaigns/5/streams') и его шаблон ('campaigns/{id}/streams'),
+    чтобы можно было сбросить как одну запись, так и все записи вида.
+    """
+    endpoint = endpoint.strip('/')
+    template = endpoint_template(endpoint)
+    return [endpoint] if endpoint == template else [endpoint, template]
+
+
+def write_tags(method: str, endpoint: str, payload: Any = None) -> List[str]:
+    """
+    Теги, которые нужно сбросить после записи
+
+    Args:
+        method: HTTP метод запроса на запись
+        endpoint: API endpoint (без /admin_api/v1)
+        payload: Тело запроса
+
+    Returns:
+        Список тегов для инвалидации
+    """
+    endpoint = endpoint.strip('/')
+    template = endpoint_template(endpoint)
+    payload = payload if isinstance(payload, dict) else {}
+
+    if template == 'streams':
+        # Новый поток меняет список потоков своей кампании
+        campaign_id = payload.get('campaign_id')
+        return [f'campaigns/{campaign_id}/streams'] if campaign_id else ['campaigns/{id}/streams']
+    if template == 'streams/{id}':
+        # Кампания потока неизвестна - сбрасываем списки потоков всех кампаний
+        return [endpoint, 'campaigns/{id}/streams']
+    if template.startswith('campaigns'):
+        return ['campaigns', endpoint]
+    if template.startswith('offers'):
+        return ['offers', endpoint]
+    return [endpoint]
+
+
+class BaseResponseCache(abc.ABC):
+    """Интерфейс кэша ответов Keitaro"""
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _count(self, hit: bool):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.keitaro_cache_requests.inc(result='hit' if hit else 'miss')
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """Тело ответа по ключу или None"""
+
+    @abc.abstractmethod
+    def set(self, key: str, content: bytes, ttl: float, tags: Iterable[str]):
+        """Сохранение тела ответа с TTL и тегами"""
+
+    @abc.abstractmethod
+    def invalidate(self, *tags: str):
+        """Удаление всех записей с любым из тегов"""
+
+    @abc.abstractmethod
+    def clear(self):
+        """Полная очистка"""
+
+    def stats(self) -> Dict:
+        """Счётчики попаданий и промахов"""
+        with self._stats_lock:
+            hits, misses, invalidations = self.hits, self.misses, self.invalidations
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'invalidations': invalidations,
+            'hit_ratio': round(hits / total, 4) if total else 0.0,
+        }
+
+
+class LRUResponseCache(BaseResponseCache):
+    """
+    LRU кэш в памяти процесса с ограничением по суммарному размеру тел ответов
+
+    Хранятся сырые тела ответов (bytes): их размер точно учитывается в лимите,
+    а каждое попадание возвращает свежие объекты после json.loads.
+
+    Кэш свой у каждого воркера: сброс по тегам после записи действует только в воркере,
+    который её выполнил, в остальных записи живут до истечения TTL. Для нескольких
+    воркеров нужен DjangoResponseCache поверх общего кэша (Redis, Memcached, БД).
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, max_entry_bytes: int = None,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            max_bytes: Лимит суммарного размера тел ответов
+            max_entry_bytes: Лимит одной записи (по умолчанию четверть общего)
+            clock: Источник монотонного времени для TTL (в тестах - управляемые часы)
+        """
+        super().__init__()
+        self._clock = clock
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 4
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[str, Tuple[float, bytes, frozenset]]' = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+
+    def _drop(self, key: str):
+        _, content, _ = self._entries.pop(key)
+        self._bytes -= len(content)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] <= self._clock():
+                self._drop(key)
+                entry = None
+            if entry:
+                self._entries.move_to_end(key)
+        self._count(entry is not None)
+        return entry[1] if entry else None
+
+    def set(self, key: str, content: bytes, ttl: float, tags: Iterable[str]):
+        if len(content) > self.max_entry_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (self._clock() + ttl, content, frozenset(tags))
+            self._bytes += len(content)
+            while self._bytes > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, *tags: str):
+        tags = set(tags)
+        with self._lock:
+            for key in [k for k, (_, _, entry_tags) in self._entries.items() if entry_tags & tags]:
+                self._drop(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        result = super().stats()
+        with self._lock:
+            result.update({
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+            })
+        return result
+
+
+class DjangoResponseCache(BaseResponseCache):
+    """
+    Кэш поверх django.core.cache (например, общий Redis для всех воркеров)
+
+    Инвалидация по тегам реализована версиями: запись хранит версии своих тегов
+    на момент сохранения и считается устаревшей, если хотя бы одна версия изменилась.
+    """
+
+    def __init__(self, alias: str = 'default', prefix: str = 'keitaro', max_bytes: int = None):
+        """
+        Args:
+            alias: Алиас кэша из settings.CACHES
+            prefix: Префикс ключей
+            max_bytes: Не используется: лимит памяти задаётся настройками самого кэша Django
+        """
+        super().__init__()
+        from django.core.cache import caches
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    def _tag_key(self, tag: str) -> str:
+        return f'{self.prefix}:tag:{hashlib.sha1(tag.encode()).hexdigest()}'
+
+    def _versions(self, tags: Iterable[str]) -> Dict[str, int]:
+        keys = {tag: self._tag_key(tag) for tag in tags}
+        stored = self.cache.get_many(list(keys.values()))
+        return {tag: stored.get(key, 0) for tag, key in keys.items()}
+
+    def get(self, key: str) -> Optional[bytes]:
+        entry = self.cache.get(f'{self.prefix}:{key}')
+        if entry is not None and self._versions(entry['tags']) != entry['tags']:
+            entry = None
+        self._count(entry is not None)
+        return entry['content'] if entry else None
+
+    def set(self, key: str, content: bytes, ttl: float, tags: Iterable[str]):
+        self.cache.set(f'{self.prefix}:{key}', {
+            'content': content,
+            'tags': self._versions(tags),
+        }, timeout=ttl)
+
+    def invalidate(self, *tags: str):
+        for tag in tags:
+            key = self._tag_key(tag)
+            self.cache.add(key, 0, timeout=None)
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                self.cache.set(key, 1, timeout=None)
+        with self._stats_lock:
+            self.invalidations += len(tags)
+
+    def clear(self):
+        self.cache.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[BaseResponseCache]:
+    """
+    Кэш ответов процесса, созданный по settings.KEITARO_RESPONSE_CACHE
+
+    Returns:
+        Объект кэша или None, если кэш отключён
+    """
+    global _cache
+    config = getattr(settings, 'KEITARO_RESPONSE_CACHE', None)
+    if not config or not config.get('BACKEND'):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+        return _cache
@@ -1,12 +1,24 @@
 """
 Клиент для работы с Keitaro API
 """
+import json
+import time
 import requests
-from typing import Dict, List, Any
-from config.exceptions import KeitaroAPIException, KeitaroAuthException, KeitaroConnectionException
+from django.conf import settings
+from typing import Dict, Iterator, Any, Optional
+from urllib3.exceptions import ConnectTimeoutError
+from config.exceptions import (KeitaroAPIException, KeitaroAuthException, KeitaroConnectionException,
+                               KeitaroRequestNotSentException)
+from .base_client import BaseKeitaroClient
+from .cache import cache_ttl, get_response_cache, read_tags, write_tags
+from .json_stream import iter_json_array
+from .rate_limit import get_bucket
+from .resilience import endpoint_class, get_timeout
+from .singleflight import flight_group
+from .tracing import KeitaroCall, tracer
 
 
-class KeitaroClient:
+class KeitaroClient(BaseKeitaroClient):
     """Клиент для работы с Keitaro API"""
     
     def __init__(self, base_url: str, api_key: str):
@@ -17,18 +29,20 @@ class KeitaroClient:
             base_url: URL Keitaro инстанса
             api_key: API ключ для аутентификации
         """
-        self.base_url = base_url.rstrip('/')
-        self.api_key = api_key
-        self.api_base = f"{self.base_url}/admin_api/v1"
-        self.headers = {
-            'Api-Key': self.api_key,
-            'Content-Type': 'application/json',
-        }
+        super().__init__(base_url, api_key)
+        # Сессия переиспользует TCP/TLS соединения между запросами клиента
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
     
     def _make_request(self, method: str, endpoint: str, **kwargs) -> Any:
         """
         Выполнение HTTP запроса к API
         
+        Чтения с настроенным TTL отдаются из кэша ответов. Одинаковые параллельные
+        GET запросы (URL, параметры, API ключ) внутри процесса объединяются в один
+        HTTP вызов. Запросы на запись сбрасывают затронутые записи кэша и микро-кэш,
+        чтобы следующее чтение увидело изменения.
+        
         Args:
             method: HTTP метод (GET, POST, PUT, DELETE)
             endpoint: API endpoint (без /admin_api/v1)
@@ -40,213 +54,215 @@ class KeitaroClient:
         Raises:
             KeitaroAPIException: При ошибках API
         """
-        url = f"{self.api_base}/{endpoint.lstrip('/')}"
-        
-        try:
-            response = requests.request(
-                method=method,
-                url=url,
-                headers=self.headers,
-                timeout=30,
-                **kwargs
-            )
-            
-            # Обработка ошибок
-            if response.status_code == 401:
-                raise KeitaroAuthException('Неверный API ключ или доступ запрещён')
-            elif response.status_code == 404:
-                raise KeitaroAPIException(f'Ресурс не найден: {endpoint}')
-            elif response.status_code >= 500:
-                raise KeitaroConnectionException(f'Ошибка сервера Keitaro: {response.status_code}')
-            elif response.status_code >= 400:
-                raise KeitaroAPIException(f'Ошибка запроса: {response.status_code} - {response.text}')
-            
-            response.raise_for_status()
-            
-            # Некоторые endpoints возвращают пустой ответ
-            if not response.content:
-                return {}
-            
-            return response.json()
-            
-        except requests.exceptions.Timeout:
-            raise KeitaroConnectionException('Превышено время ожидания ответа от Keitaro')
-        except requests.exceptions.ConnectionError:
-            raise KeitaroConnectionException('Не удалось подключиться к Keitaro')
-        except requests.exceptions.RequestException as e:
-            raise KeitaroConnectionException(f'Ошибка при запросе к Keitaro: {str(e)}')
+        url = self._url(endpoint)
+        cache = get_response_cache()
+        ttl = cache_ttl(method, endpoint) if cache else 0
+        
+        if ttl:
+            key = self._cache_key(method, endpoint, **kwargs)
+            content = cache.get(key)
+            if content is None:
+                content = self._fetch(method, endpoint, url, **kwargs)
+                cache.set(key, content, ttl, read_tags(endpoint))
+        else:
+            content = self._fetch(method, endpoint, url, **kwargs)
+        
+        if self._is_write(method, endpoint):
+            flight_group.forget()
+            if cache:
+                cache.invalidate(*write_tags(method, endpoint, kwargs.get('json')))
+        
+        # Некоторые endpoints возвращают пустой ответ
+        if not content:
+            return {}
+        
+        return json.loads(content)
     
-    def get_campaigns(self, offset: int = 0, limit: int = 100) -> List[Dict]:
+    def _fetch(self, method: str, endpoint: str, url: str, **kwargs) -> bytes:
         """
-        Получение списка кампаний
-        
-        Args:
-            offset: Смещение для пагинации
-            limit: Количество записей
+        Получение тела ответа с объединением одинаковых параллельных GET запросов
         
         Returns:
-            Список кампаний
+            Тело ответа (bytes)
         """
-        params = {}
-        if offset:
-            params['offset'] = offset
-        if limit:
-            params['limit'] = limit
-        
-        return self._make_request('GET', 'campaigns', params=params)
+        if method.upper() != 'GET' or not getattr(settings, 'KEITARO_SINGLEFLIGHT', True):
+            return self._request_content(method, endpoint, url, **kwargs)
+        
+        return flight_group.do(
+            self._flight_key(url, kwargs.get('params')),
+            lambda: self._request_content(method, endpoint, url, **kwargs),
+            ttl=getattr(settings, 'KEITARO_MICROCACHE_TTL', 0),
+        )
     
-    def get_campaign(self, campaign_id: int) -> Dict:
+    def _request_content(self, method: str, endpoint: str, url: str, **kwargs) -> bytes:
         """
-        Получение деталей кампании
-        
-        Args:
-            campaign_id: ID кампании в Keitaro
+        HTTP вызов с трассировкой (статус, размер, время, повторы, ID запроса)
         
         Returns:
-            Данные кампании
+            Тело ответа (bytes)
         """
-        return self._make_request('GET', f'campaigns/{campaign_id}')
+        with tracer.trace(method, endpoint) as call:
+            response = self._perform_request(method, endpoint, url, call=call, **kwargs)
+            call.bytes = len(response.content)
+            return response.content
     
-    def get_offer(self, offer_id: int) -> Dict:
+    def invalidate_cache(self, *endpoints: str):
         """
-        Получение деталей оффера
+        Сброс кэша ответов для endpoints (например, перед явной синхронизацией)
         
         Args:
-            offer_id: ID оффера в Keitaro
-        
-        Returns:
-            Данные оффера
+            *endpoints: Endpoints или их шаблоны ('campaigns/5/streams', 'offers')
         """
-        return self._make_request('GET', f'offers/{offer_id}')
+        flight_group.forget()
+        cache = get_response_cache()
+        if cache:
+            cache.invalidate(*(endpoint.strip('/') for endpoint in endpoints))
     
-    def get_streams(self, campaign_id: int) -> List[Dict]:
+    def _perform_request(self, method: str, endpoint: str, url: str, call: Optional[KeitaroCall] = None,
+                         **kwargs) -> requests.Response:
         """
-        Получение потоков (streams) кампании
+        Выполнение запроса с таймаутами, повторами и circuit breaker
         
-        Args:
-            campaign_id: ID кампании в Keitaro
-        
-        Returns:
-            Список потоков с офферами
-        """
-        return self._make_request('GET', f'campaigns/{campaign_id}/streams')
-    
-    def get_stream(self, stream_id: int) -> Dict:
-        """
-        Получение деталей потока
+        Таймауты подключения и чтения зависят от класса endpoint. Идемпотентные
+        запросы (GET) повторяются с экспоненциальной задержкой при таймаутах,
+        ошибках соединения и 5xx. Пока circuit breaker открыт, запрос сразу
+        завершается ошибкой без обращения к Keitaro. Каждая попытка расходует
+        токен из общего для всех воркеров лимита запросов.
         
         Args:
-            stream_id: ID потока в Keitaro
+            call: Трассируемый вызов: в него записываются статус и число повторов
         
         Returns:
-            Данные потока
-        """
-        return self._make_request('GET', f'streams/{stream_id}')
-    
-    def update_stream(self, stream_id: int, data: Dict) -> Dict:
-        """
-        Обновление потока (включая offers)
-        
-        Args:
-            stream_id: ID потока в Keitaro
-            data: Данные для обновления
+            Ответ requests (с stream=True тело ещё не прочитано)
         
-        Returns:
-            Обновлённые данные потока
+        Raises:
+            KeitaroAPIException: При ошибках API
+            KeitaroCircuitOpenException: Если Keitaro временно считается недоступным
+            KeitaroRateLimitException: Если лимит запросов исчерпан
         """
-        return self._make_request('PUT', f'streams/{stream_id}', json=data)
+        cls = endpoint_class(method, endpoint)
+        timeout = get_timeout(cls)
+        bucket = get_bucket(self.base_url, cls)
+        attempts = self.retry_policy.attempts_for(method)
+        
+        for attempt in range(attempts):
+            if bucket:
+                bucket.acquire()
+            self.breaker.before_request()
+            if call:
+                call.retries = attempt
+            try:
+                response = self._send(method, url, timeout, **kwargs)
+                if call:
+                    call.status = response.status_code
+                self._check_status(response, endpoint)
+            except KeitaroConnectionException:
+                self.breaker.record_failure()
+                if attempt + 1 >= attempts:
+                    raise
+                time.sleep(self.retry_policy.delay(attempt))
+                continue
+            except KeitaroAPIException:
+                # Keitaro ответил (4xx) - сервис доступен
+                self.breaker.record_success()
+                raise
+            
+            self.breaker.record_success()
+            return response
     
-    def create_campaign(self, name: str, alias: str = None) -> Dict:
+    def _stream_items(self, endpoint: str, **kwargs) -> Iterator[Dict]:
         """
-        Создание кампании в Keitaro
+        Потоковое чтение списка: элементы JSON массива разбираются по мере загрузки
+        
+        Кэш ответов и объединение запросов не используются: большой ответ
+        не должен целиком оказаться в памяти.
         
         Args:
-            name: Название кампании
-            alias: Алиас кампании (если не указан, генерируется из названия)
+            endpoint: API endpoint (без /admin_api/v1)
+            **kwargs: Дополнительные параметры для requests
         
-        Returns:
-            Данные созданной кампании
-        """
-        if not alias:
-            # Генерируем alias из названия (латиница, нижний регистр, без пробелов)
-            alias = ''.join(c.lower() if c.isalnum() else '_' for c in name)[:50]
+        Yields:
+            Элементы списка
         
-        data = {
-            'name': name,
-            'alias': alias,
-            'state': 'active',
-            'type': 'position'
-        }
+        Raises:
+            KeitaroAPIException: При ошибках API или некорректном JSON
+            KeitaroConnectionException: При обрыве соединения во время загрузки
+        """
+        url = self._url(endpoint)
+        chunk_size = getattr(settings, 'KEITARO_STREAM_CHUNK_BYTES', 64 * 1024)
         
-        return self._make_request('POST', 'campaigns', json=data)
+        with tracer.trace('GET', endpoint, streamed=True) as call:
+            response = self._perform_request('GET', endpoint, url, call=call, stream=True, **kwargs)
+            
+            def chunks() -> Iterator[bytes]:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    call.bytes += len(chunk)
+                    yield chunk
+            
+            try:
+                yield from iter_json_array(chunks())
+            except ValueError as e:
+                raise KeitaroAPIException(f'Некорректный ответ Keitaro: {endpoint}: {str(e)}')
+            except requests.exceptions.RequestException:
+                self.breaker.record_failure()
+                raise KeitaroConnectionException('Соединение с Keitaro прервано во время загрузки')
+            finally:
+                response.close()
     
-    def create_stream(self, campaign_id: int, name: str, action_type: str, 
-                     schema: str = 'redirect', stream_type: str = 'regular',
-                     action_payload: str = '', action_options: Dict = None,
-                     filters: List[Dict] = None, offers: List[Dict] = None,
-                     position: int = 0) -> Dict:
+    def _send(self, method: str, url: str, timeout, **kwargs) -> requests.Response:
         """
-        Создание потока в Keitaro
-        
-        Args:
-            campaign_id: ID кампании
-            name: Название потока
-            action_type: Тип действия ('http', 'campaign', и т.д.)
-            schema: Схема потока ('redirect', 'landings')
-            stream_type: Тип потока ('regular', 'forced', 'default')
-            action_payload: Payload действия (обычно пустая строка для redirect)
-            action_options: Опции действия (например, {"url": "https://google.com"})
-            filters: Список фильтров (для гео-таргетинга и т.д.)
-            offers: Список офферов (для schema='landings')
-            position: Позиция потока
+        Отправка одного HTTP запроса
         
-        Returns:
-            Данные созданного потока
+        Raises:
+            KeitaroRequestNotSentException: Соединение не установлено (запрос не отправлен)
+            KeitaroConnectionException: При таймауте ответа или обрыве соединения
         """
-        data = {
-            'campaign_id': campaign_id,
-            'name': name,
-            'type': stream_type,
-            'schema': schema,
-            'action_type': action_type,
-            'action_payload': action_payload,
-            'state': 'active',
-            'position': position,
-            'collect_clicks': True,
-            'filter_or': False
-        }
-        
-        if action_options:
-            data['action_options'] = action_options
-        
-        if filters:
-            data['filters'] = filters
-        
-        if offers:
-            data['offers'] = offers
-        
-        return self._make_request('POST', 'streams', json=data)
+        try:
+            return self.session.request(
+                method=method,
+                url=url,
+                timeout=timeout,
+                **kwargs
+            )
+        except requests.exceptions.ConnectTimeout:
+            raise KeitaroRequestNotSentException('Превышено время подключения к Keitaro')
+        except requests.exceptions.Timeout:
+            raise KeitaroConnectionException('Превышено время ожидания ответа от Keitaro')
+        except requests.exceptions.ConnectionError as e:
+            # Отказ в соединении, ошибка DNS: requests оборачивает их в MaxRetryError(reason=...)
+            reason = getattr(e.args[0], 'reason', None) if e.args else None
+            if isinstance(reason, ConnectTimeoutError):
+                raise KeitaroRequestNotSentException('Не удалось подключиться к Keitaro')
+            raise KeitaroConnectionException('Соединение с Keitaro прервано')
+        except requests.exceptions.RequestException as e:
+            raise KeitaroConnectionException(f'Ошибка при запросе к Keitaro: {str(e)}')
+    
+    @staticmethod
+    def coalescing_stats() -> Dict:
+        """Счётчики объединения GET запросов и микро-кэша (по процессу)"""
+        return flight_group.stats()
     
-    def get_offers(self) -> List[Dict]:
+    def iter_offers(self) -> Iterator[Dict]:
         """
-        Получение списка всех офферов
+        Потоковое получение всех офферов (по одному, без загрузки всего списка в память)
         
-        Returns:
-            Список офферов
+        Yields:
+            Данные оффера
         """
-        return self._make_request('GET', 'offers')
+        return self._stream_items('offers')
     
-    def get_report(self, params: Dict) -> Dict:
+    def iter_campaigns(self, offset: int = 0, limit: int = 100) -> Iterator[Dict]:
         """
-        Построение отчёта (для статистики)
+        Потоковое получение списка кампаний
         
         Args:
-            params: Параметры отчёта (columns, metrics, filters, range)
+            offset: Смещение для пагинации
+            limit: Количество записей
         
-        Returns:
-            Данные отчёта
+        Yields:
+            Данные кампании
         """
-        return self._make_request('POST', 'report/build', json=params)
+        return self._stream_items('campaigns', params=self._page_params(offset, limit))
     
     def validate_api_key(self) -> bool:
         """
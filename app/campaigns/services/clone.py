@@ -0,0 +1,203 @@
+"""
+Клонирование кампании
+
+Копия создаётся в Keitaro с потоками исходной кампании (фильтры, действие, офферы со
+своими share), при необходимости - с другими гео-кодами. Потоки создаются параллельно
+(не больше CLONE_STREAM_CONCURRENCY одновременно) сразу с офферами, без отдельного
+добавления каждого оффера. Локальные Campaign, Flow и FlowOffer вставляются bulk_create
+в одной транзакции, счётчики и снимки офферов заполняются там же.
+"""
+import asyncio
+from typing import Dict, List, Optional, Set, Tuple
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from ..models import Campaign, Flow, FlowOffer, Offer, OfferVisibility, keitaro_instance
+from .async_client import AsyncKeitaroClient
+from .snapshots import refresh_flow_snapshots
+from .sync_service import KeitaroSyncService
+from config.exceptions import CampaignCloneException, KeitaroAPIException
+
+# Поля фильтра потока, которые передаются при создании (id и stream_id у копии свои)
+FILTER_FIELDS = ('name', 'mode', 'payload')
+
+
+def clone_stream_params(stream_data: Dict, campaign_id: int, geo_codes: Optional[List[str]] = None) -> Dict:
+    """
+    Параметры create_stream для копии потока
+
+    Args:
+        stream_data: Поток исходной кампании из Keitaro
+        campaign_id: ID новой кампании в Keitaro
+        geo_codes: Гео-коды для фильтров 'country' (по умолчанию - как у исходного потока)
+
+    Returns:
+        kwargs для AsyncKeitaroClient.create_stream
+    """
+    filters = []
+    for filter_data in stream_data.get('filters') or []:
+        filter_data = {key: filter_data[key] for key in FILTER_FIELDS if key in filter_data}
+        if geo_codes and filter_data.get('name') == 'country':
+            filter_data['payload'] = geo_codes
+        filters.append(filter_data)
+
+    return {
+        'campaign_id': campaign_id,
+        'name': stream_data.get('name', ''),
+        'action_type': stream_data.get('action_type', 'campaign'),
+        'schema': stream_data.get('schema', 'landings'),
+        'stream_type': stream_data.get('type', 'regular'),
+        'action_payload': stream_data.get('action_payload') or '',
+        'action_options': stream_data.get('action_options') or None,
+        'filters': filters,
+        'offers': [{
+            'offer_id': offer_data['offer_id'],
+            'share': offer_data.get('share', 0),
+            'state': offer_data.get('state', 'active'),
+        } for offer_data in stream_data.get('offers') or [] if offer_data.get('offer_id')],
+        'position': stream_data.get('position', 0),
+    }
+
+
+async def clone_campaign(user, source: Campaign, name: str, client: AsyncKeitaroClient,
+                         geo_codes: Optional[List[str]] = None) -> Campaign:
+    """
+    Создание копии кампании в Keitaro и в локальной БД
+
+    Потоки и офферы копируются в том виде, в каком они сохранены в Keitaro
+    (неотправленные локальные изменения не копируются); закрепления офферов
+    переносятся из локальных данных исходной кампании.
+
+    Args:
+        user: Пользователь (его офферы и API ключ клиента)
+        source: Исходная кампания
+        name: Название копии
+        client: Открытый асинхронный клиент
+        geo_codes: Гео-коды для фильтров 'country' потоков (по умолчанию - как у исходной кампании)
+
+    Returns:
+        Новая кампания
+
+    Raises:
+        KeitaroAPIException: Не удалось загрузить потоки или создать кампанию
+        CampaignCloneException: Кампания создана, но часть потоков не создана
+            (созданные потоки сохранены локально)
+    """
+    await client.invalidate_cache(f'campaigns/{source.keitaro_id}/streams')
+    streams_data = await client.get_streams(source.keitaro_id)
+
+    campaign_data = await client.create_campaign(name)
+    semaphore = asyncio.Semaphore(settings.CLONE_STREAM_CONCURRENCY)
+
+    async def create(stream_data: Dict) -> Dict:
+        async with semaphore:
+            return await client.create_stream(**clone_stream_params(stream_data, campaign_data['id'], geo_codes))
+
+    results = await asyncio.gather(*(create(stream_data) for stream_data in streams_data), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    for error in errors:
+        if not isinstance(error, KeitaroAPIException):
+            raise error
+    # Пары (исходный поток, созданный поток): gather сохраняет порядок
+    created = [(stream_data, result) for stream_data, result in zip(streams_data, results)
+               if not isinstance(result, BaseException)]
+
+    # Офферы копии - те же, что у исходной кампании: недостающие в каталоге загружаются по ID
+    offer_ids = {
+        offer_data['offer_id'] for _, stream_data in created for offer_data in stream_data.get('offers') or []
+    }
+    try:
+        await KeitaroSyncService(user).aensure_offers(offer_ids, client)
+    except KeitaroAPIException:
+        pass  # Офферы без данных сохранятся с названием "Offer N"
+
+    campaign = await sync_to_async(_save_clone)(user, source, name, campaign_data, created)
+    if errors:
+        raise CampaignCloneException(
+            f'Кампания "{campaign.name}" (ID {campaign.keitaro_id}) создана, но не созданы потоки: '
+            f'{len(errors)} из {len(streams_data)} ({str(errors[0])})'
+        )
+    return campaign
+
+
+def _pinned_offers(source: Campaign) -> Set[Tuple[int, int]]:
+    """Закреплённые офферы исходной кампании: пары (keitaro_id потока, keitaro_id оффера)"""
+    return set(FlowOffer.objects.filter(flow__campaign=source, is_pinned=True)
+               .values_list('flow__keitaro_id', 'offer__keitaro_id'))
+
+
+def _catalog_offers(user, offer_ids: Set[int]) -> Dict[int, int]:
+    """
+    ID строк каталога по ID офферов в Keitaro
+
+    Офферы, которых Keitaro не отдал, сохраняются заглушками (как при синхронизации потоков).
+    """
+    instance = keitaro_instance()
+    offers = dict(Offer.objects.filter(instance=instance, keitaro_id__in=offer_ids).values_list('keitaro_id', 'pk'))
+    missing = offer_ids - set(offers)
+    if missing:
+        Offer.objects.bulk_create([
+            Offer(instance=instance, keitaro_id=offer_id, name=f'Offer {offer_id}', state='active')
+            for offer_id in missing
+        ], ignore_conflicts=True)
+        offers.update(Offer.objects.filter(instance=instance, keitaro_id__in=missing).values_list('keitaro_id', 'pk'))
+        # Оффер из потока пользователя доступен ему, даже если его нет в списке офферов
+        OfferVisibility.objects.bulk_create([
+            OfferVisibility(user=user, offer_id=offers[offer_id], synced_at=timezone.now()) for offer_id in missing
+        ], ignore_conflicts=True)
+    return offers
+
+
+@transaction.atomic
+def _save_clone(user, source: Campaign, name: str, campaign_data: Dict, created: List[Tuple[Dict, Dict]]) -> Campaign:
+    """
+    Вставка копии кампании с потоками и офферами потоков (bulk_create, одна транзакция)
+
+    Args:
+        created: Пары (исходный поток, созданный поток) из Keitaro
+    """
+    pinned = _pinned_offers(source)
+    offers = _catalog_offers(user, {
+        offer_data['offer_id'] for _, stream_data in created for offer_data in stream_data.get('offers') or []
+    })
+
+    campaign = Campaign.objects.create(
+        keitaro_id=campaign_data['id'],
+        name=campaign_data.get('name', name),
+        alias=campaign_data.get('alias', ''),
+        state=campaign_data.get('state', 'active'),
+        type=campaign_data.get('type', 'position'),
+        flows_count=len(created),
+    )
+
+    flows = Flow.objects.bulk_create([Flow(
+        keitaro_id=stream_data['id'],
+        campaign=campaign,
+        name=stream_data.get('name', ''),
+        type=stream_data.get('type', 'offers'),
+        position=stream_data.get('position', 0),
+        state=stream_data.get('state', 'active'),
+        active_offers_count=sum(1 for o in stream_data.get('offers') or [] if o.get('state', 'active') == 'active'),
+        total_offers_count=len(stream_data.get('offers') or []),
+    ) for _, stream_data in created])
+
+    now = timezone.now()
+    flow_offers = []
+    for flow, (source_stream, stream_data) in zip(flows, created):
+        for offer_data in stream_data.get('offers') or []:
+            state = offer_data.get('state', 'active')
+            flow_offers.append(FlowOffer(
+                flow=flow,
+                offer_id=offers[offer_data['offer_id']],
+                share=offer_data.get('share', 0),
+                state=state,
+                disabled_at=now if state == 'disabled' else None,
+                is_pinned=(source_stream['id'], offer_data['offer_id']) in pinned,
+                keitaro_offer_stream_id=offer_data.get('id'),
+            ))
+    FlowOffer.objects.bulk_create(flow_offers)
+
+    # Снимки офферов строятся по вставленным строкам (нужны их ID); версии новых потоков - по умолчанию
+    refresh_flow_snapshots(campaign.flows.all())
+    return campaign
@@ -0,0 +1,104 @@
+"""
+Денормализованные счётчики: потоки кампании и офферы потока
+
+Campaign.flows_count, Flow.active_offers_count и Flow.total_offers_count хранятся в
+таблицах, чтобы список и карточка кампании не считали агрегаты при каждом показе.
+Счётчики обновляются в той же транзакции, что и изменение потоков и офферов:
+точечные изменения - приращением (F), синхронизация - пересчётом одним UPDATE.
+Расхождения находит и исправляет команда recount.
+"""
+from typing import Dict
+from django.db.models import Count, F, OuterRef, Q, QuerySet, Subquery, Value
+from django.db.models.functions import Coalesce
+from ..models import Campaign, Flow, FlowOffer
+from .json_stream import chunked
+
+RECOUNT_BATCH_SIZE = 500
+
+
+def _count(queryset: QuerySet, field: str) -> Coalesce:
+    """Коррелированный подзапрос COUNT(*) по внешнему ключу field (0, если строк нет)"""
+    counted = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(count=Count('pk'))
+    return Coalesce(Subquery(counted.values('count')), Value(0))
+
+
+def refresh_flow_counters(flows: QuerySet) -> int:
+    """
+    Пересчёт счётчиков офферов потоков одним UPDATE
+
+    Args:
+        flows: QuerySet потоков
+
+    Returns:
+        Количество обновлённых потоков
+    """
+    return flows.update(
+        active_offers_count=_count(FlowOffer.objects.filter(state='active'), 'flow'),
+        total_offers_count=_count(FlowOffer.objects.all(), 'flow'),
+    )
+
+
+def refresh_campaign_counters(campaigns: QuerySet) -> int:
+    """
+    Пересчёт количества потоков кампаний одним UPDATE
+
+    Args:
+        campaigns: QuerySet кампаний
+
+    Returns:
+        Количество обновлённых кампаний
+    """
+    return campaigns.update(flows_count=_count(Flow.objects.all(), 'campaign'))
+
+
+def adjust_flow_counters(flow: Flow, active: int = 0, total: int = 0):
+    """
+    Приращение счётчиков офферов потока (без чтения: UPDATE ... SET count = count + n)
+
+    Значения в объекте flow тоже обновляются, чтобы их можно было вернуть в ответе.
+
+    Args:
+        flow: Поток
+        active: Изменение числа активных офферов
+        total: Изменение общего числа офферов
+    """
+    Flow.objects.filter(pk=flow.pk).update(
+        active_offers_count=F('active_offers_count') + active,
+        total_offers_count=F('total_offers_count') + total,
+    )
+    flow.active_offers_count += active
+    flow.total_offers_count += total
+
+
+def stale_flows() -> QuerySet:
+    """Потоки, у которых счётчики офферов расходятся с фактическими"""
+    return Flow.objects.annotate(
+        actual_active=Count('flow_offers', filter=Q(flow_offers__state='active')),
+        actual_total=Count('flow_offers'),
+    ).exclude(active_offers_count=F('actual_active'), total_offers_count=F('actual_total'))
+
+
+def stale_campaigns() -> QuerySet:
+    """Кампании, у которых счётчик потоков расходится с фактическим"""
+    return Campaign.objects.annotate(actual_flows=Count('flows')).exclude(flows_count=F('actual_flows'))
+
+
+def recount(fix: bool = True) -> Dict[str, int]:
+    """
+    Сверка денормализованных счётчиков с фактическими данными
+
+    Args:
+        fix: Исправить найденные расхождения
+
+    Returns:
+        Количество кампаний и потоков с расхождениями
+    """
+    flow_ids = list(stale_flows().values_list('pk', flat=True))
+    campaign_ids = list(stale_campaigns().values_list('pk', flat=True))
+    if fix:
+        # Пачками: число параметров запроса ограничено (SQLite)
+        for chunk in chunked(flow_ids, RECOUNT_BATCH_SIZE):
+            refresh_flow_counters(Flow.objects.filter(pk__in=chunk))
+        for chunk in chunked(campaign_ids, RECOUNT_BATCH_SIZE):
+            refresh_campaign_counters(Campaign.objects.filter(pk__in=chunk))
+    return {'campaigns': len(campaign_ids), 'flows': len(flow_ids)}
@@ -0,0 +1,163 @@
+"""
+Потоковая выгрузка кампаний, потоков и распределения share в CSV и NDJSON
+
+Строки читаются курсором на стороне сервера (QuerySet.iterator(chunk_size)) и сразу
+превращаются в текст пачками по chunk_size строк, поэтому память не зависит от объёма
+выгрузки. Используется view выгрузки (StreamingHttpResponse) и командой export.
+"""
+import csv
+import json
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import QuerySet
+from ..models import Campaign, Flow, FlowOffer
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+
+class ExportDataset:
+    """Набор выгрузки: колонки и запрос строк (values_list в порядке колонок)"""
+
+    def __init__(self, columns: Dict[str, str], queryset: Callable[[bool], QuerySet]):
+        self.columns = columns
+        self.queryset = queryset
+
+    def rows(self, include_deleted: bool = False, using: Optional[str] = None) -> QuerySet:
+        """QuerySet строк выгрузки (кортежи в порядке колонок)"""
+        queryset = self.queryset(include_deleted).values_list(*self.columns.values())
+        return queryset.using(using) if using else queryset
+
+
+def _campaigns(include_deleted: bool) -> QuerySet:
+    campaigns = Campaign.objects.all() if include_deleted else Campaign.objects.exclude(state='deleted')
+    return campaigns.order_by('pk')
+
+
+def _flows(include_deleted: bool) -> QuerySet:
+    flows = Flow.objects.all() if include_deleted else Flow.objects.exclude(campaign__state='deleted')
+    # Порядок unique индекса (campaign, keitaro_id): курсор отдаёт строки без сортировки всей таблицы
+    return flows.order_by('campaign_id', 'keitaro_id')
+
+
+def _shares(include_deleted: bool) -> QuerySet:
+    flow_offers = FlowOffer.objects.all()
+    if not include_deleted:
+        flow_offers = flow_offers.exclude(flow__campaign__state='deleted')
+    # Порядок unique индекса (flow, offer)
+    return flow_offers.order_by('flow_id', 'offer_id')
+
+
+DATASETS = {
+    'campaigns': ExportDataset({
+        'id': 'pk',
+        'keitaro_id': 'keitaro_id',
+        'name': 'name',
+        'alias': 'alias',
+        'state': 'state',
+        'type': 'type',
+        'flows_count': 'flows_count',
+        'created_at': 'created_at',
+        'synced_at': 'synced_at',
+    }, _campaigns),
+    'flows': ExportDataset({
+        'campaign_keitaro_id': 'campaign__keitaro_id',
+        'campaign_name': 'campaign__name',
+        'flow_keitaro_id': 'keitaro_id',
+        'name': 'name',
+        'type': 'type',
+        'position': 'position',
+        'state': 'state',
+        'active_offers_count': 'active_offers_count',
+        'total_offers_count': 'total_offers_count',
+    }, _flows),
+    'shares': ExportDataset({
+        'campaign_keitaro_id': 'flow__campaign__keitaro_id',
+        'campaign_name': 'flow__campaign__name',
+        'flow_keitaro_id': 'flow__keitaro_id',
+        'flow_name': 'flow__name',
+        'offer_keitaro_id': 'offer__keitaro_id',
+        'offer_name': 'offer__name',
+        'share': 'share',
+        'is_pinned': 'is_pinned',
+        'state': 'state',
+    }, _shares),
+}
+
+
+class _LineBuffer:
+    """Файлоподобный объект для csv.writer: возвращает записанную строку вместо буферизации"""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def _value(value: Any) -> Any:
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def _csv_lines(columns: Sequence[str], rows: Iterable[tuple]) -> Iterator[str]:
+    writer = csv.writer(_LineBuffer())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([_value(value) for value in row])
+
+
+def _ndjson_lines(columns: Sequence[str], rows: Iterable[tuple]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(dict(zip(columns, map(_value, row))), ensure_ascii=False) + '\n'
+
+
+def iter_export(dataset: str, fmt: str, include_deleted: bool = False, using: Optional[str] = None,
+                chunk_size: Optional[int] = None) -> Iterator[str]:
+    """
+    Выгрузка набора в текстовом формате пачками строк
+
+    Args:
+        dataset: Набор (campaigns, flows, shares)
+        fmt: Формат (csv, ndjson)
+        include_deleted: Включать удалённые кампании (и их потоки)
+        using: Алиас БД для чтения (по умолчанию - по роутеру)
+        chunk_size: Строк в пачке курсора и в одном фрагменте вывода (по умолчанию EXPORT_CHUNK_SIZE)
+
+    Yields:
+        Фрагменты текста по chunk_size строк
+
+    Raises:
+        ValueError: Неизвестный набор или формат
+    """
+    if dataset not in DATASETS:
+        raise ValueError(f'Неизвестный набор выгрузки: {dataset}')
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'Неизвестный формат выгрузки: {fmt}')
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+
+    export = DATASETS[dataset]
+    rows = export.rows(include_deleted, using).iterator(chunk_size=chunk_size)
+    render = _csv_lines if fmt == 'csv' else _ndjson_lines
+    lines: List[str] = []
+    for line in render(list(export.columns), rows):
+        lines.append(line)
+        if len(lines) >= chunk_size:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+async def aiter_export(chunks: Iterator[str]) -> AsyncIterator[str]:
+    """
+    Асинхронная обёртка выгрузки для ASGI
+
+    StreamingHttpResponse под ASGI собирает синхронный итератор в список целиком, поэтому
+    фрагменты читаются по одному в потоке БД (thread_sensitive: курсор живёт в одном соединении).
+    """
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    while True:
+        chunk = await next_chunk(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
@@ -0,0 +1,112 @@
+"""
+Инкрементальный разбор JSON массивов из потока байтов
+"""
+import codecs
+import json
+from itertools import islice
+from typing import Any, Iterable, Iterator, List
+
+_WHITESPACE = ' \t\n\r'
+_DELIMITERS = _WHITESPACE + ',]'
+
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """
+    Разбор JSON массива верхнего уровня по одному элементу
+
+    В памяти держится только текущий необработанный фрагмент ответа,
+    а не весь документ и не весь список объектов.
+
+    Args:
+        chunks: Итератор фрагментов тела ответа (bytes)
+
+    Yields:
+        Элементы массива
+
+    Raises:
+        ValueError: Если документ не является корректным JSON массивом
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    exhausted = False
+
+    def read_more() -> bool:
+        nonlocal buf, pos, exhausted
+        if exhausted:
+            return False
+        try:
+            data = next(chunks)
+        except StopIteration:
+            exhausted = True
+            data = None
+        text = text_decoder.decode(data or b'', final=data is None)
+        buf = buf[pos:] + text
+        pos = 0
+        return data is not None or bool(text)
+
+    def next_char() -> str:
+        """Первый значащий символ (без пропуска), '' в конце потока"""
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if not read_more():
+                return ''
+
+    first = next_char()
+    if first == '':
+        return
+    if first != '[':
+        raise ValueError('Ожидался JSON массив')
+    pos += 1
+
+    if next_char() == ']':
+        return
+
+    while True:
+        if next_char() == '':
+            raise ValueError('Неожиданный конец JSON массива')
+        while True:
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+                # Значение, за которым ещё нет разделителя, может быть обрезано (например, число)
+                if exhausted or (end < len(buf) and buf[end] in _DELIMITERS):
+                    break
+            except json.JSONDecodeError:
+                if exhausted:
+                    raise ValueError('Некорректный JSON в ответе')
+            read_more()
+        pos = end
+        yield item
+
+        separator = next_char()
+        if separator == ',':
+            pos += 1
+        elif separator == ']':
+            return
+        else:
+            raise ValueError('Некорректный JSON массив')
+
+
+def chunked(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """
+    Разбиение итератора на списки не длиннее size
+
+    Args:
+        items: Итератор элементов
+        size: Размер пачки
+
+    Yields:
+        Списки элементов
+    """
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,125 @@
+"""
+Хранилище профилей запросов (кольцевой буфер на диске)
+"""
+import json
+import os
+import pstats
+import re
+import tempfile
+import time
+from typing import Dict, List, Optional
+from django.conf import settings
+
+# Имя профиля: время в наносекундах и ID запроса
+_VALID_NAME = re.compile(r'^\d+-[A-Za-z0-9._-]{1,64}$')
+
+
+def _short_path(filename: str) -> str:
+    """Путь относительно проекта для файлов проекта"""
+    base_dir = str(settings.BASE_DIR)
+    return os.path.relpath(filename, base_dir) if filename.startswith(base_dir) else filename
+
+
+def top_functions(stats: pstats.Stats, limit: int = 25) -> List[Dict]:
+    """
+    Самые затратные функции профиля по суммарному времени (cumulative)
+
+    Args:
+        stats: Статистика cProfile
+        limit: Количество функций
+
+    Returns:
+        Список словарей: функция, место, вызовы, собственное и суммарное время (мс)
+    """
+    rows = []
+    for (filename, line, function), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            'function': function,
+            'location': f'{_short_path(filename)}:{line}',
+            'calls': calls,
+            'tottime_ms': round(tottime * 1000, 2),
+            'cumtime_ms': round(cumtime * 1000, 2),
+        })
+    rows.sort(key=lambda row: row['cumtime_ms'], reverse=True)
+    return rows[:limit]
+
+
+class ProfileStore:
+    """
+    Профили последних запросов в каталоге PROFILING_DIR
+
+    Для каждого профиля хранится файл .prof (для snakeviz / pstats) и .json
+    с метаданными запроса. Хранятся только последние PROFILING_MAX_PROFILES профилей.
+    """
+
+    def __init__(self, directory: str = None, max_profiles: int = None):
+        """
+        Args:
+            directory: Каталог профилей
+            max_profiles: Размер кольцевого буфера
+        """
+        self.directory = directory or getattr(settings, 'PROFILING_DIR', '') or \
+            os.path.join(tempfile.gettempdir(), 'campaign-manager-profiles')
+        self.max_profiles = max_profiles or getattr(settings, 'PROFILING_MAX_PROFILES', 50)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def save(self, stats: pstats.Stats, meta: Dict) -> str:
+        """
+        Сохранение профиля и удаление самых старых сверх лимита
+
+        Args:
+            stats: Статистика cProfile
+            meta: Метаданные запроса (путь, время, SQL, Keitaro)
+
+        Returns:
+            Имя профиля
+        """
+        name = f'{time.time_ns()}-{meta.get("request_id") or "request"}'
+        stats.dump_stats(os.path.join(self.directory, f'{name}.prof'))
+        meta = dict(meta, name=name, top_functions=top_functions(
+            stats, getattr(settings, 'PROFILING_TOP_FUNCTIONS', 25)))
+        tmp_path = os.path.join(self.directory, f'{name}.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(self.directory, f'{name}.json'))
+        self._trim()
+        return name
+
+    def _names(self) -> List[str]:
+        """Имена профилей, от новых к старым"""
+        names = [filename[:-5] for filename in os.listdir(self.directory) if filename.endswith('.json')]
+        return sorted(names, key=lambda name: int(name.split('-', 1)[0]), reverse=True)
+
+    def _trim(self):
+        for name in self._names()[self.max_profiles:]:
+            for ext in ('.json', '.prof'):
+                try:
+                    os.remove(os.path.join(self.directory, name + ext))
+                except FileNotFoundError:
+                    pass
+
+    def list(self) -> List[Dict]:
+        """Метаданные профилей, от новых к старым"""
+        profiles = []
+        for name in self._names():
+            meta = self.get(name)
+            if meta:
+                profiles.append(meta)
+        return profiles
+
+    def get(self, name: str) -> Optional[Dict]:
+        """Метаданные профиля или None"""
+        if not _VALID_NAME.match(name):
+            return None
+        try:
+            with open(os.path.join(self.directory, f'{name}.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def prof_path(self, name: str) -> Optional[str]:
+        """Путь к файлу .prof или None"""
+        if not _VALID_NAME.match(name):
+            return None
+        path = os.path.join(self.directory, f'{name}.prof')
+        return path if os.path.exists(path) else None
@@ -0,0 +1,153 @@
+"""
+Клиентский rate limiter для Keitaro API (token bucket, общий для всех процессов)
+"""
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Tuple
+from django.conf import settings
+from config.exceptions import KeitaroRateLimitException
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка только в рамках процесса
+    fcntl = None
+
+
+class TokenBucket:
+    """
+    Token bucket, состояние которого хранится в файле
+
+    Файл блокируется через flock на время чтения и записи, поэтому все
+    воркеры gunicorn на одной машине расходуют один общий бюджет запросов.
+    """
+
+    def __init__(self, key: str, rate: float, capacity: float, directory: str = None,
+                 clock: Callable[[], float] = time.time):
+        """
+        Args:
+            key: Ключ бакета (URL Keitaro и класс endpoint)
+            rate: Пополнение, токенов в секунду
+            capacity: Ёмкость бакета (допустимый всплеск запросов)
+            directory: Каталог для файлов состояния
+            clock: Источник времени в секундах, общий для процессов (в тестах - управляемые часы)
+        """
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity
+        directory = directory or getattr(settings, 'KEITARO_RATE_LIMIT_DIR', '') or \
+            os.path.join(tempfile.gettempdir(), 'keitaro-ratelimit')
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        self.path = os.path.join(directory, f'{digest}.bucket')
+        self._lock = threading.Lock()
+        self._clock = clock
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """
+        Попытка взять токены из бакета
+
+        Args:
+            tokens: Количество токенов
+
+        Returns:
+            0 если токены получены, иначе время ожидания в секундах до их появления
+        """
+        with self._lock, open(self.path, 'a+') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read().split()
+                now = self._clock()
+                if len(raw) == 2:
+                    available, updated = float(raw[0]), float(raw[1])
+                    available = min(self.capacity, available + max(0.0, now - updated) * self.rate)
+                else:
+                    available = self.capacity
+
+                if available >= tokens:
+                    available -= tokens
+                    wait = 0.0
+                else:
+                    wait = (tokens - available) / self.rate
+
+                f.seek(0)
+                f.truncate()
+                f.write(f'{available:.6f} {now:.6f}')
+                f.flush()
+                return wait
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def acquire(self, tokens: float = 1, max_wait: float = None):
+        """
+        Получение токенов с ожиданием
+
+        Args:
+            tokens: Количество токенов
+            max_wait: Максимальное время ожидания в секундах
+
+        Raises:
+            KeitaroRateLimitException: Если токены не появились за max_wait
+        """
+        if max_wait is None:
+            max_wait = getattr(settings, 'KEITARO_RATE_LIMIT_MAX_WAIT', 10)
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise KeitaroRateLimitException('Превышен лимит запросов к Keitaro, попробуйте позже')
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: float = 1, max_wait: float = None):
+        """
+        Асинхронный вариант acquire: ожидание не блокирует event loop
+
+        Raises:
+            KeitaroRateLimitException: Если токены не появились за max_wait
+        """
+        if max_wait is None:
+            max_wait = getattr(settings, 'KEITARO_RATE_LIMIT_MAX_WAIT', 10)
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise KeitaroRateLimitException('Превышен лимит запросов к Keitaro, попробуйте позже')
+            await asyncio.sleep(wait)
+
+
+_buckets: Dict[Tuple, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(base_url: str, cls: str):
+    """
+    Бакет для инстанса Keitaro и класса endpoint
+
+    Args:
+        base_url: URL Keitaro инстанса
+        cls: Класс endpoint (см. resilience.endpoint_class)
+
+    Returns:
+        Объект TokenBucket или None, если лимит для класса отключён
+    """
+    limits = getattr(settings, 'KEITARO_RATE_LIMITS', {})
+    rate, capacity = limits.get(cls) or limits.get('default') or (0, 0)
+    if rate <= 0:
+        return None
+
+    with _buckets_lock:
+        key = (base_url, cls, rate, capacity)
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket = _buckets[key] = TokenBucket(f'{base_url}|{cls}', rate, max(capacity, 1))
+        return bucket
@@ -0,0 +1,232 @@
+"""
+Устойчивость клиента Keitaro: таймауты, повторы и circuit breaker
+"""
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Tuple
+from django.conf import settings
+from config.exceptions import KeitaroCircuitOpenException
+
+# Методы, которые безопасно повторять при сбоях
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+# Состояния circuit breaker
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+def endpoint_template(endpoint: str) -> str:
+    """
+    Шаблон endpoint без конкретных ID: 'campaigns/12/streams' -> 'campaigns/{id}/streams'
+
+    Args:
+        endpoint: API endpoint (без /admin_api/v1)
+
+    Returns:
+        Шаблон endpoint
+    """
+    return re.sub(r'/\d+(?=/|$)', '/{id}', endpoint.strip('/'))
+
+
+def endpoint_class(method: str, endpoint: str) -> str:
+    """
+    Класс endpoint для настроек таймаутов и лимитов
+
+    - report: построение отчётов (самые тяжёлые запросы)
+    - catalog: списки кампаний и офферов (большие ответы)
+    - default: всё остальное (потоки, отдельные сущности, запись)
+
+    Args:
+        method: HTTP метод
+        endpoint: API endpoint (без /admin_api/v1)
+
+    Returns:
+        Название класса endpoint
+    """
+    template = endpoint_template(endpoint)
+    if template.startswith('report'):
+        return 'report'
+    if method.upper() == 'GET' and template in ('campaigns', 'offers'):
+        return 'catalog'
+    return 'default'
+
+
+def get_timeout(cls: str) -> Tuple[float, float]:
+    """
+    Таймауты (connect, read) для класса endpoint
+
+    Args:
+        cls: Класс endpoint (см. endpoint_class)
+
+    Returns:
+        Кортеж (connect_timeout, read_timeout) в секундах
+    """
+    timeouts = getattr(settings, 'KEITARO_TIMEOUTS', {})
+    return tuple(timeouts.get(cls) or timeouts.get('default') or (3, 30))
+
+
+class RetryPolicy:
+    """Экспоненциальные повторы с полным джиттером"""
+
+    def __init__(self, max_retries: int = None, backoff: float = None, backoff_max: float = None):
+        """
+        Args:
+            max_retries: Максимум повторов (без учёта первой попытки)
+            backoff: Базовая задержка в секундах
+            backoff_max: Верхняя граница задержки в секундах
+        """
+        self.max_retries = max_retries if max_retries is not None else getattr(settings, 'KEITARO_MAX_RETRIES', 2)
+        self.backoff = backoff if backoff is not None else getattr(settings, 'KEITARO_RETRY_BACKOFF', 0.5)
+        self.backoff_max = backoff_max if backoff_max is not None else getattr(settings, 'KEITARO_RETRY_BACKOFF_MAX', 4)
+
+    def attempts_for(self, method: str) -> int:
+        """Количество попыток для метода: неидемпотентные запросы не повторяются"""
+        if method.upper() in IDEMPOTENT_METHODS:
+            return 1 + self.max_retries
+        return 1
+
+    def delay(self, attempt: int) -> float:
+        """
+        Задержка перед повтором (full jitter)
+
+        Args:
+            attempt: Номер неудачной попытки, начиная с 0
+
+        Returns:
+            Задержка в секундах
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker, общий для всех клиентов одного инстанса Keitaro
+
+    Считает исходы запросов в скользящем окне. Когда доля ошибок превышает порог,
+    breaker открывается и запросы сразу завершаются ошибкой. После паузы пропускается
+    один пробный запрос: успех закрывает breaker, ошибка снова открывает.
+    """
+
+    def __init__(self, error_rate: float = None, min_calls: int = None,
+                 window: float = None, cooldown: float = None, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            error_rate: Порог доли ошибок (0..1) для открытия
+            min_calls: Минимум запросов в окне для принятия решения
+            window: Размер скользящего окна в секундах
+            cooldown: Время в открытом состоянии до пробного запроса (секунды)
+            clock: Источник монотонного времени в секундах (в тестах - управляемые часы)
+        """
+        self.error_rate = error_rate if error_rate is not None else getattr(settings, 'KEITARO_BREAKER_ERROR_RATE', 0.5)
+        self.min_calls = min_calls if min_calls is not None else getattr(settings, 'KEITARO_BREAKER_MIN_CALLS', 10)
+        self.window = window if window is not None else getattr(settings, 'KEITARO_BREAKER_WINDOW', 30)
+        self.cooldown = cooldown if cooldown is not None else getattr(settings, 'KEITARO_BREAKER_COOLDOWN', 30)
+        self._lock = threading.Lock()
+        self._events = deque()
+        self._state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._clock = clock
+
+    def _trim(self, now: float):
+        """Удаление событий за пределами окна"""
+        while self._events and self._events[0][0] < now - self.window:
+            self._events.popleft()
+
+    def _open(self, now: float):
+        self._state = STATE_OPEN
+        self._opened_at = now
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        """Текущее состояние: closed, open или half_open"""
+        with self._lock:
+            if self._state == STATE_OPEN and self._clock() - self._opened_at >= self.cooldown:
+                return STATE_HALF_OPEN
+            return self._state
+
+    def allows_requests(self) -> bool:
+        """True если запрос к Keitaro имеет смысл (breaker не открыт)"""
+        return self.state != STATE_OPEN
+
+    def before_request(self):
+        """
+        Проверка перед запросом
+
+        Raises:
+            KeitaroCircuitOpenException: Если breaker открыт
+        """
+        with self._lock:
+            now = self._clock()
+            if self._state == STATE_OPEN:
+                if now - self._opened_at < self.cooldown:
+                    raise KeitaroCircuitOpenException('Keitaro временно недоступен, запросы приостановлены')
+                self._state = STATE_HALF_OPEN
+            if self._state == STATE_HALF_OPEN:
+                # В полуоткрытом состоянии пропускаем только один пробный запрос
+                if self._probe_in_flight:
+                    raise KeitaroCircuitOpenException('Keitaro временно недоступен, идёт проверка доступности')
+                self._probe_in_flight = True
+
+    def record_success(self):
+        """Регистрация успешного запроса"""
+        with self._lock:
+            now = self._clock()
+            if self._state == STATE_HALF_OPEN:
+                self._state = STATE_CLOSED
+                self._probe_in_flight = False
+                self._events.clear()
+            self._events.append((now, True))
+            self._trim(now)
+
+    def record_failure(self):
+        """Регистрация неудачного запроса (таймаут, ошибка соединения, 5xx)"""
+        with self._lock:
+            now = self._clock()
+            if self._state == STATE_HALF_OPEN:
+                self._open(now)
+                return
+            self._events.append((now, False))
+            self._trim(now)
+            total = len(self._events)
+            failures = sum(1 for _, ok in self._events if not ok)
+            if total >= self.min_calls and failures / total >= self.error_rate:
+                self._open(now)
+
+    def stats(self) -> Dict:
+        """Снимок состояния для диагностики"""
+        with self._lock:
+            self._trim(self._clock())
+            failures = sum(1 for _, ok in self._events if not ok)
+            total = len(self._events)
+        return {
+            'state': self.state,
+            'calls': total,
+            'failures': failures,
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(base_url: str) -> CircuitBreaker:
+    """
+    Общий circuit breaker для инстанса Keitaro (в рамках процесса)
+
+    Args:
+        base_url: URL Keitaro инстанса
+
+    Returns:
+        Объект CircuitBreaker
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(base_url)
+        if breaker is None:
+            breaker = _breakers[base_url] = CircuitBreaker()
+        return breaker
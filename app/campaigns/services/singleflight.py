@@ -0,0 +1,191 @@
+"""
+Объединение одинаковых параллельных GET запросов к Keitaro (single-flight)
+"""
+import asyncio
+import copy
+import threading
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Hashable
+from config import metrics
+
+
+class _Call:
+    """Выполняющийся запрос, результат которого ждут остальные потоки"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Группа single-flight в рамках процесса
+
+    Пока запрос с ключом выполняется, остальные потоки с тем же ключом не делают
+    свой HTTP запрос, а ждут и получают копию его результата. Опциональный
+    микро-кэш хранит результат ещё ttl секунд, чтобы поглотить всплеск запросов.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            clock: Источник монотонного времени для микро-кэша (в тестах - управляемые часы)
+        """
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._recent: Dict[Hashable, tuple] = {}
+        self.executed = 0
+        self.coalesced = 0
+        self.microcache_hits = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any], ttl: float = 0) -> Any:
+        """
+        Выполнение fn не более одного раза на ключ одновременно
+
+        Args:
+            key: Ключ запроса
+            fn: Функция, выполняющая запрос
+            ttl: Время жизни результата в микро-кэше (секунды, 0 - без кэша)
+
+        Returns:
+            Результат fn (ожидающие потоки получают глубокую копию)
+        """
+        with self._lock:
+            now = self._clock()
+            cached = self._recent.get(key)
+            if cached and cached[0] > now:
+                self.microcache_hits += 1
+                metrics.keitaro_coalesced_requests.inc(result='microcache')
+                return copy.deepcopy(cached[1])
+
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+            metrics.keitaro_coalesced_requests.inc(result='executed' if leader else 'coalesced')
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                if ttl > 0 and call.error is None:
+                    now = self._clock()
+                    self._recent = {k: v for k, v in self._recent.items() if v[0] > now}
+                    self._recent[key] = (now + ttl, copy.deepcopy(call.result))
+            call.event.set()
+
+    def forget(self, predicate: Callable[[Hashable], bool] = None):
+        """
+        Удаление результатов из микро-кэша
+
+        Args:
+            predicate: Функция отбора ключей (None - очистить всё)
+        """
+        with self._lock:
+            if predicate is None:
+                self._recent.clear()
+            else:
+                self._recent = {k: v for k, v in self._recent.items() if not predicate(k)}
+
+    def stats(self) -> Dict:
+        """
+        Счётчики: выполненные запросы, объединённые, попадания в микро-кэш и доля экономии
+        """
+        with self._lock:
+            executed, coalesced, hits = self.executed, self.coalesced, self.microcache_hits
+        total = executed + coalesced + hits
+        return {
+            'executed': executed,
+            'coalesced': coalesced,
+            'microcache_hits': hits,
+            'hit_ratio': round((coalesced + hits) / total, 4) if total else 0.0,
+        }
+
+
+class AsyncSingleFlight:
+    """
+    Single-flight для корутин (AsyncKeitaroClient)
+
+    Одинаковые параллельные запросы внутри event loop ждут future первого.
+    Future привязан к своему event loop, поэтому выполняющиеся запросы
+    хранятся отдельно для каждого loop. Микро-кэша нет: повторные чтения
+    закрывает кэш ответов.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict]' = weakref.WeakKeyDictionary()
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[bytes]]) -> bytes:
+        """
+        Выполнение fn не более одного раза на ключ одновременно в текущем event loop
+
+        Args:
+            key: Ключ запроса
+            fn: Функция, возвращающая корутину запроса
+
+        Returns:
+            Результат fn (тело ответа - bytes, поэтому копия не нужна)
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            calls = self._calls.setdefault(loop, {})
+            future = calls.get(key)
+            leader = future is None
+            if leader:
+                future = calls[key] = loop.create_future()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        metrics.keitaro_coalesced_requests.inc(result='executed' if leader else 'coalesced')
+
+        if not leader:
+            # shield: отмена ожидающего не должна отменять общий future
+            return await asyncio.shield(future)
+
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Ожидающих может не быть - помечаем исключение полученным
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                calls.pop(key, None)
+
+    def stats(self) -> Dict:
+        """Счётчики: выполненные и объединённые запросы"""
+        with self._lock:
+            return {'executed': self.executed, 'coalesced': self.coalesced}
+
+
+# Общая группа процесса для всех экземпляров KeitaroClient
+flight_group = SingleFlight()
+# Группа для AsyncKeitaroClient
+async_flight_group = AsyncSingleFlight()
@@ -0,0 +1,86 @@
+"""
+Снимки офферов потоков: Flow.offers_snapshot
+
+Снимок - список офферов потока (ID связи, ID и название оффера, share, закрепление,
+состояние) в порядке показа. Карточка кампании и её JSON API читают только таблицу
+потоков, без соединения с flow_offers и offers. Снимок переписывается в той же
+транзакции, что и изменение офферов потока; расхождения находит команда recount.
+"""
+from typing import Dict, Iterable, Iterator, List
+from django.db.models import QuerySet
+from ..models import Flow, FlowOffer
+from .json_stream import chunked
+
+SNAPSHOT_BATCH_SIZE = 500
+
+
+def build_snapshots(flow_ids: Iterable[int]) -> Dict[int, List[Dict]]:
+    """
+    Снимки потоков по нормализованным данным одним запросом
+
+    Args:
+        flow_ids: ID потоков
+
+    Returns:
+        Словарь {flow_id: снимок}; у потока без офферов снимка в словаре нет
+    """
+    snapshots: Dict[int, List[Dict]] = {}
+    rows = FlowOffer.objects.filter(flow_id__in=list(flow_ids)).order_by('flow_id', '-share', 'pk').values_list(
+        'flow_id', 'pk', 'offer__keitaro_id', 'offer__name', 'share', 'is_pinned', 'state',
+    )
+    for flow_id, pk, offer_id, offer_name, share, is_pinned, state in rows:
+        snapshots.setdefault(flow_id, []).append({
+            'id': pk,
+            'offer_id': offer_id,
+            'offer_name': offer_name,
+            'share': share,
+            'is_pinned': is_pinned,
+            'state': state,
+        })
+    return snapshots
+
+
+def refresh_flow_snapshots(flows: QuerySet) -> int:
+    """
+    Перезапись снимков офферов потоков
+
+    Args:
+        flows: QuerySet потоков
+
+    Returns:
+        Количество обновлённых потоков
+    """
+    flow_ids = set(flows.values_list('pk', flat=True))
+    snapshots = build_snapshots(flow_ids)
+    return Flow.objects.bulk_update(
+        [Flow(pk=flow_id, offers_snapshot=snapshots.get(flow_id, [])) for flow_id in flow_ids],
+        ['offers_snapshot'],
+        batch_size=SNAPSHOT_BATCH_SIZE,
+    )
+
+
+def stale_snapshot_flows() -> Iterator[int]:
+    """ID потоков, снимок которых расходится с нормализованными данными (проверка пачками)"""
+    flow_ids = Flow.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=SNAPSHOT_BATCH_SIZE)
+    for chunk in chunked(flow_ids, SNAPSHOT_BATCH_SIZE):
+        expected = build_snapshots(chunk)
+        for flow_id, snapshot in Flow.objects.filter(pk__in=chunk).values_list('pk', 'offers_snapshot'):
+            if snapshot != expected.get(flow_id, []):
+                yield flow_id
+
+
+def check_snapshots(fix: bool = True) -> int:
+    """
+    Сверка снимков офферов потоков с нормализованными данными
+
+    Args:
+        fix: Перезаписать расходящиеся снимки
+
+    Returns:
+        Количество потоков с расхождениями
+    """
+    stale = list(stale_snapshot_flows())
+    if fix:
+        for chunk in chunked(stale, SNAPSHOT_BATCH_SIZE):
+            refresh_flow_snapshots(Flow.objects.filter(pk__in=chunk))
+    return len(stale)
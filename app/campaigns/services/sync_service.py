@@ -1,13 +1,32 @@
 """
 Сервис для синхронизации данных между БД и Keitaro
 """
-from typing import Dict, List, Any
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Union
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.db import transaction
-from ..models import Campaign, Flow, Offer, FlowOffer
-from config.exceptions import KeitaroAPIException
+from django.utils import timezone
+from ..models import Campaign, Flow, Offer, FlowOffer, OfferVisibility, keitaro_instance
+from config.exceptions import KeitaroAPIException, KeitaroConnectionException, KeitaroRequestNotSentException
+from config.metrics import track_sync
+from .async_client import AsyncKeitaroClient
 from .client import KeitaroClient
 from .calculator import ShareCalculator
+from .counters import refresh_campaign_counters, refresh_flow_counters
+from .json_stream import chunked
+from .snapshots import refresh_flow_snapshots
+from .versions import bump_flow_versions
+
+logger = logging.getLogger(__name__)
+
+# Результат загрузки оффера по ID: данные, None (Keitaro его не отдал) или ошибка подключения
+FetchResult = Union[Dict, None, KeitaroConnectionException]
 
 
 class KeitaroSyncService:
@@ -22,57 +41,100 @@ class KeitaroSyncService:
         """
         self.user = user
         self.client = KeitaroClient(settings.KEITARO_URL, user.api_key)
+        # Размер пачки для bulk сохранения при потоковой синхронизации
+        self.chunk_size = getattr(settings, 'KEITARO_SYNC_CHUNK_SIZE', 500)
+    
+    def async_client(self) -> AsyncKeitaroClient:
+        """
+        Асинхронный клиент для async views (закрывается вызывающим: async with)
+        
+        Returns:
+            Объект AsyncKeitaroClient
+        """
+        return AsyncKeitaroClient(settings.KEITARO_URL, self.user.api_key)
     
+    @property
+    def keitaro_available(self) -> bool:
+        """Доступен ли Keitaro (circuit breaker не открыт)"""
+        return self.client.is_available
+    
+    @track_sync('campaigns')
     @transaction.atomic
     def sync_campaigns(self) -> int:
         """
         Синхронизация кампаний из Keitaro в БД
         
+        Список разбирается потоково и сохраняется пачками по мере загрузки.
         Кампании, которых нет в Keitaro, помечаются как 'deleted'.
         
         Returns:
             Количество синхронизированных кампаний
         """
         try:
-            campaigns_data = self.client.get_campaigns()
+            # Явная синхронизация всегда читает свежие данные, минуя кэш ответов
+            self.client.invalidate_cache('campaigns')
             
-            # Получаем список всех keitaro_id из Keitaro
-            keitaro_campaign_ids = {camp_data['id'] for camp_data in campaigns_data}
+            # Собираем keitaro_id всех кампаний из Keitaro
+            keitaro_campaign_ids = set()
             
             synced_count = 0
-            for camp_data in campaigns_data:
-                keitaro_id = camp_data['id']
-                
-                # Проверяем, существует ли кампания с таким keitaro_id
-                try:
-                    existing_campaign = Campaign.objects.get(keitaro_id=keitaro_id)
-                    # Если кампания существует, обновляем её данные
-                    existing_campaign.name = camp_data.get('name', '')
-                    existing_campaign.alias = camp_data.get('alias', '')
-                    existing_campaign.state = camp_data.get('state', 'active')
-                    existing_campaign.type = camp_data.get('type', 'position')
-                    existing_campaign.save()
-                except Campaign.DoesNotExist:
-                    # Кампания не существует - создаём новую
-                    Campaign.objects.create(
-                        keitaro_id=keitaro_id,
-                        name=camp_data.get('name', ''),
-                        alias=camp_data.get('alias', ''),
-                        state=camp_data.get('state', 'active'),
-                        type=camp_data.get('type', 'position'),
-                    )
-                
-                synced_count += 1
+            for chunk in chunked(self.client.iter_campaigns(), self.chunk_size):
+                synced_count += self._upsert_campaigns(chunk)
+                keitaro_campaign_ids.update(camp_data['id'] for camp_data in chunk)
             
-            # Помечаем как 'deleted' все кампании, которых нет в Keitaro
-            deleted_campaigns = Campaign.objects.exclude(keitaro_id__in=keitaro_campaign_ids)
-            deleted_count = deleted_campaigns.update(state='deleted')
+            # Помечаем как 'deleted' все кампании, которых нет в Keitaro. Уже удалённые не
+            # трогаем: deleted_at - начало срока хранения до архивации (manage.py archive)
+            deleted_campaigns = Campaign.objects.exclude(keitaro_id__in=keitaro_campaign_ids).exclude(state='deleted')
+            deleted_count = deleted_campaigns.update(state='deleted', deleted_at=timezone.now())
             
             return synced_count
             
         except KeitaroAPIException as e:
             raise Exception(f'Ошибка синхронизации кампаний: {str(e)}')
     
+    def _upsert_campaigns(self, campaigns_data: List[Dict]) -> int:
+        """
+        Создание и обновление пачки кампаний двумя bulk запросами
+        
+        Args:
+            campaigns_data: Данные кампаний из Keitaro
+        
+        Returns:
+            Количество обработанных кампаний
+        """
+        # Последняя запись с одинаковым id побеждает, как при поштучном сохранении
+        by_id = {camp_data['id']: camp_data for camp_data in campaigns_data}
+        existing = Campaign.objects.in_bulk(list(by_id), field_name='keitaro_id')
+        now = timezone.now()
+        
+        to_update, to_create = [], []
+        for keitaro_id, camp_data in by_id.items():
+            fields = {
+                'name': camp_data.get('name', ''),
+                'alias': camp_data.get('alias', ''),
+                'state': camp_data.get('state', 'active'),
+                'type': camp_data.get('type', 'position'),
+            }
+            campaign = existing.get(keitaro_id)
+            if campaign:
+                for field, value in fields.items():
+                    setattr(campaign, field, value)
+                # Срок хранения удалённой кампании идёт с первой пометки и сбрасывается, если она вернулась
+                if campaign.state != 'deleted':
+                    campaign.deleted_at = None
+                elif campaign.deleted_at is None:
+                    campaign.deleted_at = now
+                campaign.synced_at = now
+                to_update.append(campaign)
+            else:
+                deleted_at = now if fields['state'] == 'deleted' else None
+                to_create.append(Campaign(keitaro_id=keitaro_id, deleted_at=deleted_at, **fields))
+        
+        Campaign.objects.bulk_update(to_update, ['name', 'alias', 'state', 'type', 'deleted_at', 'synced_at'])
+        Campaign.objects.bulk_create(to_create)
+        return len(campaigns_data)
+    
+    @track_sync('streams')
     @transaction.atomic
     def sync_streams(self, campaign: Campaign) -> int:
         """
@@ -85,164 +147,483 @@ class KeitaroSyncService:
             Количество синхронизированных потоков
         """
         try:
+            self.client.invalidate_cache(f'campaigns/{campaign.keitaro_id}/streams')
             streams_data = self.client.get_streams(campaign.keitaro_id)
-            
-            synced_count = 0
-            for stream_data in streams_data:
-                flow, created = Flow.objects.update_or_create(
-                    keitaro_id=stream_data['id'],
-                    campaign=campaign,
-                    defaults={
-                        'name': stream_data.get('name', ''),
-                        'type': stream_data.get('type', 'offers'),
-                        'position': stream_data.get('position', 0),
-                        'state': stream_data.get('state', 'active'),
-                    }
-                )
-                
-                # Синхронизация офферов потока
-                self._sync_flow_offers(flow, stream_data.get('offers', []))
-                synced_count += 1
-            
-            return synced_count
+            try:
+                self.ensure_offers(self._stream_offer_ids(streams_data))
+            except KeitaroAPIException:
+                pass  # Офферы без данных сохранятся с названием "Offer N"
+            return self._save_streams(campaign, streams_data)
             
         except KeitaroAPIException as e:
             raise Exception(f'Ошибка синхронизации потоков: {str(e)}')
     
-    def _update_flow_offer(self, flow: Flow, offer: Offer, offer_data: Dict) -> FlowOffer:
+    @track_sync('streams')
+    async def async_streams(self, campaign: Campaign, client: AsyncKeitaroClient) -> int:
         """
-        Вспомогательный метод для обновления или создания FlowOffer
+        Асинхронный вариант sync_streams: потоки загружаются без блокировки
+        event loop, в потоке выполняется только запись в БД
         
         Args:
-            flow: Объект Flow
-            offer: Объект Offer
-            offer_data: Данные оффера из Keitaro API
+            campaign: Объект Campaign
+            client: Открытый асинхронный клиент
+        
+        Returns:
+            Количество синхронизированных потоков
+        """
+        try:
+            await client.invalidate_cache(f'campaigns/{campaign.keitaro_id}/streams')
+            streams_data = await client.get_streams(campaign.keitaro_id)
+        except KeitaroAPIException as e:
+            raise Exception(f'Ошибка синхронизации потоков: {str(e)}')
+        try:
+            await self.aensure_offers(self._stream_offer_ids(streams_data), client)
+        except KeitaroAPIException:
+            pass  # Офферы без данных сохранятся с названием "Offer N"
+        return await sync_to_async(transaction.atomic(self._save_streams))(campaign, streams_data)
+    
+    def _save_streams(self, campaign: Campaign, streams_data: List[Dict]) -> int:
+        """
+        Сохранение потоков кампании и их офферов
+        
+        Число SQL запросов не зависит от количества потоков и офферов: потоки, офферы
+        каталога и офферы потоков читаются одним запросом каждый и записываются
+        bulk_create / bulk_update.
+        
+        Args:
+            campaign: Объект Campaign
+            streams_data: Потоки из Keitaro
         
         Returns:
-            Объект FlowOffer
-        """
-        flow_offer, created = FlowOffer.objects.get_or_create(
-            flow=flow,
-            offer=offer,
-            defaults={
-                'share': offer_data.get('share', 0),
-                'state': offer_data.get('state', 'active'),
-                'keitaro_offer_stream_id': offer_data.get('id'),
-                'is_pinned': False,
+            Количество сохранённых потоков
+        """
+        now = timezone.now()
+        flows = self._save_flows(campaign, streams_data, now)
+        offers = self._stream_offers(self._stream_offer_ids(streams_data), now)
+        self._sync_flow_offers(flows, streams_data, offers, now)
+        
+        # Счётчики и снимки офферов пересчитываются в той же транзакции, что и сохранение потоков;
+        # версии увеличиваются, чтобы изменения, начатые до синхронизации, получили конфликт
+        refresh_flow_counters(campaign.flows.all())
+        refresh_flow_snapshots(campaign.flows.all())
+        bump_flow_versions(campaign.flows.all())
+        refresh_campaign_counters(Campaign.objects.filter(pk=campaign.pk))
+        return len(streams_data)
+    
+    @staticmethod
+    def _save_flows(campaign: Campaign, streams_data: List[Dict], now: datetime) -> Dict[int, Flow]:
+        """
+        Создание и обновление потоков кампании
+        
+        Returns:
+            Потоки по keitaro_id
+        """
+        existing = {flow.keitaro_id: flow for flow in Flow.objects.filter(campaign=campaign)}
+        flows, to_create, to_update = {}, [], []
+        for stream_data in streams_data:
+            fields = {
+                'name': stream_data.get('name', ''),
+                'type': stream_data.get('type', 'offers'),
+                'position': stream_data.get('position', 0),
+                'state': stream_data.get('state', 'active'),
             }
-        )
-        if not created:
-            flow_offer.share = offer_data.get('share', 0)
-            flow_offer.keitaro_offer_stream_id = offer_data.get('id')
-            
-            # Если оффер приходит из Keitaro как активный, активируем его (даже если у нас он disabled)
-            keitaro_state = offer_data.get('state', 'active')
-            if keitaro_state == 'active':
-                flow_offer.state = 'active'
-                flow_offer.save(update_fields=['share', 'state', 'keitaro_offer_stream_id'])
+            flow = existing.get(stream_data['id'])
+            if flow is None:
+                flow = Flow(keitaro_id=stream_data['id'], campaign=campaign, **fields)
+                to_create.append(flow)
             else:
-                # Если в Keitaro оффер не активен, сохраняем его состояние только если у нас он тоже не disabled
-                # (disabled офферы остаются disabled, если в Keitaro они тоже не активны)
-                if flow_offer.state != 'disabled':
-                    flow_offer.state = keitaro_state
-                    flow_offer.save(update_fields=['share', 'state', 'keitaro_offer_stream_id'])
-                else:
-                    # Если у нас disabled, а в Keitaro тоже не активен - сохраняем только share и id
-                    flow_offer.save(update_fields=['share', 'keitaro_offer_stream_id'])
-        return flow_offer
+                for name, value in fields.items():
+                    setattr(flow, name, value)
+                # bulk_update не заполняет auto_now поля
+                flow.synced_at = now
+                to_update.append(flow)
+            flows[stream_data['id']] = flow
+        
+        Flow.objects.bulk_update(to_update, ['name', 'type', 'position', 'state', 'synced_at'])
+        Flow.objects.bulk_create(to_create)
+        return flows
+    
+    def _stream_offers(self, offer_ids: Set[int], now: datetime) -> Dict[int, Offer]:
+        """
+        Офферы каталога по keitaro_id для офферов потоков
+        
+        Неизвестные офферы потоков уже загружены (ensure_offers в sync_streams / async_streams);
+        те, что Keitaro не отдал, сохраняются заглушками "Offer N".
+        """
+        instance = keitaro_instance()
+        offers = {offer.keitaro_id: offer for offer in Offer.objects.filter(instance=instance, keitaro_id__in=offer_ids)}
+        missing = offer_ids - set(offers)
+        if missing:
+            Offer.objects.bulk_create([
+                Offer(instance=instance, keitaro_id=offer_id, name=f"Offer {offer_id}", state='active')
+                for offer_id in missing
+            ], ignore_conflicts=True)
+            created = {offer.keitaro_id: offer for offer in Offer.objects.filter(instance=instance, keitaro_id__in=missing)}
+            offers.update(created)
+            # Оффер из потока пользователя доступен ему, даже если его нет в списке офферов
+            OfferVisibility.objects.bulk_create([
+                OfferVisibility(user=self.user, offer=offer, synced_at=now) for offer in created.values()
+            ], ignore_conflicts=True)
+        return offers
+    
+    @staticmethod
+    def _apply_keitaro_offer(flow_offer: FlowOffer, offer_data: Dict, now: datetime):
+        """
+        Перенос share, состояния и ID связи из Keitaro в существующий FlowOffer
+        
+        Закрепление (is_pinned) не меняется: это локальная функция.
+        """
+        keitaro_state = offer_data.get('state', 'active')
+        flow_offer.share = offer_data.get('share', 0)
+        flow_offer.keitaro_offer_stream_id = offer_data.get('id')
+        
+        if keitaro_state == 'active':
+            # Если оффер приходит из Keitaro как активный, активируем его (даже если у нас он disabled)
+            flow_offer.state = 'active'
+            flow_offer.disabled_at = None
+        elif flow_offer.state != 'disabled':
+            # Если в Keitaro оффер не активен, сохраняем его состояние только если у нас он тоже не disabled
+            # (disabled офферы остаются disabled, если в Keitaro они тоже не активны)
+            flow_offer.state = keitaro_state
+            if keitaro_state == 'disabled':
+                flow_offer.disabled_at = now
     
-    def _sync_flow_offers(self, flow: Flow, offers_data: List[Dict]):
+    def _sync_flow_offers(self, flows: Dict[int, Flow], streams_data: List[Dict], offers: Dict[int, Offer],
+                          now: datetime):
         """
-        Синхронизация офферов потока
+        Синхронизация офферов потоков
         
         При синхронизации сохраняются закрепления (is_pinned) существующих офферов,
         так как закрепление - это локальная функция, которая не синхронизируется с Keitaro.
         Новые офферы создаются с is_pinned=False.
         
         Args:
-            flow: Объект Flow
-            offers_data: Список данных офферов из Keitaro
-        """
-        # Сначала кэшируем офферы если их нет
-        offer_ids = [o['offer_id'] for o in offers_data if 'offer_id' in o]
-        for offer_id in offer_ids:
-            if not Offer.objects.filter(keitaro_id=offer_id).exists():
-                # Попробуем получить информацию об оффере
-                try:
-                    all_offers = self.client.get_offers()
-                    for offer_data in all_offers:
-                        Offer.objects.update_or_create(
-                            keitaro_id=offer_data['id'],
-                            user=self.user,
-                            defaults={
-                                'name': offer_data.get('name', f"Offer {offer_data['id']}"),
-                                'state': offer_data.get('state', 'active'),
-                            }
-                        )
-                    break
-                except Exception:
-                    pass
-        
-        # Помечаем как disabled активные офферы, которых нет в новых данных из Keitaro
-        # Это означает, что они были удалены в Keitaro
-        current_offer_stream_ids = [o.get('id') for o in offers_data if o.get('id')]
-        removed_offers = FlowOffer.objects.filter(
-            flow=flow, 
-            state='active'
-        ).exclude(
-            keitaro_offer_stream_id__in=current_offer_stream_ids
-        )
-        
-        # Помечаем их как disabled вместо удаления
-        if removed_offers.exists():
-            removed_offers.update(state='disabled', share=0)
+            flows: Сохранённые потоки по keitaro_id
+            streams_data: Потоки из Keitaro
+            offers: Офферы каталога по keitaro_id
+            now: Время синхронизации
+        """
+        existing = {
+            (flow_offer.flow_id, flow_offer.offer_id): flow_offer
+            for flow_offer in FlowOffer.objects.filter(flow__in=[flow.pk for flow in flows.values()])
+        }
+        to_update, to_create = {}, {}
         
-        # Создаём/обновляем связи (используем share из Keitaro)
-        for offer_data in offers_data:
-            offer_id = offer_data.get('offer_id')
-            if not offer_id:
-                continue
+        for stream_data in streams_data:
+            flow = flows[stream_data['id']]
+            offers_data = stream_data.get('offers', [])
             
-            try:
-                offer = Offer.objects.get(keitaro_id=offer_id)
-            except Offer.DoesNotExist:
-                offer = Offer.objects.create(
-                    keitaro_id=offer_id,
-                    user=self.user,
-                    name=f"Offer {offer_id}",
-                    state='active'
-                )
+            # Помечаем как disabled активные офферы, которых нет в новых данных из Keitaro
+            # Это означает, что они были удалены в Keitaro
+            current_offer_stream_ids = {o.get('id') for o in offers_data if o.get('id')}
+            for (flow_id, _), flow_offer in existing.items():
+                if (flow_id == flow.pk and flow_offer.state == 'active'
+                        and flow_offer.keitaro_offer_stream_id not in current_offer_stream_ids):
+                    flow_offer.state = 'disabled'
+                    flow_offer.share = 0
+                    flow_offer.disabled_at = now
+                    to_update[flow_offer.pk] = flow_offer
             
-            self._update_flow_offer(flow, offer, offer_data)
+            # Создаём/обновляем связи (используем share из Keitaro)
+            for offer_data in offers_data:
+                offer_id = offer_data.get('offer_id')
+                if not offer_id:
+                    continue
+                key = (flow.pk, offers[offer_id].pk)
+                
+                flow_offer = existing.get(key)
+                if flow_offer is not None:
+                    self._apply_keitaro_offer(flow_offer, offer_data, now)
+                    to_update[flow_offer.pk] = flow_offer
+                elif key in to_create:
+                    self._apply_keitaro_offer(to_create[key], offer_data, now)
+                else:
+                    keitaro_state = offer_data.get('state', 'active')
+                    to_create[key] = FlowOffer(
+                        flow=flow,
+                        offer=offers[offer_id],
+                        share=offer_data.get('share', 0),
+                        state=keitaro_state,
+                        disabled_at=now if keitaro_state == 'disabled' else None,
+                        keitaro_offer_stream_id=offer_data.get('id'),
+                        is_pinned=False,
+                    )
+        
+        for flow_offer in to_update.values():
+            # bulk_update не заполняет auto_now поля
+            flow_offer.updated_at = now
+        FlowOffer.objects.bulk_update(
+            list(to_update.values()), ['share', 'state', 'disabled_at', 'keitaro_offer_stream_id', 'updated_at'],
+        )
+        FlowOffer.objects.bulk_create(list(to_create.values()))
     
+    @track_sync('offers')
     @transaction.atomic
     def sync_offers(self) -> int:
         """
         Синхронизация офферов (кэш для автодополнения)
         
+        Каталог разбирается потоково и сохраняется пачками по мере загрузки,
+        поэтому в памяти не держится весь список офферов.
+        
         Returns:
             Количество синхронизированных офферов
         """
         try:
-            offers_data = self.client.get_offers()
+            self.client.invalidate_cache('offers')
             
+            synced_at = timezone.now()
             synced_count = 0
-            for offer_data in offers_data:
-                offer, created = Offer.objects.update_or_create(
-                    keitaro_id=offer_data['id'],
-                    user=self.user,
-                    defaults={
-                        'name': offer_data.get('name', f"Offer {offer_data['id']}"),
-                        'state': offer_data.get('state', 'active'),
-                    }
-                )
-                synced_count += 1
+            for chunk in chunked(self.client.iter_offers(), self.chunk_size):
+                synced_count += self._upsert_offers(chunk, synced_at)
+            self._hide_unlisted_offers(synced_at)
             
             return synced_count
             
         except KeitaroAPIException as e:
             raise Exception(f'Ошибка синхронизации офферов: {str(e)}')
     
+    @track_sync('offers')
+    async def async_offers(self, client: AsyncKeitaroClient) -> int:
+        """
+        Асинхронный вариант sync_offers
+        
+        Каталог загружается целиком (потоковое чтение есть только у синхронного
+        клиента) и сохраняется пачками в одной транзакции.
+        
+        Args:
+            client: Открытый асинхронный клиент
+        
+        Returns:
+            Количество синхронизированных офферов
+        """
+        try:
+            await client.invalidate_cache('offers')
+            offers_data = await client.get_offers()
+        except KeitaroAPIException as e:
+            raise Exception(f'Ошибка синхронизации офферов: {str(e)}')
+        
+        @transaction.atomic
+        def save() -> int:
+            synced_at = timezone.now()
+            synced_count = sum(self._upsert_offers(chunk, synced_at) for chunk in chunked(offers_data, self.chunk_size))
+            self._hide_unlisted_offers(synced_at)
+            return synced_count
+        
+        return await sync_to_async(save)()
+    
+    @staticmethod
+    def _stream_offer_ids(streams_data: List[Dict]) -> Set[int]:
+        """ID офферов во всех потоках"""
+        return {
+            offer_data['offer_id']
+            for stream_data in streams_data
+            for offer_data in stream_data.get('offers', [])
+            if offer_data.get('offer_id')
+        }
+    
+    def _missing_offer_ids(self, offer_ids: Iterable[int]) -> List[int]:
+        """ID офферов, которых нет среди доступных пользователю (один запрос)"""
+        offer_ids = set(offer_ids)
+        visible = Offer.objects.visible_to(self.user).filter(keitaro_id__in=offer_ids)
+        return sorted(offer_ids - set(visible.values_list('keitaro_id', flat=True)))
+    
+    def ensure_offers(self, offer_ids: Iterable[int]) -> List[int]:
+        """
+        Загрузка в каталог только недостающих офферов (вместо полной синхронизации)
+        
+        Офферы, недоступные пользователю, запрашиваются по одному через get_offer,
+        до KEITARO_OFFER_FETCH_CONCURRENCY одновременно, и сохраняются одной пачкой.
+        Ошибка подключения на одном оффере не отменяет остальные: загруженные офферы
+        сохраняются всегда. После ошибки до отправки запроса (rate limit, circuit breaker)
+        оставшиеся офферы не запрашиваются.
+        
+        Args:
+            offer_ids: ID офферов в Keitaro
+        
+        Returns:
+            ID офферов, которых нет в Keitaro (или они недоступны пользователю)
+        
+        Raises:
+            KeitaroConnectionException: Часть офферов не загружена из-за ошибки подключения
+                (загруженные уже сохранены)
+        """
+        missing = self._missing_offer_ids(offer_ids)
+        if not missing:
+            return []
+        
+        stop = threading.Event()
+        
+        def fetch(context, offer_id: int) -> FetchResult:
+            if stop.is_set():
+                return KeitaroConnectionException('Загрузка остановлена после ошибки подключения')
+            result = context.run(self._fetch_offer, self.client.get_offer, offer_id)
+            if isinstance(result, KeitaroRequestNotSentException):
+                stop.set()
+            return result
+        
+        # Вызовы из пула потоков учитываются трассировкой текущего запроса: у каждого своя копия контекста
+        contexts = [copy_context() for _ in missing]
+        workers = min(len(missing), settings.KEITARO_OFFER_FETCH_CONCURRENCY)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(fetch, contexts, missing))
+        return self._save_fetched_offers(missing, results)
+    
+    async def aensure_offers(self, offer_ids: Iterable[int], client: AsyncKeitaroClient) -> List[int]:
+        """
+        Асинхронный вариант ensure_offers
+        
+        Args:
+            offer_ids: ID офферов в Keitaro
+            client: Открытый асинхронный клиент
+        
+        Returns:
+            ID офферов, которых нет в Keitaro (или они недоступны пользователю)
+        
+        Raises:
+            KeitaroConnectionException: Часть офферов не загружена из-за ошибки подключения
+                (загруженные уже сохранены)
+        """
+        missing = await sync_to_async(self._missing_offer_ids)(offer_ids)
+        if not missing:
+            return []
+        
+        semaphore = asyncio.Semaphore(settings.KEITARO_OFFER_FETCH_CONCURRENCY)
+        stopped = False
+        
+        async def fetch(offer_id: int) -> FetchResult:
+            nonlocal stopped
+            async with semaphore:
+                if stopped:
+                    return KeitaroConnectionException('Загрузка остановлена после ошибки подключения')
+                result = await self._afetch_offer(client, offer_id)
+                if isinstance(result, KeitaroRequestNotSentException):
+                    stopped = True
+                return result
+        
+        results = await asyncio.gather(*(fetch(offer_id) for offer_id in missing))
+        return await sync_to_async(self._save_fetched_offers)(missing, results)
+    
+    @staticmethod
+    def _fetch_offer(get_offer, offer_id: int) -> FetchResult:
+        """Оффер из Keitaro, None, если Keitaro его не отдал (404, нет доступа), или ошибка подключения"""
+        try:
+            return get_offer(offer_id)
+        except KeitaroConnectionException as e:
+            return e
+        except KeitaroAPIException:
+            return None
+    
+    @staticmethod
+    async def _afetch_offer(client: AsyncKeitaroClient, offer_id: int) -> FetchResult:
+        """Асинхронный вариант _fetch_offer"""
+        try:
+            return await client.get_offer(offer_id)
+        except KeitaroConnectionException as e:
+            return e
+        except KeitaroAPIException:
+            return None
+    
+    def _save_fetched_offers(self, missing: List[int], results: List[FetchResult]) -> List[int]:
+        """
+        Сохранение загруженных офферов
+        
+        Returns:
+            ID офферов, которые Keitaro не отдал
+        
+        Raises:
+            KeitaroConnectionException: Часть офферов не загружена (после сохранения остальных)
+        """
+        found = [result for result in results if isinstance(result, dict)]
+        if found:
+            with transaction.atomic():
+                self._upsert_offers(found, timezone.now())
+        
+        errors = {
+            offer_id: result for offer_id, result in zip(missing, results) if isinstance(result, Exception)
+        }
+        if errors:
+            # Причина - ошибка до отправки запроса (после неё остальные офферы не запрашивались)
+            error = next((e for e in errors.values() if isinstance(e, KeitaroRequestNotSentException)),
+                         next(iter(errors.values())))
+            logger.warning('Не загружено офферов: %d из %d (%s): %s',
+                           len(errors), len(missing), error, sorted(errors)[:20])
+            raise KeitaroConnectionException(
+                f'Не загружено офферов: {len(errors)} из {len(missing)} ({str(error)})'
+            )
+        return [offer_id for offer_id, result in zip(missing, results) if result is None]
+    
+    def _upsert_offers(self, offers_data: List[Dict], synced_at: datetime) -> int:
+        """
+        Сохранение пачки офферов в общий каталог и отметка их доступности пользователю
+        
+        Каталог общий для пользователей инстанса, поэтому записываются только новые
+        и изменившиеся офферы: повторная синхронизация другим пользователем обновляет
+        лишь его отметки доступности.
+        
+        Args:
+            offers_data: Данные офферов из Keitaro
+            synced_at: Время синхронизации (отметка доступности)
+        
+        Returns:
+            Количество обработанных офферов
+        """
+        instance = keitaro_instance()
+        by_id = {offer_data['id']: offer_data for offer_data in offers_data}
+        existing = {
+            offer.keitaro_id: offer
+            for offer in Offer.objects.filter(instance=instance, keitaro_id__in=list(by_id))
+        }
+        
+        to_update, to_create, renamed = [], [], []
+        for keitaro_id, offer_data in by_id.items():
+            name = offer_data.get('name', f"Offer {keitaro_id}")
+            state = offer_data.get('state', 'active')
+            offer = existing.get(keitaro_id)
+            if offer is None:
+                to_create.append(Offer(instance=instance, keitaro_id=keitaro_id, name=name, state=state))
+            elif (offer.name, offer.state) != (name, state):
+                if offer.name != name:
+                    renamed.append(offer.pk)
+                offer.name = name
+                offer.state = state
+                offer.cached_at = synced_at
+                to_update.append(offer)
+        
+        Offer.objects.bulk_update(to_update, ['name', 'state', 'cached_at'])
+        if renamed:
+            # Название оффера хранится в снимках потоков
+            refresh_flow_snapshots(Flow.objects.filter(flow_offers__offer__in=renamed))
+        if to_create:
+            # Те же офферы может одновременно создавать синхронизация другого пользователя
+            Offer.objects.bulk_create(to_create, ignore_conflicts=True)
+            existing.update(
+                (offer.keitaro_id, offer) for offer in Offer.objects.filter(
+                    instance=instance, keitaro_id__in=[offer.keitaro_id for offer in to_create])
+            )
+        
+        OfferVisibility.objects.bulk_create(
+            [OfferVisibility(user=self.user, offer=offer, synced_at=synced_at) for offer in existing.values()],
+            update_conflicts=True,
+            unique_fields=['user', 'offer'],
+            update_fields=['synced_at'],
+        )
+        return len(offers_data)
+    
+    def _hide_unlisted_offers(self, synced_at: datetime) -> int:
+        """
+        Снятие доступности офферов, которых не было в списке полной синхронизации
+        
+        Строки каталога не удаляются: на них могут ссылаться потоки и другие пользователи.
+        
+        Returns:
+            Количество снятых отметок
+        """
+        deleted, _ = OfferVisibility.objects.filter(
+            user=self.user, offer__instance=keitaro_instance(), synced_at__lt=synced_at
+        ).delete()
+        return deleted
+    
     def push_stream_offers(self, flow: Flow) -> bool:
         """
         Отправка изменений офферов потока в Keitaro
@@ -262,21 +643,8 @@ class KeitaroSyncService:
             if not is_valid:
                 raise ValueError(f'Невалидные share: {error}')
             
-            # Формируем данные для отправки
-            offers_data = []
-            for fo in flow_offers:
-                offers_data.append({
-                    'offer_id': fo.offer.keitaro_id,
-                    'share': fo.share,
-                    'state': fo.state,
-                })
-            
             # Отправляем в Keitaro
-            update_data = {
-                'offers': offers_data
-            }
-            
-            self.client.update_stream(flow.keitaro_id, update_data)
+            self.client.update_stream(flow.keitaro_id, self._stream_offers_payload(flow_offers))
             
             # Удалённые офферы (state='disabled') остаются в базе для возможности восстановления
             # Они не отправляются в Keitaro, но сохраняются локально
@@ -286,6 +654,44 @@ class KeitaroSyncService:
         except (KeitaroAPIException, ValueError) as e:
             raise Exception(f'Ошибка отправки в Keitaro: {str(e)}')
     
+    async def apush_stream_offers(self, flow: Flow, client: AsyncKeitaroClient) -> bool:
+        """
+        Асинхронный вариант push_stream_offers
+        
+        Args:
+            flow: Объект Flow
+            client: Открытый асинхронный клиент
+        
+        Returns:
+            True если успешно
+        """
+        try:
+            flow_offers = [fo async for fo in flow.flow_offers.filter(state='active').select_related('offer')]
+            
+            is_valid, error = ShareCalculator.validate_shares(flow_offers)
+            if not is_valid:
+                raise ValueError(f'Невалидные share: {error}')
+            
+            await client.update_stream(flow.keitaro_id, self._stream_offers_payload(flow_offers))
+            return True
+            
+        except (KeitaroAPIException, ValueError) as e:
+            raise Exception(f'Ошибка отправки в Keitaro: {str(e)}')
+    
+    @staticmethod
+    def _stream_offers_payload(flow_offers) -> Dict:
+        """Данные для обновления офферов потока в Keitaro"""
+        return {
+            'offers': [
+                {
+                    'offer_id': fo.offer.keitaro_id,
+                    'share': fo.share,
+                    'state': fo.state,
+                }
+                for fo in flow_offers
+            ]
+        }
+    
     def compare_with_keitaro(self, flow: Flow) -> Dict[str, Any]:
         """
         Сравнение локальных данных потока с Keitaro
@@ -307,25 +713,65 @@ class KeitaroSyncService:
                 for fo in flow.flow_offers.filter(state='active')
             }
             
-            # Получаем только активные офферы из Keitaro
-            keitaro_offers = {
-                o['offer_id']: o['share']
-                for o in stream_data.get('offers', [])
-                if o.get('state') == 'active'
-            }
-            
-            # Сравниваем
-            has_differences = local_offers != keitaro_offers
+            return self._diff_offers(local_offers, stream_data)
             
+        except KeitaroAPIException as e:
             return {
-                'has_differences': has_differences,
-                'local_offers': local_offers,
-                'keitaro_offers': keitaro_offers,
+                'error': str(e),
+                'has_differences': False,
             }
+    
+    async def acompare_with_keitaro(self, flow: Flow, client: AsyncKeitaroClient) -> Dict[str, Any]:
+        """
+        Асинхронный вариант compare_with_keitaro (потоки кампании можно сравнивать параллельно)
+        
+        Args:
+            flow: Объект Flow
+            client: Открытый асинхронный клиент
+        
+        Returns:
+            Dict с информацией о расхождениях
+        """
+        try:
+            stream_data = await client.get_stream(flow.keitaro_id)
+            
+            local_offers = {
+                fo.offer.keitaro_id: fo.share
+                async for fo in flow.flow_offers.filter(state='active').select_related('offer')
+            }
+            return self._diff_offers(local_offers, stream_data)
             
         except KeitaroAPIException as e:
             return {
                 'error': str(e),
                 'has_differences': False,
             }
+    
+    @staticmethod
+    def _diff_offers(local_offers: Dict[int, int], stream_data: Dict) -> Dict[str, Any]:
+        """
+        Сравнение активных локальных офферов с активными офферами потока Keitaro
+        
+        Args:
+            local_offers: {keitaro_id оффера: share}
+            stream_data: Данные потока из Keitaro
+        
+        Returns:
+            Dict с информацией о расхождениях
+        """
+        # Получаем только активные офферы из Keitaro
+        keitaro_offers = {
+            o['offer_id']: o['share']
+            for o in stream_data.get('offers', [])
+            if o.get('state') == 'active'
+        }
+        
+        # Сравниваем
+        has_differences = local_offers != keitaro_offers
+        
+        return {
+            'has_differences': has_differences,
+            'local_offers': local_offers,
+            'keitaro_offers': keitaro_offers,
+        }
 
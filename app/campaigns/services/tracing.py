@@ -0,0 +1,174 @@
+"""
+Трассировка вызовов Keitaro API: гистограммы задержек по endpoint и лог медленных вызовов
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+from django.conf import settings
+from config import metrics
+from config.request_id import get_request_id
+from .resilience import endpoint_template
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы задержек, мс
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, float('inf'))
+
+# Списки, собирающие вызовы Keitaro в текущем контексте (вложенные collect() видят вызовы одновременно)
+_collectors: ContextVar[Tuple[List['KeitaroCall'], ...]] = ContextVar('keitaro_call_collectors', default=())
+
+
+@dataclass
+class KeitaroCall:
+    """Один вызов Keitaro API (со всеми повторами)"""
+    method: str
+    endpoint: str
+    request_id: str
+    status: Optional[int] = None
+    bytes: int = 0
+    duration: float = 0.0
+    retries: int = 0
+    error: str = ''
+    streamed: bool = False
+
+    @property
+    def duration_ms(self) -> float:
+        return self.duration * 1000
+
+
+class LatencyHistogram:
+    """Гистограмма задержек одного endpoint"""
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS_MS)
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, call: KeitaroCall):
+        duration_ms = call.duration_ms
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if duration_ms <= bound:
+                self.buckets[i] += 1
+                break
+        self.count += 1
+        self.errors += bool(call.error)
+        self.retries += call.retries
+        self.bytes += call.bytes
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+
+    def percentile(self, q: float) -> float:
+        """Оценка перцентиля по верхней границе корзины (мс)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return self.max_ms if bound == float('inf') else min(bound, self.max_ms)
+        return self.max_ms
+
+    def as_dict(self) -> Dict:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'retries': self.retries,
+            'bytes': self.bytes,
+            'avg_ms': round(self.total_ms / self.count, 2) if self.count else 0.0,
+            'max_ms': round(self.max_ms, 2),
+            'p50_ms': round(self.percentile(0.5), 2),
+            'p95_ms': round(self.percentile(0.95), 2),
+            'p99_ms': round(self.percentile(0.99), 2),
+            'buckets': {
+                ('+Inf' if bound == float('inf') else str(bound)): count
+                for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets)
+            },
+        }
+
+
+class KeitaroTracer:
+    """Сбор вызовов Keitaro в памяти процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, LatencyHistogram] = {}
+
+    @contextmanager
+    def trace(self, method: str, endpoint: str, streamed: bool = False) -> Iterator[KeitaroCall]:
+        """
+        Замер вызова: блок заполняет status, bytes и retries, время и ошибка фиксируются здесь
+
+        Args:
+            method: HTTP метод
+            endpoint: API endpoint (в статистике - его шаблон)
+            streamed: Потоковое чтение (время включает загрузку всего тела)
+        """
+        call = KeitaroCall(method.upper(), endpoint_template(endpoint), get_request_id(), streamed=streamed)
+        started = time.perf_counter()
+        try:
+            yield call
+        except Exception as e:
+            call.error = type(e).__name__
+            raise
+        finally:
+            call.duration = time.perf_counter() - started
+            self.record(call)
+
+    def record(self, call: KeitaroCall):
+        """Учёт завершённого вызова"""
+        with self._lock:
+            key = f'{call.method} {call.endpoint}'
+            if key not in self._histograms:
+                self._histograms[key] = LatencyHistogram()
+            self._histograms[key].observe(call)
+
+        metrics.keitaro_calls.inc(method=call.method, endpoint=call.endpoint, status=call.status or call.error or 'none')
+        metrics.keitaro_call_duration.observe(call.duration, method=call.method, endpoint=call.endpoint)
+        if call.retries:
+            metrics.keitaro_retries.inc(call.retries, method=call.method, endpoint=call.endpoint)
+        if call.bytes:
+            metrics.keitaro_response_bytes.inc(call.bytes, method=call.method, endpoint=call.endpoint)
+
+        for calls in _collectors.get():
+            calls.append(call)
+
+        threshold_ms = getattr(settings, 'KEITARO_SLOW_CALL_MS', 1000)
+        level = logging.WARNING if threshold_ms and call.duration_ms >= threshold_ms else logging.DEBUG
+        logger.log(
+            level,
+            'Keitaro %s %s: %s, %d байт, %.1f мс, повторов %d%s',
+            call.method, call.endpoint, call.status or '-', call.bytes, call.duration_ms, call.retries,
+            f', ошибка {call.error}' if call.error else '',
+        )
+
+    def stats(self) -> Dict[str, Dict]:
+        """Гистограммы по 'МЕТОД шаблон endpoint'"""
+        with self._lock:
+            return {key: histogram.as_dict() for key, histogram in sorted(self._histograms.items())}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    @staticmethod
+    @contextmanager
+    def collect() -> Iterator[List[KeitaroCall]]:
+        """Сбор вызовов Keitaro, выполненных внутри блока (например, одного HTTP запроса)"""
+        calls: List[KeitaroCall] = []
+        token = _collectors.set(_collectors.get() + (calls,))
+        try:
+            yield calls
+        finally:
+            _collectors.reset(token)
+
+
+tracer = KeitaroTracer()
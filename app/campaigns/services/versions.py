@@ -0,0 +1,44 @@
+"""
+Версии потоков для оптимистичной блокировки
+
+Flow.version увеличивается при каждом изменении офферов потока (views и синхронизация).
+Изменение из интерфейса передаёт версию потока, которую видел пользователь: проверка
+и увеличение версии - один условный UPDATE в начале транзакции. Если поток уже изменён
+другим запросом, UPDATE не находит строку, и view отвечает 409 с текущим состоянием
+потока вместо того, чтобы молча перезаписать чужой пересчёт share.
+"""
+from typing import Optional
+from django.db.models import F, QuerySet
+from ..models import Flow
+
+
+def bump_flow_version(flow: Flow, expected: Optional[int] = None) -> bool:
+    """
+    Проверка и увеличение версии потока одним UPDATE ... WHERE version = expected
+
+    Args:
+        flow: Поток
+        expected: Версия, которую видел клиент (по умолчанию - загруженная вместе с flow)
+
+    Returns:
+        True, если версия совпала и увеличена (flow.version обновляется), False при конфликте
+    """
+    if expected is None:
+        expected = flow.version
+    if not Flow.objects.filter(pk=flow.pk, version=expected).update(version=F('version') + 1):
+        return False
+    flow.version = expected + 1
+    return True
+
+
+def bump_flow_versions(flows: QuerySet) -> int:
+    """
+    Безусловное увеличение версий потоков (синхронизация, архивация)
+
+    Args:
+        flows: QuerySet потоков
+
+    Returns:
+        Количество обновлённых потоков
+    """
+    return flows.update(version=F('version') + 1)
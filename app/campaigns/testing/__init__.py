@@ -0,0 +1,6 @@
+"""
+Инструменты для тестов и бенчмарков без реального Keitaro
+"""
+from .fake_keitaro import FakeKeitaroApp, FakeKeitaroServer, SyntheticAccount
+
+__all__ = ['FakeKeitaroApp', 'FakeKeitaroServer', 'SyntheticAccount']
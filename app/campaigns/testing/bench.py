@@ -0,0 +1,252 @@
+"""
+Бенчмарки синхронизации, рендеринга страниц и редактирования share
+
+Наполняют базу детерминированным набором данных и замеряют время и количество
+SQL запросов для основных путей. Keitaro заменяется локальной имитацией.
+"""
+import random
+import statistics
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional
+from django.db import connection
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from ..models import Campaign, Flow, Offer, FlowOffer, OfferVisibility, keitaro_instance
+from ..services.counters import refresh_campaign_counters
+from ..services.snapshots import refresh_flow_snapshots
+from .fake_keitaro import SyntheticAccount
+
+
+@dataclass
+class Dataset:
+    """Размер синтетического набора данных"""
+    campaigns: int = 5000
+    flows_per_campaign: int = 10
+    offers_per_flow: int = 10
+    offers: int = 5000
+    seed: int = 1
+
+    @property
+    def flows(self) -> int:
+        return self.campaigns * self.flows_per_campaign
+
+    @property
+    def flow_offers(self) -> int:
+        return self.flows * min(self.offers_per_flow, self.offers)
+
+    def as_dict(self) -> Dict:
+        return {
+            'campaigns': self.campaigns,
+            'flows': self.flows,
+            'flow_offers': self.flow_offers,
+            'offers': self.offers,
+            'seed': self.seed,
+        }
+
+
+@dataclass
+class Benchmark:
+    """
+    Один замер
+
+    setup и teardown выполняются вокруг каждого прогона и не входят в замер
+    (например, чтобы вернуть данные в исходное состояние после редактирования).
+    """
+    name: str
+    run: Callable[[], object]
+    setup: Optional[Callable[[], None]] = None
+    teardown: Optional[Callable[[], None]] = None
+
+
+def build_account(dataset: Dataset) -> SyntheticAccount:
+    """
+    Имитация Keitaro, согласованная с seed_database
+
+    Каталог офферов и кампании совпадают с базой по keitaro_id; потоки создаются
+    только для первой кампании (её использует замер sync_streams), чтобы не держать
+    в памяти весь набор потоков.
+    """
+    account = SyntheticAccount(
+        campaigns=dataset.campaigns,
+        streams_per_campaign=0,
+        offers=dataset.offers,
+        seed=dataset.seed,
+    )
+    rnd = random.Random(dataset.seed)
+    offer_ids = list(account.offers)
+    for position in range(dataset.flows_per_campaign):
+        stream_offers = rnd.sample(offer_ids, min(dataset.offers_per_flow, len(offer_ids)))
+        account.create_stream({
+            'campaign_id': 1,
+            'name': f'Stream 1.{position}',
+            'type': 'regular',
+            'schema': 'landings',
+            'action_type': 'campaign',
+            'position': position,
+            'state': 'active',
+            'offers': SyntheticAccount._split_shares(stream_offers),
+        })
+    return account
+
+
+def seed_database(user, dataset: Dataset, account: SyntheticAccount, batch_size: int = 2000,
+                  progress: Callable[[str], None] = None) -> float:
+    """
+    Наполнение базы синтетическими данными через bulk_create
+
+    Офферы повторяют каталог имитации, потоки первой кампании - её потоки
+    (с теми же keitaro_id и офферами), остальные генерируются тем же seed.
+
+    Args:
+        user: Владелец офферов
+        dataset: Размер набора данных
+        account: Имитация Keitaro из build_account
+        batch_size: Размер пачки bulk_create
+        progress: Функция для вывода прогресса
+
+    Returns:
+        Время наполнения в секундах
+    """
+    started = time.perf_counter()
+    progress = progress or (lambda message: None)
+
+    offers = Offer.objects.bulk_create(
+        [Offer(instance=keitaro_instance(), keitaro_id=o['id'], name=o['name'], state=o['state'])
+         for o in account.offers.values()],
+        batch_size=batch_size,
+    )
+    now = timezone.now()
+    OfferVisibility.objects.bulk_create(
+        [OfferVisibility(user=user, offer=offer, synced_at=now) for offer in offers], batch_size=batch_size,
+    )
+    offer_pks = {offer.keitaro_id: offer.pk for offer in offers}
+    progress(f'Офферы: {len(offer_pks)}')
+
+    rnd = random.Random(dataset.seed + 1)
+    offer_ids = list(offer_pks)
+    per_flow = min(dataset.offers_per_flow, len(offer_ids))
+    stream_id = dataset.flows_per_campaign
+    offer_stream_id = 0
+
+    def campaign_streams(campaign_id: int) -> Iterator[Dict]:
+        nonlocal stream_id
+        if campaign_id == 1:
+            yield from account.campaign_streams(1)
+            return
+        for position in range(dataset.flows_per_campaign):
+            stream_id += 1
+            yield {
+                'id': stream_id,
+                'name': f'Stream {campaign_id}.{position}',
+                'position': position,
+                'offers': SyntheticAccount._split_shares(rnd.sample(offer_ids, per_flow)),
+            }
+
+    campaign_ids = list(account.campaigns)
+    # Кампаний в пачке столько, чтобы их потоков было около batch_size
+    campaigns_per_batch = max(1, batch_size // max(1, dataset.flows_per_campaign))
+    for start in range(0, len(campaign_ids), campaigns_per_batch):
+        chunk = campaign_ids[start:start + campaigns_per_batch]
+        campaigns = Campaign.objects.bulk_create([
+            Campaign(keitaro_id=campaign_id, name=f'Campaign {campaign_id}', alias=f'campaign_{campaign_id}')
+            for campaign_id in chunk
+        ])
+
+        flows, stream_offers = [], []
+        for campaign in campaigns:
+            for stream in campaign_streams(campaign.keitaro_id):
+                flows.append(Flow(
+                    keitaro_id=stream['id'],
+                    campaign=campaign,
+                    name=stream['name'],
+                    position=stream['position'],
+                    active_offers_count=len(stream['offers']),
+                    total_offers_count=len(stream['offers']),
+                ))
+                stream_offers.append(stream['offers'])
+        flows = Flow.objects.bulk_create(flows, batch_size=batch_size)
+
+        flow_offers = []
+        for flow, offers_data in zip(flows, stream_offers):
+            for offer_data in offers_data:
+                offer_stream_id = offer_data.get('id') or offer_stream_id + 1
+                flow_offers.append(FlowOffer(
+                    flow=flow,
+                    offer_id=offer_pks[offer_data['offer_id']],
+                    share=offer_data['share'],
+                    keitaro_offer_stream_id=offer_stream_id,
+                ))
+        FlowOffer.objects.bulk_create(flow_offers, batch_size=batch_size)
+        refresh_campaign_counters(Campaign.objects.filter(pk__in=[campaign.pk for campaign in campaigns]))
+        refresh_flow_snapshots(Flow.objects.filter(campaign__in=campaigns))
+        progress(f'Кампании: {start + len(chunk)}/{len(campaign_ids)}')
+
+    return time.perf_counter() - started
+
+
+def measure(benchmark: Benchmark, repeat: int, warmup: int = 1) -> Dict:
+    """
+    Замер времени и количества SQL запросов
+
+    Args:
+        benchmark: Замер
+        repeat: Количество измеряемых прогонов
+        warmup: Количество прогонов для прогрева (не учитываются)
+
+    Returns:
+        Словарь с временем (мс) и количеством запросов
+    """
+    timings, query_counts = [], []
+    for i in range(warmup + repeat):
+        if benchmark.setup:
+            benchmark.setup()
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                benchmark.run()
+                elapsed = time.perf_counter() - started
+        finally:
+            if benchmark.teardown:
+                benchmark.teardown()
+        if i >= warmup:
+            timings.append(elapsed * 1000)
+            query_counts.append(len(queries))
+
+    timings.sort()
+    return {
+        'runs': repeat,
+        'wall_ms': {
+            'min': round(timings[0], 3),
+            'median': round(statistics.median(timings), 3),
+            'mean': round(statistics.mean(timings), 3),
+            'p95': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+            'max': round(timings[-1], 3),
+        },
+        'queries': max(query_counts),
+        'queries_min': min(query_counts),
+    }
+
+
+def compare(results: Dict, baseline: Dict) -> List[Dict]:
+    """
+    Сравнение результатов с сохранённым прогоном
+
+    Returns:
+        Список строк: имя замера, медиана и запросы до/после, изменение медианы в %
+    """
+    rows = []
+    for name, result in results['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if not before:
+            continue
+        old, new = before['wall_ms']['median'], result['wall_ms']['median']
+        rows.append({
+            'name': name,
+            'median_before': old,
+            'median_after': new,
+            'median_change_pct': round((new - old) / old * 100, 1) if old else None,
+            'queries_before': before['queries'],
+            'queries_after': result['queries'],
+        })
+    return rows
@@ -0,0 +1,409 @@
+"""
+Локальная имитация Keitaro Admin API для тестов, нагрузочных проверок и бенчмарков
+
+Реализует endpoints, которые использует KeitaroClient, поверх синтетического
+аккаунта заданного размера. Умеет добавлять задержку и ошибки.
+"""
+import json
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from socketserver import ThreadingMixIn
+from typing import Dict, Iterable, List, Optional
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+API_PREFIX = '/admin_api/v1'
+
+HTTP_STATUSES = {
+    200: '200 OK',
+    400: '400 Bad Request',
+    401: '401 Unauthorized',
+    404: '404 Not Found',
+    500: '500 Internal Server Error',
+    502: '502 Bad Gateway',
+    503: '503 Service Unavailable',
+    504: '504 Gateway Timeout',
+}
+
+
+class SyntheticAccount:
+    """Детерминированный синтетический аккаунт Keitaro"""
+
+    def __init__(self, campaigns: int = 10, streams_per_campaign: int = 3, offers: int = 50,
+                 offers_per_stream: int = 3, seed: int = 1, api_keys: Iterable[str] = None):
+        """
+        Args:
+            campaigns: Количество кампаний
+            streams_per_campaign: Потоков в каждой кампании
+            offers: Размер каталога офферов
+            offers_per_stream: Офферов в каждом потоке
+            seed: Seed генератора (одинаковый seed - одинаковые данные)
+            api_keys: Допустимые API ключи (None - принимается любой непустой ключ)
+        """
+        self.api_keys = set(api_keys) if api_keys else None
+        self._lock = threading.Lock()
+        rnd = random.Random(seed)
+
+        self.offers: Dict[int, Dict] = {}
+        for offer_id in range(1, offers + 1):
+            self.offers[offer_id] = {
+                'id': offer_id,
+                'name': f'Offer {offer_id} {rnd.choice(["US", "GB", "DE", "FR", "BR"])}',
+                'state': 'active' if rnd.random() > 0.05 else 'disabled',
+            }
+
+        self.campaigns: Dict[int, Dict] = {}
+        self.streams: Dict[int, Dict] = {}
+        self._campaign_streams: Dict[int, List[int]] = defaultdict(list)
+        self._next_stream_id = 1
+        self._next_offer_stream_id = 1
+        offer_ids = list(self.offers)
+        for campaign_id in range(1, campaigns + 1):
+            self.campaigns[campaign_id] = {
+                'id': campaign_id,
+                'name': f'Campaign {campaign_id}',
+                'alias': f'campaign_{campaign_id}',
+                'state': 'active',
+                'type': 'position',
+            }
+            for position in range(streams_per_campaign):
+                stream_offers = rnd.sample(offer_ids, min(offers_per_stream, len(offer_ids)))
+                self._add_stream({
+                    'campaign_id': campaign_id,
+                    'name': f'Stream {campaign_id}.{position}',
+                    'type': 'regular',
+                    'schema': 'landings',
+                    'action_type': 'campaign',
+                    'position': position,
+                    'state': 'active',
+                    'filters': [],
+                    'offers': self._split_shares(stream_offers),
+                })
+
+    @staticmethod
+    def _split_shares(offer_ids: List[int]) -> List[Dict]:
+        """Равномерное распределение 100% между офферами"""
+        if not offer_ids:
+            return []
+        base, remainder = divmod(100, len(offer_ids))
+        return [
+            {'offer_id': offer_id, 'share': base + (1 if i < remainder else 0), 'state': 'active'}
+            for i, offer_id in enumerate(offer_ids)
+        ]
+
+    def _add_stream(self, data: Dict) -> Dict:
+        stream_id = self._next_stream_id
+        self._next_stream_id += 1
+        stream = dict(data, id=stream_id)
+        stream['offers'] = self._link_offers(stream_id, data.get('offers') or [], {})
+        self.streams[stream_id] = stream
+        self._campaign_streams[stream['campaign_id']].append(stream_id)
+        return stream
+
+    def _link_offers(self, stream_id: int, offers: List[Dict], existing: Dict[int, int]) -> List[Dict]:
+        """Связи поток-оффер с id (существующие связи сохраняют свой id)"""
+        result = []
+        for offer in offers:
+            link_id = existing.get(offer['offer_id'])
+            if link_id is None:
+                link_id = self._next_offer_stream_id
+                self._next_offer_stream_id += 1
+            result.append({
+                'id': link_id,
+                'stream_id': stream_id,
+                'offer_id': offer['offer_id'],
+                'share': offer.get('share', 0),
+                'state': offer.get('state', 'active'),
+            })
+        return result
+
+    def authorized(self, api_key: str) -> bool:
+        """Проверка API ключа"""
+        if not api_key:
+            return False
+        return self.api_keys is None or api_key in self.api_keys
+
+    def list_campaigns(self, offset: int = 0, limit: Optional[int] = None) -> List[Dict]:
+        with self._lock:
+            items = list(self.campaigns.values())
+        return items[offset:offset + limit] if limit else items[offset:]
+
+    def create_campaign(self, data: Dict) -> Dict:
+        with self._lock:
+            campaign_id = max(self.campaigns, default=0) + 1
+            campaign = {
+                'id': campaign_id,
+                'name': data.get('name', f'Campaign {campaign_id}'),
+                'alias': data.get('alias', ''),
+                'state': data.get('state', 'active'),
+                'type': data.get('type', 'position'),
+            }
+            self.campaigns[campaign_id] = campaign
+            return campaign
+
+    def campaign_streams(self, campaign_id: int) -> Optional[List[Dict]]:
+        with self._lock:
+            if campaign_id not in self.campaigns:
+                return None
+            return [self.streams[stream_id] for stream_id in self._campaign_streams[campaign_id]]
+
+    def create_stream(self, data: Dict) -> Optional[Dict]:
+        with self._lock:
+            if data.get('campaign_id') not in self.campaigns:
+                return None
+            return self._add_stream(data)
+
+    def update_stream(self, stream_id: int, data: Dict) -> Optional[Dict]:
+        with self._lock:
+            stream = self.streams.get(stream_id)
+            if stream is None:
+                return None
+            if 'offers' in data:
+                existing = {o['offer_id']: o['id'] for o in stream['offers']}
+                stream['offers'] = self._link_offers(stream_id, data['offers'], existing)
+            for field, value in data.items():
+                if field not in ('id', 'offers'):
+                    stream[field] = value
+            return stream
+
+    def report(self, params: Dict) -> Dict:
+        """Отчёт по кампаниям (детерминированные метрики по id кампании)"""
+        campaign_ids = None
+        for report_filter in params.get('filters', []):
+            if report_filter.get('name') == 'campaign_id':
+                campaign_ids = {int(i) for i in report_filter.get('expression') or []}
+        rows = []
+        for campaign_id in self.campaigns:
+            if campaign_ids is not None and campaign_id not in campaign_ids:
+                continue
+            rnd = random.Random(campaign_id)
+            clicks = rnd.randint(0, 10000)
+            conversions = rnd.randint(0, clicks // 10 + 1)
+            revenue = round(conversions * rnd.uniform(1, 20), 2)
+            cost = round(clicks * rnd.uniform(0.01, 0.2), 2)
+            rows.append({
+                'campaign_id': campaign_id,
+                'clicks': clicks,
+                'conversions': conversions,
+                'sales': conversions,
+                'cr': round(conversions / clicks * 100, 2) if clicks else 0,
+                'crs': 0,
+                'revenue': revenue,
+                'cost': cost,
+                'profit': round(revenue - cost, 2),
+                'roi': round((revenue - cost) / cost * 100, 2) if cost else 0,
+            })
+        return {'rows': rows, 'total': len(rows)}
+
+
+class FakeKeitaroApp:
+    """
+    WSGI приложение, имитирующее Keitaro Admin API v1
+
+    Задержка: latency +- jitter секунд на каждый запрос.
+    Ошибки: с вероятностью error_rate отвечает error_status; fail_next() ставит
+    в очередь ошибки для ближайших запросов (для детерминированных тестов).
+    Потерянный ответ: stall_next() выполняет запрос, но задерживает ответ
+    (клиент получает таймаут, хотя объект уже создан).
+    """
+
+    ROUTES = [
+        ('GET', r'campaigns', 'list_campaigns'),
+        ('POST', r'campaigns', 'create_campaign'),
+        ('GET', r'campaigns/(\d+)', 'get_campaign'),
+        ('GET', r'campaigns/(\d+)/streams', 'get_streams'),
+        ('POST', r'streams', 'create_stream'),
+        ('GET', r'streams/(\d+)', 'get_stream'),
+        ('PUT', r'streams/(\d+)', 'update_stream'),
+        ('GET', r'offers', 'list_offers'),
+        ('GET', r'offers/(\d+)', 'get_offer'),
+        ('POST', r'report/build', 'build_report'),
+    ]
+
+    def __init__(self, account: SyntheticAccount = None, latency: float = 0, jitter: float = 0,
+                 error_rate: float = 0, error_status: int = 503, seed: int = None):
+        self.account = account or SyntheticAccount()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._scheduled_errors: List[int] = []
+        self._scheduled_stalls: List[tuple] = []
+        self.requests: List[tuple] = []
+
+    def fail_next(self, count: int = 1, status: int = 503):
+        """Ответить ошибкой status на ближайшие count запросов"""
+        with self._lock:
+            self._scheduled_errors.extend([status] * count)
+
+    def stall_next(self, delay: float, count: int = 1, method: str = 'POST'):
+        """Выполнить ближайшие count запросов method, но ответить на них через delay секунд"""
+        with self._lock:
+            self._scheduled_stalls.extend([(method, delay)] * count)
+
+    def _injected_stall(self, method: str) -> float:
+        with self._lock:
+            for i, (stall_method, delay) in enumerate(self._scheduled_stalls):
+                if stall_method == method:
+                    del self._scheduled_stalls[i]
+                    return delay
+        return 0
+
+    def _injected_error(self) -> Optional[int]:
+        with self._lock:
+            if self._scheduled_errors:
+                return self._scheduled_errors.pop(0)
+            if self.error_rate and self._random.random() < self.error_rate:
+                return self.error_status
+        return None
+
+    def __call__(self, environ, start_response):
+        method = environ['REQUEST_METHOD']
+        path = environ.get('PATH_INFO', '')
+        with self._lock:
+            self.requests.append((method, path))
+
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter)))
+
+        status = self._injected_error()
+        if status:
+            return self._respond(start_response, status, {'error': 'Injected error'})
+
+        if not self.account.authorized(environ.get('HTTP_API_KEY', '')):
+            return self._respond(start_response, 401, {'error': 'Unauthorized'})
+
+        if not path.startswith(API_PREFIX + '/'):
+            return self._respond(start_response, 404, {'error': 'Not found'})
+        endpoint = path[len(API_PREFIX) + 1:].strip('/')
+
+        for route_method, pattern, handler in self.ROUTES:
+            match = re.fullmatch(pattern, endpoint)
+            if route_method == method and match:
+                args = [int(arg) for arg in match.groups()]
+                try:
+                    result = getattr(self, handler)(environ, *args)
+                except ValueError:
+                    return self._respond(start_response, 400, {'error': 'Invalid JSON'})
+                if result is None:
+                    return self._respond(start_response, 404, {'error': 'Not found'})
+                stall = self._injected_stall(method)
+                if stall:
+                    time.sleep(stall)
+                return self._respond(start_response, 200, result)
+
+        return self._respond(start_response, 404, {'error': 'Not found'})
+
+    @staticmethod
+    def _respond(start_response, status: int, body):
+        start_response(HTTP_STATUSES.get(status, f'{status} Error'), [('Content-Type', 'application/json')])
+        if isinstance(body, list):
+            # Списки отдаются по элементам, как большой ответ реального сервера
+            return _iter_json_list(body)
+        return [json.dumps(body).encode()]
+
+    @staticmethod
+    def _query(environ) -> Dict[str, str]:
+        from urllib.parse import parse_qsl
+        return dict(parse_qsl(environ.get('QUERY_STRING', '')))
+
+    @staticmethod
+    def _body(environ) -> Dict:
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        raw = environ['wsgi.input'].read(length) if length else b''
+        return json.loads(raw) if raw else {}
+
+    def list_campaigns(self, environ):
+        query = self._query(environ)
+        return self.account.list_campaigns(int(query.get('offset', 0)), int(query.get('limit', 0)) or None)
+
+    def create_campaign(self, environ):
+        return self.account.create_campaign(self._body(environ))
+
+    def get_campaign(self, environ, campaign_id):
+        return self.account.campaigns.get(campaign_id)
+
+    def get_streams(self, environ, campaign_id):
+        return self.account.campaign_streams(campaign_id)
+
+    def create_stream(self, environ):
+        return self.account.create_stream(self._body(environ))
+
+    def get_stream(self, environ, stream_id):
+        return self.account.streams.get(stream_id)
+
+    def update_stream(self, environ, stream_id):
+        return self.account.update_stream(stream_id, self._body(environ))
+
+    def list_offers(self, environ):
+        return list(self.account.offers.values())
+
+    def get_offer(self, environ, offer_id):
+        return self.account.offers.get(offer_id)
+
+    def build_report(self, environ):
+        return self.account.report(self._body(environ))
+
+
+def _iter_json_list(items: List) -> Iterable[bytes]:
+    yield b'['
+    for i, item in enumerate(items):
+        yield (b',' if i else b'') + json.dumps(item).encode()
+    yield b']'
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeKeitaroServer:
+    """
+    HTTP сервер с FakeKeitaroApp в фоновом потоке
+
+    Пример:
+        with FakeKeitaroServer(SyntheticAccount(campaigns=100)) as server:
+            with override_settings(KEITARO_URL=server.url):
+                ...
+    """
+
+    def __init__(self, account: SyntheticAccount = None, host: str = '127.0.0.1', port: int = 0, **app_options):
+        """
+        Args:
+            account: Синтетический аккаунт (по умолчанию небольшой)
+            host: Адрес для прослушивания
+            port: Порт (0 - любой свободный)
+            **app_options: Параметры FakeKeitaroApp (latency, jitter, error_rate, ...)
+        """
+        self.app = FakeKeitaroApp(account, **app_options)
+        self.httpd = make_server(host, port, self.app, server_class=_ThreadingWSGIServer,
+                                 handler_class=_QuietHandler)
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'FakeKeitaroServer':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -1,3 +1,1314 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import multiprocessing
+import os
+import tempfile
+from io import StringIO
+import threading
+import time
+from datetime import timedelta
+from unittest import skipUnless
+import httpx
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from config import metrics
+from config.db_router import ReplicaRouter, ReplicaState, ReplicaStickinessMiddleware, allow_replica_reads, replica_state_var
+from config.exceptions import (KeitaroAuthException, KeitaroCircuitOpenException, KeitaroConnectionException,
+                               KeitaroRateLimitException, KeitaroRequestNotSentException)
+from config.testing import QueryBudgetTestMixin
+from users.models import User
+from .models import ArchivedRecord, Campaign, Flow, Offer, FlowOffer
+from .services import AsyncKeitaroClient, KeitaroClient, KeitaroSyncService, archive
+from .services.bulk_create import BulkCampaignCreator
+from .services.cache import BaseResponseCache, DjangoResponseCache, LRUResponseCache, read_tags, write_tags
+from .services.json_stream import iter_json_array
+from .services.rate_limit import TokenBucket, fcntl
+from .services.resilience import STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, CircuitBreaker, RetryPolicy
+from .services.singleflight import AsyncSingleFlight, SingleFlight
+from .services.tracing import tracer
+from .testing import FakeKeitaroServer, SyntheticAccount
 
-# Create your tests here.
+
+class FakeKeitaroTestCase(TestCase):
+    """Тесты против локальной имитации Keitaro (без сети и реального Keitaro)"""
+
+    account_options = {'campaigns': 5, 'streams_per_campaign': 2, 'offers': 20, 'offers_per_stream': 3}
+
+    def setUp(self):
+        # Свой сервер на каждый тест: тесты изменяют данные аккаунта
+        self.server = FakeKeitaroServer(SyntheticAccount(api_keys=['test-key'], **self.account_options)).start()
+        self.addCleanup(self.server.stop)
+        settings_override = override_settings(
+            KEITARO_URL=self.server.url,
+            KEITARO_RATE_LIMITS={},
+            KEITARO_RETRY_BACKOFF=0,
+            KEITARO_RESPONSE_CACHE=None,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create(api_key='test-key')
+        self.sync_service = KeitaroSyncService(self.user)
+
+    def login(self):
+        """Авторизация тестового клиента (AuthMiddleware читает user_id из session)"""
+        session = self.client.session
+        session['user_id'] = self.user.id
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+
+class SyncServiceTests(FakeKeitaroTestCase):
+
+    def test_sync_campaigns_marks_missing_as_deleted(self):
+        Campaign.objects.create(keitaro_id=999, name='Removed in Keitaro')
+
+        count = self.sync_service.sync_campaigns()
+
+        self.assertEqual(count, 5)
+        self.assertEqual(Campaign.objects.exclude(state='deleted').count(), 5)
+        self.assertEqual(Campaign.objects.get(keitaro_id=999).state, 'deleted')
+
+        # Повторная синхронизация не сдвигает начало срока хранения
+        deleted_at = Campaign.objects.get(keitaro_id=999).deleted_at
+        self.assertIsNotNone(deleted_at)
+        self.sync_service.sync_campaigns()
+        self.assertEqual(Campaign.objects.get(keitaro_id=999).deleted_at, deleted_at)
+
+    def test_sync_streams_creates_flows_and_offers(self):
+        self.sync_service.sync_campaigns()
+        campaign = Campaign.objects.get(keitaro_id=1)
+
+        count = self.sync_service.sync_streams(campaign)
+
+        self.assertEqual(count, 2)
+        for flow in Flow.objects.filter(campaign=campaign):
+            shares = [fo.share for fo in flow.flow_offers.filter(state='active')]
+            self.assertEqual(len(shares), 3)
+            self.assertEqual(sum(shares), 100)
+            self.assertEqual((flow.active_offers_count, flow.total_offers_count), (3, 3))
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.flows_count, 2)
+
+    def test_ensure_offers_fetches_only_missing(self):
+        self.server.app.account.offers[3]['name'] = 'Renamed offer'
+        self.sync_service.ensure_offers([1])
+        self.server.app.requests.clear()
+
+        missing = self.sync_service.ensure_offers([1, 2, 3, 999])
+
+        self.assertEqual(missing, [999])
+        paths = sorted(path for _, path in self.server.app.requests)
+        self.assertEqual(paths, ['/admin_api/v1/offers/2', '/admin_api/v1/offers/3', '/admin_api/v1/offers/999'])
+        self.assertEqual(Offer.objects.visible_to(self.user).get(keitaro_id=3).name, 'Renamed offer')
+        self.assertEqual(Offer.objects.count(), 3)
+
+    @override_settings(KEITARO_RATE_LIMITS={'default': (0.001, 3)}, KEITARO_RATE_LIMIT_MAX_WAIT=0,
+                       KEITARO_OFFER_FETCH_CONCURRENCY=1)
+    def test_ensure_offers_keeps_offers_fetched_before_failure(self):
+        self.server.app.requests.clear()
+
+        with self.assertRaises(KeitaroConnectionException):
+            self.sync_service.ensure_offers(range(1, 7))
+
+        # Три токена - три загруженных оффера; после исчерпания лимита остальные не запрашиваются
+        self.assertEqual(len(self.server.app.requests), 3)
+        offers = Offer.objects.visible_to(self.user).order_by('keitaro_id')
+        self.assertEqual([(o.keitaro_id, o.name) for o in offers],
+                         [(i, self.server.app.account.offers[i]['name']) for i in (1, 2, 3)])
+
+    @override_settings(KEITARO_RATE_LIMITS={'default': (0.001, 3)}, KEITARO_RATE_LIMIT_MAX_WAIT=0,
+                       KEITARO_OFFER_FETCH_CONCURRENCY=1)
+    def test_async_ensure_offers_keeps_offers_fetched_before_failure(self):
+        async def ensure():
+            async with self.sync_service.async_client() as client:
+                await self.sync_service.aensure_offers(range(1, 7), client)
+
+        with self.assertRaises(KeitaroConnectionException):
+            async_to_sync(ensure)()
+
+        self.assertEqual(Offer.objects.visible_to(self.user).count(), 3)
+
+    def test_sync_streams_keeps_fetched_offer_names_after_failure(self):
+        self.sync_service.sync_campaigns()
+        campaign = Campaign.objects.get(keitaro_id=1)
+        stream_offers = sorted({o['offer_id'] for s in self.server.app.account.campaign_streams(1) for o in s['offers']})
+        # Лимит исчерпывается после загрузки потоков и двух офферов
+        limits = {'default': (0.001, 1 + 2), 'catalog': (0, 0)}
+
+        with override_settings(KEITARO_RATE_LIMITS=limits, KEITARO_RATE_LIMIT_MAX_WAIT=0,
+                               KEITARO_OFFER_FETCH_CONCURRENCY=1):
+            self.sync_service.sync_streams(campaign)
+
+        names = dict(Offer.objects.values_list('keitaro_id', 'name'))
+        self.assertEqual(sorted(names), stream_offers)
+        fetched = [i for i in stream_offers if names[i] == self.server.app.account.offers[i]['name']]
+        self.assertEqual(len(fetched), 2)
+        self.assertTrue(all(names[i] == f'Offer {i}' for i in stream_offers if i not in fetched))
+
+    def test_sync_streams_fetches_unknown_offers_by_id(self):
+        self.sync_service.sync_campaigns()
+        campaign = Campaign.objects.get(keitaro_id=1)
+        self.server.app.requests.clear()
+
+        self.sync_service.sync_streams(campaign)
+
+        self.assertNotIn(('GET', '/admin_api/v1/offers'), self.server.app.requests)
+        stream_offers = {o['offer_id'] for s in self.server.app.account.campaign_streams(1) for o in s['offers']}
+        self.assertEqual(set(Offer.objects.values_list('keitaro_id', flat=True)), stream_offers)
+        for offer in Offer.objects.all():
+            self.assertEqual(offer.name, self.server.app.account.offers[offer.keitaro_id]['name'])
+
+    def test_sync_offers_is_idempotent(self):
+        self.assertEqual(self.sync_service.sync_offers(), 20)
+        self.assertEqual(self.sync_service.sync_offers(), 20)
+        self.assertEqual(Offer.objects.visible_to(self.user).count(), 20)
+
+    def test_offer_catalog_is_shared_between_users(self):
+        self.server.app.account.api_keys.add('other-key')
+        other = User.objects.create(api_key='other-key', username='other')
+        self.sync_service.sync_offers()
+        cached_at = Offer.objects.get(keitaro_id=1).cached_at
+
+        self.server.app.account.offers.pop(2)
+        KeitaroSyncService(other).sync_offers()
+
+        self.assertEqual(Offer.objects.count(), 20)
+        self.assertEqual(Offer.objects.get(keitaro_id=1).cached_at, cached_at)
+        self.assertEqual(Offer.objects.visible_to(self.user).count(), 20)
+        self.assertEqual(Offer.objects.visible_to(other).count(), 19)
+        self.assertFalse(Offer.objects.visible_to(other).filter(keitaro_id=2).exists())
+
+    def test_push_stream_offers_updates_keitaro(self):
+        self.sync_service.sync_campaigns()
+        campaign = Campaign.objects.get(keitaro_id=1)
+        self.sync_service.sync_streams(campaign)
+        flow = campaign.flows.first()
+        first, *rest = flow.flow_offers.filter(state='active')
+        first.share = 100
+        first.save()
+        FlowOffer.objects.filter(pk__in=[fo.pk for fo in rest]).update(state='disabled', share=0)
+
+        self.sync_service.push_stream_offers(flow)
+
+        stream = self.server.app.account.streams[flow.keitaro_id]
+        self.assertEqual([(o['offer_id'], o['share']) for o in stream['offers']], [(first.offer.keitaro_id, 100)])
+        self.assertFalse(self.sync_service.compare_with_keitaro(flow)['has_differences'])
+
+
+class CounterTests(FakeKeitaroTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sync_service.sync_campaigns()
+        self.sync_service.sync_streams(Campaign.objects.get(keitaro_id=1))
+        self.flow = Flow.objects.filter(campaign__keitaro_id=1).first()
+        self.flow_offer = self.flow.flow_offers.first()
+        self.login()
+
+    def assertOffersCount(self, active, total):
+        self.flow.refresh_from_db()
+        self.assertEqual((self.flow.active_offers_count, self.flow.total_offers_count), (active, total))
+
+    def test_offer_views_update_counters(self):
+        remove_url = reverse('campaigns:remove_offer', kwargs={'pk': self.flow_offer.pk})
+        self.client.post(remove_url)
+        self.client.post(remove_url)
+        self.assertOffersCount(2, 3)
+
+        self.client.post(reverse('campaigns:restore_offer', kwargs={'pk': self.flow_offer.pk}))
+        self.assertOffersCount(3, 3)
+
+        offer = Offer.objects.visible_to(self.user).exclude(flow_offers__flow=self.flow).first()
+        self.client.post(reverse('campaigns:add_offer', kwargs={'flow_id': self.flow.pk}), {'offer_id': offer.keitaro_id})
+        self.assertOffersCount(4, 4)
+
+    def test_offer_views_rewrite_snapshot(self):
+        self.client.post(reverse('campaigns:toggle_pin', kwargs={'pk': self.flow_offer.pk}))
+        self.client.post(reverse('campaigns:remove_offer', kwargs={'pk': self.flow_offer.pk}))
+
+        self.flow.refresh_from_db()
+        snapshot = {item['id']: item for item in self.flow.offers_snapshot}
+        self.assertEqual(len(snapshot), 3)
+        self.assertEqual(snapshot[self.flow_offer.pk]['state'], 'disabled')
+        self.assertTrue(snapshot[self.flow_offer.pk]['is_pinned'])
+        self.assertEqual(snapshot[self.flow_offer.pk]['offer_name'], self.flow_offer.offer.name)
+        self.assertEqual(sum(item['share'] for item in snapshot.values()), 100)
+        call_command('recount', '--check', stdout=StringIO())
+
+    def test_recount_command_fixes_drift(self):
+        Flow.objects.filter(pk=self.flow.pk).update(active_offers_count=10)
+        Campaign.objects.filter(keitaro_id=1).update(flows_count=0)
+        FlowOffer.objects.filter(pk=self.flow_offer.pk).update(share=0)
+
+        with self.assertRaises(CommandError):
+            call_command('recount', '--check', stdout=StringIO())
+        call_command('recount', stdout=StringIO())
+
+        self.assertOffersCount(3, 3)
+        self.assertEqual(Campaign.objects.get(keitaro_id=1).flows_count, 2)
+        last = self.flow.offers_snapshot[-1]
+        self.assertEqual((last['id'], last['share']), (self.flow_offer.pk, 0))
+        call_command('recount', '--check', stdout=StringIO())
+
+
+class FlowVersionTests(FakeKeitaroTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sync_service.sync_campaigns()
+        self.campaign = Campaign.objects.get(keitaro_id=1)
+        self.sync_service.sync_streams(self.campaign)
+        self.flow = self.campaign.flows.first()
+        self.flow_offer = self.flow.flow_offers.first()
+        self.login()
+
+    def post(self, url_name, version, pk):
+        return self.client.post(reverse(url_name, kwargs={'pk': pk}), {'version': version})
+
+    def test_stale_version_gets_conflict(self):
+        seen = self.flow.version
+        response = self.post('campaigns:toggle_pin', seen, self.flow_offer.pk)
+        self.assertEqual(response.json()['version'], seen + 1)
+
+        # Второй пользователь редактирует поток, загруженный до первого изменения
+        response = self.post('campaigns:remove_offer', seen, self.flow_offer.pk)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['version'], seen + 1)
+        self.assertEqual(len(response.json()['flow']['offers']), 3)
+        self.flow_offer.refresh_from_db()
+        self.assertEqual(self.flow_offer.state, 'active')
+
+        self.assertEqual(self.post('campaigns:remove_offer', seen + 1, self.flow_offer.pk).status_code, 200)
+        self.assertEqual(self.post('campaigns:restore_offer', 'abc', self.flow_offer.pk).status_code, 400)
+
+    def test_invalid_pin_keeps_version(self):
+        first, second, third = self.flow.flow_offers.filter(state='active').order_by('pk')
+        FlowOffer.objects.filter(pk=first.pk).update(is_pinned=True, share=50)
+        FlowOffer.objects.filter(pk=second.pk).update(is_pinned=True, share=40)
+        FlowOffer.objects.filter(pk=third.pk).update(share=5)
+        seen = self.flow.version
+
+        # Все офферы закреплены, сумма 95% - изменение отклоняется целиком
+        response = self.post('campaigns:toggle_pin', seen, third.pk)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['version'], seen)
+        third.refresh_from_db()
+        self.flow.refresh_from_db()
+        self.assertEqual((third.is_pinned, third.share, self.flow.version), (False, 5, seen))
+
+        self.assertEqual(self.post('campaigns:toggle_pin', seen, first.pk).status_code, 200)
+
+    def test_sync_bumps_version(self):
+        seen = self.flow.version
+        self.sync_service.sync_streams(self.campaign)
+
+        self.assertEqual(self.post('campaigns:toggle_pin', seen, self.flow_offer.pk).status_code, 409)
+        self.flow_offer.refresh_from_db()
+        self.assertFalse(self.flow_offer.is_pinned)
+
+
+class ArchiveTests(FakeKeitaroTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sync_service.sync_campaigns()
+        self.campaign = Campaign.objects.get(keitaro_id=1)
+        self.sync_service.sync_streams(self.campaign)
+        self.expired = timezone.now() - timedelta(days=settings.ARCHIVE_RETENTION_DAYS + 1)
+        self.login()
+
+    def test_deleted_campaign_is_archived_and_restored(self):
+        FlowOffer.objects.filter(flow__campaign=self.campaign).update(is_pinned=True)
+        Campaign.objects.filter(pk=self.campaign.pk).update(state='deleted', deleted_at=self.expired)
+        Campaign.objects.filter(keitaro_id=2).update(state='deleted', deleted_at=timezone.now())
+
+        call_command('archive', stdout=StringIO())
+
+        self.assertFalse(Campaign.objects.filter(keitaro_id=1).exists())
+        self.assertFalse(Flow.objects.filter(campaign__keitaro_id=1).exists())
+        self.assertTrue(Campaign.objects.filter(keitaro_id=2).exists())
+        self.assertEqual(list(ArchivedRecord.objects.values_list('kind', 'campaign_keitaro_id')), [('campaign', 1)])
+
+        call_command('archive', '--restore-campaign', '1', stdout=StringIO())
+
+        campaign = Campaign.objects.get(keitaro_id=1)
+        self.assertEqual((campaign.state, campaign.created_at, campaign.flows_count),
+                         ('deleted', self.campaign.created_at, 2))
+        restored = FlowOffer.objects.filter(flow__campaign=campaign)
+        self.assertEqual(restored.count(), 6)
+        self.assertTrue(all(restored.values_list('is_pinned', flat=True)))
+        self.assertFalse(ArchivedRecord.objects.exists())
+        call_command('recount', '--check', stdout=StringIO())
+
+    def test_disabled_flow_offer_is_archived_and_restored(self):
+        flow = self.campaign.flows.first()
+        old, recent = flow.flow_offers.all()[:2]
+        for flow_offer in (old, recent):
+            self.client.post(reverse('campaigns:remove_offer', kwargs={'pk': flow_offer.pk}))
+        FlowOffer.objects.filter(pk=old.pk).update(disabled_at=self.expired)
+
+        self.assertEqual(archive.report()['flow_offers'], {'total': 6, 'removed': 2, 'expired': 1})
+        call_command('archive', stdout=StringIO())
+
+        self.assertFalse(FlowOffer.objects.filter(pk=old.pk).exists())
+        self.assertTrue(FlowOffer.objects.filter(pk=recent.pk).exists())
+        flow.refresh_from_db()
+        self.assertEqual((flow.active_offers_count, flow.total_offers_count), (1, 2))
+        report = archive.report()
+        self.assertEqual(report['archive']['flow_offer']['records'], 1)
+        self.assertGreater(report['archive']['flow_offer']['payload_bytes'], 0)
+
+        record = ArchivedRecord.objects.get()
+        call_command('archive', '--restore', str(record.pk), stdout=StringIO())
+        restored = flow.flow_offers.get(offer=old.offer)
+        self.assertEqual((restored.state, restored.share), ('disabled', 0))
+        call_command('recount', '--check', stdout=StringIO())
+
+        with self.assertRaises(CommandError):
+            call_command('archive', '--restore-campaign', '1', stdout=StringIO())
+
+
+class BulkCreateTests(FakeKeitaroTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.login()
+
+    def write_csv(self, text):
+        f = tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8', delete=False)
+        self.addCleanup(os.unlink, f.name)
+        with f:
+            f.write(text)
+        return f.name
+
+    def keitaro_posts(self):
+        return [path for method, path in self.server.app.requests if method == 'POST']
+
+    def test_command_creates_campaigns_with_retry(self):
+        path = self.write_csv('name,geo_codes,offer_id\n' + ''.join(
+            f'Bulk {i},"us, de",{i}\n' for i in range(1, 7)
+        ))
+        # Офферы уже в каталоге, поэтому первым запросом идёт POST: он завершается 503 и повторяется
+        self.sync_service.sync_offers()
+        self.server.app.fail_next(1, status=503)
+        self.server.app.requests.clear()
+
+        call_command('bulk_create_campaigns', path, '--user', str(self.user.pk), '--concurrency', '3',
+                     stdout=StringIO())
+
+        campaigns = Campaign.objects.filter(name__startswith='Bulk ')
+        self.assertEqual(campaigns.count(), 6)
+        # 6 кампаний, 12 потоков и один повтор
+        self.assertEqual(len(self.keitaro_posts()), 19)
+        for campaign in campaigns:
+            # Потоки создаются параллельно: порядок создания не определён, порядок показа задаёт position
+            streams = sorted(self.server.app.account.campaign_streams(campaign.keitaro_id), key=lambda s: s['position'])
+            self.assertEqual([stream['name'] for stream in streams], ['US, DE → Google', 'All → Offers'])
+
+    @override_settings(KEITARO_TIMEOUTS={'default': (1, 0.3)})
+    def test_timeout_after_create_does_not_duplicate_campaign(self):
+        self.sync_service.sync_offers()
+        self.server.app.stall_next(0.6)
+
+        creator = BulkCampaignCreator(self.user, concurrency=1)
+        rows = async_to_sync(creator.create_from_csv)('name,geo_codes,offer_id\nStalled,US,1\n')
+
+        self.assertEqual(rows[0].status, 'created', rows[0].errors)
+        campaigns = [c for c in self.server.app.account.campaigns.values() if c['name'] == 'Stalled']
+        self.assertEqual(len(campaigns), 1)
+        self.assertEqual(rows[0].keitaro_id, campaigns[0]['id'])
+        self.assertEqual(len(self.server.app.account.campaign_streams(campaigns[0]['id'])), 2)
+        self.assertEqual(Campaign.objects.filter(name='Stalled').count(), 1)
+
+    def test_timeout_after_create_does_not_duplicate_stream(self):
+        self.sync_service.sync_offers()
+        creator = BulkCampaignCreator(self.user, concurrency=1)
+        # Первый POST (кампания) проходит, ответ на первый поток теряется
+        self.server.app.stall_next(0, count=1)
+        self.server.app.stall_next(0.6, count=1)
+
+        with override_settings(KEITARO_TIMEOUTS={'default': (1, 0.3)}):
+            rows = async_to_sync(creator.create_from_csv)('name,geo_codes,offer_id\nStalled,US,1\n')
+
+        self.assertEqual(rows[0].status, 'created', rows[0].errors)
+        self.assertEqual(len(self.server.app.account.campaign_streams(rows[0].keitaro_id)), 2)
+
+    def test_invalid_rows_create_nothing(self):
+        text = 'name,geo_codes,offer_id\nGood,US,1\nGood,USA,x\n,US,999\n'
+        self.server.app.requests.clear()
+
+        response = self.client.post(reverse('campaigns:bulk_create_campaigns'), {'csv': text})
+
+        self.assertEqual(response.status_code, 400)
+        data = response.json()
+        self.assertEqual(data['summary'], {'created': 0, 'failed': 0, 'invalid': 2, 'skipped': 1})
+        self.assertEqual([row['status'] for row in data['rows']], ['skipped', 'invalid', 'invalid'])
+        self.assertEqual(len(data['rows'][1]['errors']), 3)
+        self.assertEqual(data['rows'][2]['errors'], ['Не указано название кампании', 'Оффер 999 не найден'])
+        self.assertEqual(self.keitaro_posts(), [])
+
+        response = self.client.post(reverse('campaigns:bulk_create_campaigns'),
+                                    {'csv': text, 'skip_invalid': 'true'})
+
+        data = response.json()
+        self.assertEqual(data['summary'], {'created': 1, 'failed': 0, 'invalid': 2, 'skipped': 0})
+        self.assertEqual(data['rows'][0]['campaign_id'], Campaign.objects.get(name='Good').pk)
+
+
+class CloneCampaignTests(FakeKeitaroTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sync_service.sync_campaigns()
+        self.campaign = Campaign.objects.get(keitaro_id=1)
+        account = self.server.app.account
+        first_stream = account.campaign_streams(1)[0]
+        first_stream['filters'] = [{'id': 1, 'stream_id': first_stream['id'], 'name': 'country', 'mode': 'accept',
+                                    'payload': ['US']}]
+        self.sync_service.sync_streams(self.campaign)
+        self.pinned = FlowOffer.objects.filter(flow__campaign=self.campaign).order_by('pk').first()
+        self.login()
+        self.client.post(reverse('campaigns:toggle_pin', kwargs={'pk': self.pinned.pk}))
+
+    def test_clone_copies_streams_and_offers(self):
+        self.server.app.requests.clear()
+
+        response = self.client.post(reverse('campaigns:clone_campaign', args=[self.campaign.pk]),
+                                    {'name': 'Copy', 'geo_codes': 'de, fr'})
+
+        data = response.json()
+        self.assertTrue(data['success'], data)
+        self.assertEqual(data['flows_count'], 2)
+        posts = [path for method, path in self.server.app.requests if method != 'GET']
+        self.assertEqual(sorted(posts), ['/admin_api/v1/campaigns'] + ['/admin_api/v1/streams'] * 2)
+
+        clone = Campaign.objects.get(pk=data['campaign_id'])
+        streams = self.server.app.account.campaign_streams(clone.keitaro_id)
+        self.assertEqual(sorted(s['filters'][0]['payload'] for s in streams if s.get('filters')), [['DE', 'FR']])
+
+        def layout(campaign):
+            return [
+                (flow.name, flow.position, sorted((o['offer_id'], o['share'], o['is_pinned']) for o in flow.offers_snapshot))
+                for flow in campaign.flows.order_by('position')
+            ]
+
+        self.assertEqual(layout(clone), layout(self.campaign))
+        self.assertTrue(FlowOffer.objects.get(flow__campaign=clone, flow__position=self.pinned.flow.position,
+                                              offer=self.pinned.offer).is_pinned)
+        self.assertEqual(clone.flows_count, 2)
+        # Счётчики и снимки заполнены при вставке
+        call_command('recount', '--check', stdout=StringIO())
+
+    def test_clone_of_unknown_campaign(self):
+        response = self.client.post(reverse('campaigns:clone_campaign', args=[999]), {'name': 'Copy'})
+        self.assertEqual(response.status_code, 404)
+
+
+class ExportTests(FakeKeitaroTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sync_service.sync_campaigns()
+        self.sync_service.sync_streams(Campaign.objects.get(keitaro_id=1))
+        Campaign.objects.filter(keitaro_id=5).update(state='deleted')
+        self.login()
+
+    def export(self, dataset, **params):
+        response = self.client.get(reverse('campaigns:export', args=[dataset]), params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_export(self):
+        campaigns = list(csv.DictReader(StringIO(self.export('campaigns'))))
+        self.assertEqual([row['keitaro_id'] for row in campaigns], ['1', '2', '3', '4'])
+        self.assertEqual(len(list(csv.DictReader(StringIO(self.export('campaigns', deleted='1'))))), 5)
+
+        flows = list(csv.DictReader(StringIO(self.export('flows'))))
+        self.assertEqual([(row['campaign_keitaro_id'], row['total_offers_count']) for row in flows], [('1', '3')] * 2)
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_ndjson_export_command(self):
+        out = StringIO()
+        call_command('export', 'shares', '--format', 'ndjson', stdout=out)
+
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(sum(row['share'] for row in rows), 200)
+        self.assertEqual(set(rows[0]), {'campaign_keitaro_id', 'campaign_name', 'flow_keitaro_id', 'flow_name',
+                                        'offer_keitaro_id', 'offer_name', 'share', 'is_pinned', 'state'})
+
+    def test_unknown_dataset_or_format(self):
+        self.assertEqual(self.client.get(reverse('campaigns:export', args=['users'])).status_code, 404)
+        response = self.client.get(reverse('campaigns:export', args=['flows']), {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+
+class IndexUsageTests(FakeKeitaroTestCase):
+    """Планировщик использует индексы, подобранные под запросы списка, автодополнения и пересчёта share"""
+
+    def setUp(self):
+        super().setUp()
+        self.sync_service.sync_campaigns()
+        self.sync_service.sync_streams(Campaign.objects.get(keitaro_id=1))
+        self.sync_service.sync_offers()
+
+    def assertUsesIndex(self, queryset, index_name):
+        if connection.vendor == 'postgresql':
+            # На маленьком наборе Postgres предпочёл бы полный просмотр таблицы
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        self.assertIn(index_name, queryset.explain())
+
+    def test_campaign_list_index(self):
+        self.assertUsesIndex(Campaign.objects.exclude(state='deleted').order_by('-created_at'),
+                             'campaigns_live_created_idx')
+
+    def test_offer_autocomplete_index(self):
+        offers = Offer.objects.visible_to(self.user).filter(name__icontains='offer', state='active').order_by('name')[:20]
+        self.assertUsesIndex(offers, 'offers_active_name_idx')
+
+    def test_active_flow_offers_index(self):
+        flow = Flow.objects.first()
+        self.assertUsesIndex(flow.flow_offers.filter(state='active'), 'flow_offers_active_idx')
+
+
+class FakeClock:
+    """Управляемые часы для тестов (секунды)"""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(error_rate=0.5, min_calls=4, window=10, cooldown=5, clock=self.clock)
+
+    def fail(self, count):
+        for _ in range(count):
+            self.breaker.before_request()
+            self.breaker.record_failure()
+
+    def test_opens_at_error_rate_after_min_calls(self):
+        self.fail(3)
+        self.assertEqual(self.breaker.state, STATE_CLOSED)
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, STATE_CLOSED)
+        self.fail(1)
+
+        self.assertEqual(self.breaker.state, STATE_OPEN)
+        self.assertFalse(self.breaker.allows_requests())
+        with self.assertRaises(KeitaroCircuitOpenException):
+            self.breaker.before_request()
+
+    def test_window_forgets_old_failures(self):
+        self.fail(3)
+        self.clock.advance(11)
+        self.breaker.record_success()
+        self.fail(1)
+
+        # Три старые ошибки вышли из окна: в окне 2 события, меньше min_calls
+        self.assertEqual(self.breaker.stats(), {'state': STATE_CLOSED, 'calls': 2, 'failures': 1})
+
+    def test_half_open_allows_single_probe(self):
+        self.fail(4)
+        self.clock.advance(5)
+
+        self.assertEqual(self.breaker.state, STATE_HALF_OPEN)
+        self.breaker.before_request()
+        with self.assertRaises(KeitaroCircuitOpenException):
+            self.breaker.before_request()
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, STATE_CLOSED)
+        self.assertEqual(self.breaker.stats()['calls'], 1)
+        self.breaker.before_request()
+
+    def test_failed_probe_reopens(self):
+        self.fail(4)
+        self.clock.advance(5)
+        self.breaker.before_request()
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, STATE_OPEN)
+        self.clock.advance(4)
+        with self.assertRaises(KeitaroCircuitOpenException):
+            self.breaker.before_request()
+        self.clock.advance(1)
+        self.breaker.before_request()
+
+
+class RetryPolicyTests(SimpleTestCase):
+
+    def test_only_idempotent_methods_are_retried(self):
+        policy = RetryPolicy(max_retries=3, backoff=0.5, backoff_max=4)
+        self.assertEqual(policy.attempts_for('get'), 4)
+        self.assertEqual(policy.attempts_for('POST'), 1)
+        self.assertEqual(policy.attempts_for('PUT'), 1)
+
+    def test_delay_is_jittered_and_capped(self):
+        policy = RetryPolicy(max_retries=3, backoff=0.5, backoff_max=4)
+        for attempt, limit in ((0, 0.5), (1, 1), (2, 2), (3, 4), (10, 4)):
+            delays = [policy.delay(attempt) for _ in range(50)]
+            self.assertTrue(all(0 <= delay <= limit for delay in delays), (attempt, max(delays)))
+
+
+def _take_tokens(directory, count, results):
+    """Процесс-конкурент: берёт count токенов без ожидания из общего файла бакета"""
+    bucket = TokenBucket('shared', rate=0.001, capacity=5, directory=directory)
+    results.put(sum(1 for _ in range(count) if bucket.try_acquire() == 0))
+
+
+class TokenBucketTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.clock = FakeClock()
+
+    def bucket(self, rate=10, capacity=3, **options):
+        return TokenBucket('test', rate=rate, capacity=capacity, directory=self.directory, **options)
+
+    def test_burst_and_refill(self):
+        bucket = self.bucket(clock=self.clock)
+
+        self.assertEqual([bucket.try_acquire() for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(bucket.try_acquire(), 0.1)
+
+        self.clock.advance(0.25)
+        self.assertEqual([bucket.try_acquire() for _ in range(2)], [0, 0])
+        self.assertAlmostEqual(bucket.try_acquire(), 0.05)
+
+        # Пополнение ограничено ёмкостью
+        self.clock.advance(60)
+        self.assertEqual([bucket.try_acquire() for _ in range(3)], [0, 0, 0])
+        self.assertGreater(bucket.try_acquire(), 0)
+
+    def test_acquire_blocks_until_refill(self):
+        bucket = self.bucket(rate=20, capacity=1)
+        bucket.acquire()
+
+        started = time.perf_counter()
+        bucket.acquire(max_wait=1)
+        self.assertGreaterEqual(time.perf_counter() - started, 0.04)
+
+        with self.assertRaises(KeitaroRateLimitException):
+            bucket.acquire(max_wait=0.01)
+
+    def test_async_acquire_blocks_until_refill(self):
+        bucket = self.bucket(rate=20, capacity=1)
+
+        async def acquire_twice():
+            await bucket.aacquire()
+            await bucket.aacquire(max_wait=1)
+
+        started = time.perf_counter()
+        async_to_sync(acquire_twice)()
+        self.assertGreaterEqual(time.perf_counter() - started, 0.04)
+
+    @skipUnless(fcntl, 'Общий бюджет между процессами требует flock')
+    def test_budget_is_shared_through_file(self):
+        # Разные объекты (как в разных воркерах) сериализуются только блокировкой файла
+        buckets = [TokenBucket('shared', rate=0.001, capacity=5, directory=self.directory) for _ in range(4)]
+        acquired = []
+
+        def take(bucket):
+            acquired.extend(1 for _ in range(5) if bucket.try_acquire() == 0)
+
+        threads = [threading.Thread(target=take, args=(bucket,)) for bucket in buckets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(acquired), 5)
+
+    @skipUnless(fcntl, 'Общий бюджет между процессами требует flock')
+    def test_budget_is_shared_between_processes(self):
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        processes = [context.Process(target=_take_tokens, args=(self.directory, 5, results)) for _ in range(2)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(10)
+        self.assertEqual(results.get(timeout=5) + results.get(timeout=5), 5)
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.group = SingleFlight(clock=self.clock)
+        self.calls = 0
+
+    def run_concurrently(self, fn, callers=5):
+        """Вызовы do из нескольких потоков: ведущий ждёт, пока остальные присоединятся"""
+        release = threading.Event()
+        results, errors = [], []
+
+        def leader_fn():
+            self.calls += 1
+            release.wait(5)
+            return fn()
+
+        def call():
+            try:
+                results.append(self.group.do('key', leader_fn))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while self.group.stats()['coalesced'] < callers - 1 and time.monotonic() < deadline:
+            time.sleep(0.005)
+        release.set()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_callers_share_one_call(self):
+        results, errors = self.run_concurrently(lambda: {'items': [1, 2]})
+
+        self.assertEqual((self.calls, errors), (1, []))
+        self.assertEqual(results, [{'items': [1, 2]}] * 5)
+        # Ожидающие получают копии: изменение одного результата не видно другим
+        results[0]['items'].append(3)
+        self.assertEqual(sum(result['items'] == [1, 2] for result in results), 4)
+        self.assertEqual(self.group.stats()['executed'], 1)
+
+    def test_error_is_raised_to_all_waiters(self):
+        def fail():
+            raise KeitaroConnectionException('down')
+
+        results, errors = self.run_concurrently(fail)
+
+        self.assertEqual((self.calls, results), (1, []))
+        self.assertEqual(len(errors), 5)
+        self.assertTrue(all(isinstance(error, KeitaroConnectionException) for error in errors))
+        # Ошибка не кэшируется
+        self.assertEqual(self.group.do('key', lambda: 'ok', ttl=10), 'ok')
+
+    def test_microcache_ttl_and_forget(self):
+        def fetch():
+            self.calls += 1
+            return self.calls
+
+        self.assertEqual(self.group.do('a', fetch, ttl=2), 1)
+        self.assertEqual(self.group.do('a', fetch, ttl=2), 1)
+        self.clock.advance(2)
+        self.assertEqual(self.group.do('a', fetch, ttl=2), 2)
+        self.assertEqual(self.group.stats()['microcache_hits'], 1)
+
+        self.group.do('b', fetch, ttl=2)
+        self.group.forget(lambda key: key == 'a')
+        self.assertEqual(self.group.do('a', fetch, ttl=2), 4)
+        self.assertEqual(self.group.do('b', fetch, ttl=2), 3)
+        self.group.forget()
+        self.assertEqual(self.group.do('b', fetch, ttl=2), 5)
+        # Без ttl результат не кэшируется
+        self.assertEqual(self.group.do('c', fetch), 6)
+        self.assertEqual(self.group.do('c', fetch), 7)
+
+    def test_async_callers_share_one_call(self):
+        group = AsyncSingleFlight()
+
+        async def fetch():
+            self.calls += 1
+            await asyncio.sleep(0.05)
+            return b'body'
+
+        async def fail():
+            self.calls += 1
+            await asyncio.sleep(0.05)
+            raise KeitaroConnectionException('down')
+
+        async def scenario():
+            results = await asyncio.gather(*(group.do('key', fetch) for _ in range(5)))
+            errors = await asyncio.gather(*(group.do('key', fail) for _ in range(3)), return_exceptions=True)
+            return results, errors
+
+        results, errors = async_to_sync(scenario)()
+
+        self.assertEqual(results, [b'body'] * 5)
+        self.assertTrue(all(isinstance(error, KeitaroConnectionException) for error in errors))
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(group.stats(), {'executed': 2, 'coalesced': 6})
+
+
+class ResponseCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = LRUResponseCache(max_bytes=30, max_entry_bytes=20, clock=self.clock)
+
+    def test_entry_expires_after_ttl(self):
+        self.cache.set('a', b'body', ttl=10, tags=['campaigns'])
+
+        self.clock.advance(9.9)
+        self.assertEqual(self.cache.get('a'), b'body')
+        self.clock.advance(0.1)
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        self.cache.set('a', b'x' * 10, ttl=60, tags=[])
+        self.cache.set('b', b'x' * 10, ttl=60, tags=[])
+        self.cache.get('a')
+        self.cache.set('c', b'x' * 15, ttl=60, tags=[])
+        # Запись больше max_entry_bytes не сохраняется и ничего не вытесняет
+        self.cache.set('d', b'x' * 25, ttl=60, tags=[])
+
+        self.assertEqual(self.cache.get('a'), b'x' * 10)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('c'), b'x' * 15)
+        self.assertIsNone(self.cache.get('d'))
+        stats = self.cache.stats()
+        self.assertEqual((stats['bytes'], stats['evictions']), (25, 1))
+
+    def test_invalidate_drops_entries_with_any_tag(self):
+        self.cache.set('streams', b'1', ttl=60, tags=read_tags('campaigns/5/streams'))
+        self.cache.set('other', b'2', ttl=60, tags=read_tags('campaigns/6/streams'))
+        self.cache.set('offers', b'3', ttl=60, tags=read_tags('offers'))
+
+        self.cache.invalidate(*write_tags('POST', 'streams', {'campaign_id': 5}))
+        self.assertEqual([self.cache.get(key) for key in ('streams', 'other', 'offers')], [None, b'2', b'3'])
+
+        self.cache.invalidate(*write_tags('PUT', 'streams/7'))
+        self.assertEqual([self.cache.get(key) for key in ('other', 'offers')], [None, b'3'])
+        self.assertEqual(self.cache.stats()['invalidations'], 2)
+
+    def test_django_cache_invalidates_by_tag_versions(self):
+        cache = DjangoResponseCache(prefix='test-keitaro')
+        cache.clear()
+        cache.set('streams', b'1', ttl=60, tags=read_tags('campaigns/5/streams'))
+        cache.set('offers', b'2', ttl=60, tags=read_tags('offers'))
+
+        cache.invalidate('campaigns/{id}/streams')
+
+        self.assertIsNone(cache.get('streams'))
+        self.assertEqual(cache.get('offers'), b'2')
+        # Запись после сброса сохраняется с новой версией тега
+        cache.set('streams', b'3', ttl=60, tags=read_tags('campaigns/5/streams'))
+        self.assertEqual(cache.get('streams'), b'3')
+
+    def test_base_cache_is_abstract(self):
+        with self.assertRaises(TypeError):
+            BaseResponseCache()
+
+
+class JsonStreamTests(SimpleTestCase):
+
+    def splits(self, document: str):
+        """Документ, разрезанный на два фрагмента во всех позициях, и побайтно"""
+        data = document.encode()
+        for i in range(len(data) + 1):
+            yield [data[:i], data[i:]]
+        yield [data[i:i + 1] for i in range(len(data))]
+
+    def test_chunk_boundaries_inside_strings_and_escapes(self):
+        items = [
+            {'name': 'Оффер "A", ч.1', 'path': 'C:\\x\\', 'tab': '\t', 'u': '\u00e9\U0001f600'},
+            'a]b,c',
+            -12.5e3,
+            True,
+            None,
+        ]
+        document = json.dumps(items)
+        for chunks in self.splits(document):
+            self.assertEqual(list(iter_json_array(chunks)), items)
+        # Не-ASCII без экранирования: многобайтовые символы UTF-8 разрезаются между фрагментами
+        document = json.dumps(items, ensure_ascii=False)
+        for chunks in self.splits(document):
+            self.assertEqual(list(iter_json_array(chunks)), items)
+
+    def test_nested_arrays_are_yielded_whole(self):
+        items = [[1, [2, []]], {'offers': [{'id': 1}, {'id': 2}]}, []]
+        for chunks in self.splits(' \n' + json.dumps(items, indent=2) + '\n'):
+            self.assertEqual(list(iter_json_array(chunks)), items)
+
+    def test_empty_array_and_empty_body(self):
+        for document in ('[]', ' [ ] ', '\n[\n]\n'):
+            for chunks in self.splits(document):
+                self.assertEqual(list(iter_json_array(chunks)), [])
+        self.assertEqual(list(iter_json_array([])), [])
+        self.assertEqual(list(iter_json_array([b'', b'  '])), [])
+
+    def test_truncated_input_raises(self):
+        for document in ('[', '[1,', '[{"id": 1}', '[{"id": 1', '["abc', '["a\\', '[tr', '[1, 2'):
+            for chunks in self.splits(document):
+                with self.assertRaises(ValueError, msg=document):
+                    list(iter_json_array(chunks))
+
+    def test_non_array_input_raises(self):
+        for document in ('{"id": 1}', '"text"', '1', 'null', '<html>', '[1 2]', '[1,,2]'):
+            with self.assertRaises(ValueError, msg=document):
+                list(iter_json_array([document.encode()]))
+
+    def test_items_are_yielded_before_the_whole_body_is_read(self):
+        def chunks():
+            yield b'[{"id": 1}, '
+            yield b'{"id": 2}, '
+            raise AssertionError('Читать дальше не нужно')
+
+        items = iter_json_array(chunks())
+        self.assertEqual(next(items), {'id': 1})
+
+
+class KeitaroClientTests(FakeKeitaroTestCase):
+
+    def test_get_is_retried_after_server_error(self):
+        self.server.app.fail_next(1, status=503)
+
+        streams = KeitaroClient(self.server.url, 'test-key').get_streams(1)
+
+        self.assertEqual(len(streams), 2)
+
+    def test_refused_connection_is_not_sent(self):
+        with self.assertRaises(KeitaroRequestNotSentException):
+            KeitaroClient('http://127.0.0.1:1', 'test-key').create_campaign('Refused')
+
+        async def create():
+            async with AsyncKeitaroClient('http://127.0.0.1:1', 'test-key') as client:
+                await client.create_campaign('Refused')
+
+        with self.assertRaises(KeitaroRequestNotSentException):
+            async_to_sync(create)()
+
+    def test_calls_are_traced(self):
+        self.server.app.fail_next(1, status=503)
+
+        with tracer.collect() as calls:
+            KeitaroClient(self.server.url, 'test-key').get_streams(1)
+
+        [call] = calls
+        self.assertEqual((call.method, call.endpoint, call.status, call.retries), ('GET', 'campaigns/{id}/streams', 200, 1))
+        self.assertGreater(call.bytes, 0)
+        self.assertIn('GET campaigns/{id}/streams', KeitaroClient.trace_stats())
+
+    def test_invalid_api_key(self):
+        client = KeitaroClient(self.server.url, 'wrong-key')
+
+        self.assertFalse(client.validate_api_key())
+        with self.assertRaises(KeitaroAuthException):
+            client.get_offers()
+
+
+class AsyncViewsTests(FakeKeitaroTestCase):
+    """Async views через AsyncClient: middleware и views работают в режиме ASGI"""
+
+    def setUp(self):
+        super().setUp()
+        self.sync_service.sync_campaigns()
+        self.campaign = Campaign.objects.get(keitaro_id=1)
+        self.sync_service.sync_streams(self.campaign)
+        self.login()
+        self.async_client.cookies = self.client.cookies
+
+    async def test_check_sync_compares_streams_concurrently(self):
+        flow = await self.campaign.flows.afirst()
+        await FlowOffer.objects.filter(flow=flow, state='active').aupdate(share=1)
+        self.server.app.latency = 0.3
+
+        started = time.perf_counter()
+        response = await self.async_client.get(reverse('campaigns:check_sync', args=[self.campaign.pk]))
+        elapsed = time.perf_counter() - started
+
+        data = response.json()
+        self.assertTrue(data['has_differences'])
+        self.assertEqual([d['flow_id'] for d in data['differences']], [flow.id])
+        self.assertEqual(response['X-Keitaro-Calls'], '2')
+        # Два вызова по 0.3 с выполняются параллельно
+        self.assertLess(elapsed, 0.55)
+
+    @override_settings(CHECK_SYNC_CONCURRENCY=1)
+    async def test_check_sync_concurrency_is_bounded(self):
+        self.server.app.latency = 0.2
+
+        started = time.perf_counter()
+        response = await self.async_client.get(reverse('campaigns:check_sync', args=[self.campaign.pk]))
+        elapsed = time.perf_counter() - started
+
+        self.assertTrue(response.json()['success'])
+        # Два вызова выполняются по очереди
+        self.assertGreaterEqual(elapsed, 0.4)
+
+    async def test_async_client_has_no_sync_session(self):
+        async with AsyncKeitaroClient(self.server.url, 'test-key') as client:
+            self.assertIsInstance(client.session, httpx.AsyncClient)
+            self.assertNotIsInstance(client, KeitaroClient)
+            self.assertFalse(hasattr(client, 'iter_offers'))
+            self.assertEqual(len(await client.get_offers()), len(self.server.app.account.offers))
+
+    async def test_push_to_keitaro(self):
+        flow = await self.campaign.flows.afirst()
+        first, *rest = [fo async for fo in flow.flow_offers.filter(state='active').select_related('offer')]
+        first.share = 100
+        await first.asave()
+        await FlowOffer.objects.filter(pk__in=[fo.pk for fo in rest]).aupdate(state='disabled', share=0)
+
+        response = await self.async_client.post(reverse('campaigns:push_to_keitaro', args=[flow.pk]))
+
+        self.assertTrue(response.json()['success'])
+        stream = self.server.app.account.streams[flow.keitaro_id]
+        self.assertEqual([(o['offer_id'], o['share']) for o in stream['offers']], [(first.offer.keitaro_id, 100)])
+        # SQL запросы из потока sync_to_async учитываются middleware в режиме ASGI
+        self.assertGreater(int(response['X-DB-Query-Count']), 0)
+
+    async def test_export_streams_asynchronously(self):
+        response = await self.async_client.get(reverse('campaigns:export', args=['shares']), {'format': 'ndjson'})
+
+        self.assertTrue(response.is_async)
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual(len(body.splitlines()), await FlowOffer.objects.acount())
+
+    async def test_fetch_streams(self):
+        response = await self.async_client.post(reverse('campaigns:fetch_streams', args=[self.campaign.pk]))
+
+        self.assertEqual(response.json()['count'], 2)
+        self.assertEqual(await self.campaign.flows.acount(), 2)
+
+    async def test_create_campaign_fetches_missing_offer(self):
+        self.server.app.requests.clear()
+
+        response = await self.async_client.post(reverse('campaigns:create_campaign'), {
+            'name': 'Async campaign',
+            'geo_codes': 'us, de',
+            'offer_id': 7,
+            'offer_name': 'Offer 7',
+        })
+
+        data = response.json()
+        self.assertTrue(data['success'], data)
+        campaign = await Campaign.objects.aget(pk=data['campaign_id'])
+        self.assertEqual(len(self.server.app.account.campaign_streams(campaign.keitaro_id)), 2)
+        self.assertTrue(await Offer.objects.visible_to(self.user).filter(keitaro_id=7).aexists())
+        # Загружен только нужный оффер, без синхронизации каталога
+        self.assertIn(('GET', '/admin_api/v1/offers/7'), self.server.app.requests)
+        self.assertNotIn(('GET', '/admin_api/v1/offers'), self.server.app.requests)
+
+    def test_stats(self):
+        response = self.client.post(reverse('campaigns:campaign_stats'), {'campaign_ids[]': [self.campaign.pk]})
+
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertIn(str(self.campaign.pk), data['stats'])
+
+
+class ReplicaRouterTests(TestCase):
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.state = ReplicaState()
+        token = replica_state_var.set(self.state)
+        self.addCleanup(replica_state_var.reset, token)
+
+    def test_reads_use_replica_until_write(self):
+        self.assertEqual(self.router.db_for_read(Campaign), 'default')
+
+        allow_replica_reads()
+        self.assertEqual(self.router.db_for_read(Campaign), 'replica')
+        self.assertEqual(self.router.db_for_read(User), 'default')
+
+        self.assertEqual(self.router.db_for_write(Flow), 'default')
+        self.assertEqual(self.router.db_for_read(Campaign), 'default')
+        self.assertTrue(self.state.wrote)
+
+    def test_session_sticks_to_primary_after_write(self):
+        read_databases = []
+
+        def view(request):
+            allow_replica_reads()
+            read_databases.append(self.router.db_for_read(Offer))
+            if request.method == 'POST':
+                self.router.db_for_write(Flow)
+            return HttpResponse()
+
+        middleware = ReplicaStickinessMiddleware(view)
+        middleware.enabled = True
+        session = SessionStore()
+        for method in ('get', 'post', 'get'):
+            request = getattr(RequestFactory(), method)('/')
+            request.session = session
+            middleware(request)
+
+        self.assertEqual(read_databases, ['replica', 'replica', 'default'])
+        with override_settings(DB_REPLICA_STICKY_SECONDS=0):
+            request = RequestFactory().post('/')
+            request.session = session
+            middleware(request)
+        request = RequestFactory().get('/')
+        request.session = session
+        middleware(request)
+        self.assertEqual(read_databases[-1], 'replica')
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, FakeKeitaroTestCase):
+    account_options = dict(FakeKeitaroTestCase.account_options, campaigns=20, streams_per_campaign=4)
+
+    def setUp(self):
+        super().setUp()
+        self.sync_service.sync_offers()
+        self.sync_service.sync_campaigns()
+        self.campaign = Campaign.objects.get(keitaro_id=1)
+        self.sync_service.sync_streams(self.campaign)
+        self.flow = self.campaign.flows.first()
+        self.login()
+
+    def test_campaign_list(self):
+        with self.assertQueryBudget('campaigns:campaign_list'):
+            response = self.client.get(reverse('campaigns:campaign_list'))
+        self.assertEqual(len(response.context['campaigns']), 20)
+
+    def test_campaign_detail(self):
+        with self.assertQueryBudget('campaigns:campaign_detail'):
+            self.client.get(reverse('campaigns:campaign_detail', args=[self.campaign.pk]))
+
+    def test_campaign_detail_api(self):
+        with self.assertQueryBudget('campaigns:campaign_detail_api'):
+            response = self.client.get(reverse('campaigns:campaign_detail_api', args=[self.campaign.pk]))
+        flows = response.json()['flows']
+        self.assertEqual(len(flows), 4)
+        self.assertEqual([o['share'] for o in flows[0]['offers']], sorted((o['share'] for o in flows[0]['offers']), reverse=True))
+        self.assertEqual({o['offer_id'] for o in flows[0]['offers']},
+                         set(self.campaign.flows.get(pk=flows[0]['id']).flow_offers.values_list('offer__keitaro_id', flat=True)))
+
+    def test_offer_autocomplete(self):
+        with self.assertQueryBudget('campaigns:offer_autocomplete'):
+            self.client.get(reverse('campaigns:offer_autocomplete'), {'q': 'Offer'})
+
+    def test_add_offer(self):
+        offer = Offer.objects.exclude(flow_offers__flow=self.flow).filter(state='active').first()
+        with self.assertQueryBudget('campaigns:add_offer'):
+            response = self.client.post(reverse('campaigns:add_offer', args=[self.flow.pk]), {'offer_id': offer.keitaro_id})
+        self.assertEqual(response.status_code, 200)
+
+    def test_fetch_streams(self):
+        with self.assertQueryBudget('campaigns:fetch_streams'):
+            response = self.client.post(reverse('campaigns:fetch_streams', args=[self.campaign.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.campaign.flows.count(), 4)
+
+    def test_push_to_keitaro(self):
+        with self.assertQueryBudget('campaigns:push_to_keitaro'):
+            response = self.client.post(reverse('campaigns:push_to_keitaro', args=[self.flow.pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_middleware_headers(self):
+        response = self.client.get(reverse('campaigns:campaign_detail', args=[self.campaign.pk]))
+
+        self.assertGreater(int(response['X-DB-Query-Count']), 0)
+        self.assertIn('X-DB-Time-Ms', response)
+
+    @override_settings(QUERY_BUDGETS={'campaigns:campaign_detail': 1})
+    def test_over_budget_is_logged(self):
+        with self.assertLogs('config.middleware', level='WARNING') as logs:
+            self.client.get(reverse('campaigns:campaign_detail', args=[self.campaign.pk]))
+
+        self.assertIn('campaigns:campaign_detail', logs.output[0])
+
+
+class MetricsTests(FakeKeitaroTestCase):
+
+    def setUp(self):
+        super().setUp()
+        metrics_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(metrics_dir.cleanup)
+        settings_override = override_settings(METRICS_DIR=metrics_dir.name, METRICS_TOKEN='secret')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        metrics.registry.reset()
+        self.login()
+
+    def test_metrics_endpoint(self):
+        self.sync_service.sync_campaigns()
+        self.client.get(reverse('campaigns:campaign_list'))
+
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+
+        body = response.content.decode()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('http_requests_total{view="campaigns:campaign_list",method="GET",status="200"} 1', body)
+        self.assertIn('sync_job_rows_total{job="campaigns"} 5', body)
+        self.assertIn('keitaro_calls_total{method="GET",endpoint="campaigns",status="200"} 1', body)
+        self.assertIn('process_resident_memory_bytes{pid=', body)
+
+    def test_metrics_token_required(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_denied_without_token_setting(self):
+        self.client.logout()
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    def test_only_metrics_path_skips_login(self):
+        self.client.logout()
+        response = self.client.get('/metricsfoo/')
+        self.assertRedirects(response, reverse('users:login'), fetch_redirect_response=False)
+
+    def test_db_pool_metrics(self):
+        from psycopg_pool import ConnectionPool
+        pool = ConnectionPool('', open=False, min_size=1, max_size=3)
+
+        metrics.observe_db_pool('default', pool)
+        metrics.registry.flush()
+
+        body = metrics.registry.render()
+        self.assertIn('db_pool_max_connections{alias="default",pid=', body)
+        self.assertIn('db_pool_connections{alias="default",state="idle",pid=', body)
+        self.assertNotIn('db_pool_errors_total{', body)
+
+
+class ProfilingTests(FakeKeitaroTestCase):
+
+    def setUp(self):
+        super().setUp()
+        profiles_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(profiles_dir.cleanup)
+        settings_override = override_settings(PROFILING_DIR=profiles_dir.name, PROFILING_MAX_PROFILES=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.sync_service.sync_campaigns()
+        self.campaign = Campaign.objects.get(keitaro_id=1)
+        self.login()
+
+    def test_staff_request_is_profiled(self):
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        url = reverse('campaigns:fetch_streams', args=[self.campaign.pk])
+
+        for _ in range(3):
+            response = self.client.post(url, HTTP_X_PROFILE='1')
+
+        profiles = self.client.get(reverse('campaigns:profile_list')).context['profiles']
+        self.assertEqual(len(profiles), 2)
+        self.assertEqual(profiles[0]['name'], response['X-Profile-Id'])
+        self.assertEqual(profiles[0]['view'], 'campaigns:fetch_streams')
+        self.assertEqual(profiles[0]['keitaro'][0]['endpoint'], 'campaigns/{id}/streams')
+        self.assertGreater(profiles[0]['sql_queries'], 0)
+        self.assertTrue(profiles[0]['top_functions'])
+
+    def test_profiling_requires_staff(self):
+        response = self.client.get(reverse('campaigns:campaign_list'), {'_profile': '1'})
+
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(self.client.get(reverse('campaigns:profile_list')).status_code, 403)
@@ -9,6 +9,7 @@ urlpatterns = [
     
     # Детали кампании
     path('<int:pk>/', views.CampaignDetailView.as_view(), name='campaign_detail'),
+    path('<int:pk>/api/', views.CampaignDetailAPIView.as_view(), name='campaign_detail_api'),
     
     # AJAX endpoints для синхронизации
     path('<int:pk>/fetch-streams/', views.FetchStreamsView.as_view(), name='fetch_streams'),
@@ -17,6 +18,8 @@ urlpatterns = [
     
     # Создание кампании
     path('create/', views.CreateCampaignView.as_view(), name='create_campaign'),
+    path('create/bulk/', views.BulkCreateCampaignsView.as_view(), name='bulk_create_campaigns'),
+    path('<int:pk>/clone/', views.CloneCampaignView.as_view(), name='clone_campaign'),
     
     # AJAX endpoints для управления офферами
     path('flow/<int:flow_id>/add-offer/', views.AddOfferView.as_view(), name='add_offer'),
@@ -31,5 +34,12 @@ urlpatterns = [
     
     # Статистика
     path('stats/', views.CampaignStatsAPIView.as_view(), name='campaign_stats'),
+    
+    # Выгрузка (CSV/NDJSON)
+    path('export/<str:dataset>/', views.ExportView.as_view(), name='export'),
+    
+    # Профили запросов (staff)
+    path('profiles/', views.ProfileListView.as_view(), name='profile_list'),
+    path('profiles/<str:name>/download/', views.ProfileDownloadView.as_view(), name='profile_download'),
 ]
 
@@ -1,15 +1,21 @@
 """
 Views для управления кампаниями, потоками и офферами
 """
-from .campaign_views import CampaignListView, CampaignDetailView, CreateCampaignView
+from .campaign_views import (CampaignListView, CampaignDetailView, CampaignDetailAPIView, CreateCampaignView,
+                             BulkCreateCampaignsView, CloneCampaignView)
 from .flow_views import SyncCampaignsView, FetchStreamsView, CheckSyncView, PushToKeitaroView, CancelChangesView
 from .offer_views import AddOfferView, RemoveOfferView, RestoreOfferView, TogglePinView, OfferAutocompleteView
 from .stats_views import CampaignStatsAPIView
+from .export_views import ExportView
+from .profiling_views import ProfileListView, ProfileDownloadView
 
 __all__ = [
     'CampaignListView',
     'CampaignDetailView',
+    'CampaignDetailAPIView',
     'CreateCampaignView',
+    'BulkCreateCampaignsView',
+    'CloneCampaignView',
     'SyncCampaignsView',
     'FetchStreamsView',
     'CheckSyncView',
@@ -21,5 +27,8 @@ __all__ = [
     'TogglePinView',
     'OfferAutocompleteView',
     'CampaignStatsAPIView',
+    'ExportView',
+    'ProfileListView',
+    'ProfileDownloadView',
 ]
 
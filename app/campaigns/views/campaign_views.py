@@ -1,20 +1,24 @@
 """
 Views для управления кампаниями
 """
+import asyncio
+from asgiref.sync import sync_to_async
 from django.views.generic import ListView, DetailView
 from django.views import View
 from django.shortcuts import get_object_or_404
 from django.http import JsonResponse
-from django.db import transaction
-from django.db.models import Count
 from django.conf import settings
-from ..models import Campaign, Offer
-from ..services import KeitaroSyncService, KeitaroClient
-from ..forms import CreateCampaignForm
-from config.exceptions import KeitaroAPIException
+from ..models import Campaign
+from ..services import AsyncKeitaroClient, KeitaroSyncService
+from ..services.bulk_create import BulkCampaignCreator, campaign_streams, parse_geo_codes, summarize
+from ..services.clone import clone_campaign
+from ..services.resilience import get_breaker
+from ..forms import CreateCampaignForm, CloneCampaignForm
+from config.db_router import ReplicaReadMixin
+from config.exceptions import CampaignCloneException, KeitaroAPIException
 
 
-class CampaignListView(ListView):
+class CampaignListView(ReplicaReadMixin, ListView):
     """Список рекламных кампаний"""
     model = Campaign
     template_name = 'campaigns/campaign_list.html'
@@ -23,17 +27,11 @@ class CampaignListView(ListView):
     
     def get_queryset(self):
         """Получение всех активных кампаний (исключая удалённые)"""
+        # Количество потоков хранится в Campaign.flows_count - агрегат не нужен
         return Campaign.objects.exclude(state='deleted').order_by('-created_at')
-    
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        # Добавляем количество потоков для каждой кампании
-        for campaign in context['campaigns']:
-            campaign.flows_count = campaign.flows.count()
-        return context
 
 
-class CampaignDetailView(DetailView):
+class CampaignDetailView(ReplicaReadMixin, DetailView):
     """Детальная страница кампании с потоками"""
     model = Campaign
     template_name = 'campaigns/campaign_detail.html'
@@ -45,18 +43,48 @@ class CampaignDetailView(DetailView):
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # Сортируем потоки: сначала по количеству офферов (убывание), затем по position
-        flows = self.object.flows.prefetch_related('flow_offers__offer').annotate(
-            offers_count=Count('flow_offers')
-        ).order_by('-offers_count', 'position')
-        context['flows'] = flows
+        # Сортируем потоки: сначала по количеству офферов (убывание), затем по position.
+        # Офферы берутся из снимка потока (Flow.offers_snapshot) - flow_offers и offers не читаются
+        context['flows'] = self.object.flows.order_by('-total_offers_count', 'position')
+        # Состояние circuit breaker: при недоступном Keitaro показываем локальные данные с предупреждением
+        context['keitaro_available'] = get_breaker(settings.KEITARO_URL.rstrip('/')).allows_requests()
         return context
 
 
+class CampaignDetailAPIView(ReplicaReadMixin, View):
+    """JSON: кампания с потоками и офферами потоков (из снимков, как на детальной странице)"""
+    
+    def get(self, request, pk):
+        campaign = get_object_or_404(Campaign.objects.exclude(state='deleted'), pk=pk)
+        flows = campaign.flows.order_by('-total_offers_count', 'position')
+        
+        return JsonResponse({
+            'id': campaign.id,
+            'keitaro_id': campaign.keitaro_id,
+            'name': campaign.name,
+            'alias': campaign.alias,
+            'state': campaign.state,
+            'type': campaign.type,
+            'flows_count': campaign.flows_count,
+            'flows': [{
+                'id': flow.id,
+                'keitaro_id': flow.keitaro_id,
+                'name': flow.name,
+                'type': flow.type,
+                'position': flow.position,
+                'state': flow.state,
+                'active_offers_count': flow.active_offers_count,
+                'total_offers_count': flow.total_offers_count,
+                'version': flow.version,
+                'offers': flow.offers_snapshot,
+            } for flow in flows],
+        })
+
+
 class CreateCampaignView(View):
-    """AJAX: Создание новой рекламной кампании"""
+    """AJAX: Создание новой рекламной кампании (async: вызовы Keitaro не занимают поток)"""
     
-    def post(self, request):
+    async def post(self, request):
         try:
             form = CreateCampaignForm(request.POST)
             
@@ -69,86 +97,38 @@ class CreateCampaignView(View):
             offer_id = form.cleaned_data['offer_id']
             
             # Парсим гео-коды
-            geo_codes = [code.strip().upper() for code in geo_codes_str.split(',') if code.strip()]
+            geo_codes = parse_geo_codes(geo_codes_str)
             if not geo_codes:
                 return JsonResponse({'success': False, 'error': 'Укажите хотя бы один гео-код страны'}, status=400)
             
-            # Получаем оффер
-            try:
-                offer = Offer.objects.get(keitaro_id=offer_id, user=request.user)
-            except Offer.DoesNotExist:
-                # Если оффер не найден в кэше, синхронизируем
-                sync_service = KeitaroSyncService(request.user)
-                sync_service.sync_offers()
-                try:
-                    offer = Offer.objects.get(keitaro_id=offer_id, user=request.user)
-                except Offer.DoesNotExist:
-                    return JsonResponse({'success': False, 'error': 'Оффер не найден'}, status=400)
-            
             # Получаем клиент Keitaro
             keitaro_url = getattr(settings, 'KEITARO_URL', '')
             if not keitaro_url:
                 return JsonResponse({'success': False, 'error': 'KEITARO_URL не настроен'}, status=500)
             
-            client = KeitaroClient(keitaro_url, request.user.api_key)
-            
-            with transaction.atomic():
+            async with AsyncKeitaroClient(keitaro_url, request.user.api_key) as client:
+                # Проверяем оффер: если его нет в кэше, загружаем только его (без синхронизации каталога)
+                if await KeitaroSyncService(request.user).aensure_offers([offer_id], client):
+                    return JsonResponse({'success': False, 'error': 'Оффер не найден'}, status=400)
+                
                 # Создаём кампанию в Keitaro
-                campaign_data = client.create_campaign(name)
+                campaign_data = await client.create_campaign(name)
                 campaign_keitaro_id = campaign_data['id']
                 
-                # Формируем название для первого потока: "US,GB,DE → Google"
-                geo_codes_str = ', '.join(geo_codes[:3])  # Первые 3 кода для краткости
-                if len(geo_codes) > 3:
-                    geo_codes_str += f' +{len(geo_codes) - 3}'
-                stream1_name = f'{geo_codes_str} → Google'
-                
-                # Создаём первый поток: гео-таргетинг на указанные страны, редирект на Google
-                # Фильтр использует name='country' (не 'country_code')
-                geo_filters = [{
-                    'name': 'country',
-                    'mode': 'accept',
-                    'payload': geo_codes
-                }]
-                
-                client.create_stream(
-                    campaign_id=campaign_keitaro_id,
-                    name=stream1_name,
-                    action_type='http',
-                    schema='redirect',
-                    stream_type='regular',
-                    action_payload='',  # Пустая строка для redirect
-                    action_options={'url': 'https://www.google.com'},  # URL в action_options
-                    filters=geo_filters,
-                    position=0
-                )
-                
-                # Создаём второй поток: редирект на оффер
-                # Используем schema='landings', action_type='campaign', type='forced'
-                client.create_stream(
-                    campaign_id=campaign_keitaro_id,
-                    name='All → Offers',
-                    action_type='campaign',
-                    schema='landings',
-                    stream_type='forced',
-                    action_payload='',  # Пустая строка
-                    action_options=None,
-                    filters=[],  # Без фильтров - ловит всех
-                    offers=[{
-                        'offer_id': offer_id,
-                        'share': 100,  # 100% на один оффер
-                        'state': 'active'
-                    }],
-                    position=1
-                )
-                
-                # Сохраняем кампанию в локальную БД
-                campaign = Campaign.objects.create(
-                    keitaro_id=campaign_keitaro_id,
-                    name=campaign_data.get('name', name),
-                    alias=campaign_data.get('alias', ''),
-                    state=campaign_data.get('state', 'active')
-                )
+                # Потоки независимы (позиции заданы явно) - создаём их параллельно:
+                # гео-таргетинг на Google и forced поток на оффер
+                await asyncio.gather(*(
+                    client.create_stream(**params)
+                    for params in campaign_streams(campaign_keitaro_id, geo_codes, offer_id)
+                ))
+            
+            # Сохраняем кампанию в локальную БД
+            campaign = await sync_to_async(Campaign.objects.create)(
+                keitaro_id=campaign_keitaro_id,
+                name=campaign_data.get('name', name),
+                alias=campaign_data.get('alias', ''),
+                state=campaign_data.get('state', 'active')
+            )
             
             return JsonResponse({
                 'success': True,
@@ -162,3 +142,73 @@ class CreateCampaignView(View):
         except Exception as e:
             return JsonResponse({'success': False, 'error': f'Ошибка при создании кампании: {str(e)}'}, status=500)
 
+
+class BulkCreateCampaignsView(View):
+    """AJAX: Массовое создание кампаний из CSV (name, geo_codes, offer_id)"""
+    
+    async def post(self, request):
+        upload = request.FILES.get('file')
+        if upload:
+            try:
+                text = upload.read().decode('utf-8-sig')
+            except UnicodeDecodeError:
+                return JsonResponse({'success': False, 'error': 'CSV должен быть в кодировке UTF-8'}, status=400)
+        else:
+            text = request.POST.get('csv', '')
+        
+        if not getattr(settings, 'KEITARO_URL', ''):
+            return JsonResponse({'success': False, 'error': 'KEITARO_URL не настроен'}, status=500)
+        
+        skip_invalid = request.POST.get('skip_invalid') == 'true'
+        creator = BulkCampaignCreator(request.user)
+        try:
+            rows = await creator.create_from_csv(text, skip_invalid=skip_invalid)
+        except ValueError as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
+        except KeitaroAPIException as e:
+            return JsonResponse({'success': False, 'error': f'Ошибка Keitaro API: {str(e)}'}, status=500)
+        except Exception as e:
+            return JsonResponse({'success': False, 'error': f'Ошибка при создании кампаний: {str(e)}'}, status=500)
+        
+        summary = summarize(rows)
+        # Строки с ошибками без skip_invalid: ничего не создано, в ответе - ошибки по строкам
+        status = 400 if summary['invalid'] and not skip_invalid else 200
+        return JsonResponse({
+            'success': not (summary['failed'] or summary['invalid']),
+            'summary': summary,
+            'rows': [row.as_dict() for row in rows],
+        }, status=status)
+
+
+class CloneCampaignView(View):
+    """AJAX: Клонирование кампании с потоками и офферами (при необходимости - с другими гео-кодами)"""
+    
+    async def post(self, request, pk):
+        form = CloneCampaignForm(request.POST)
+        if not form.is_valid():
+            errors = form.errors.as_json()
+            return JsonResponse({'success': False, 'error': 'Ошибка валидации формы', 'errors': errors}, status=400)
+        
+        source = await Campaign.objects.exclude(state='deleted').filter(pk=pk).afirst()
+        if source is None:
+            return JsonResponse({'success': False, 'error': 'Кампания не найдена'}, status=404)
+        
+        try:
+            async with AsyncKeitaroClient(settings.KEITARO_URL, request.user.api_key) as client:
+                campaign = await clone_campaign(
+                    request.user, source, form.cleaned_data['name'], client,
+                    geo_codes=parse_geo_codes(form.cleaned_data['geo_codes']) or None,
+                )
+        except CampaignCloneException as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=500)
+        except KeitaroAPIException as e:
+            return JsonResponse({'success': False, 'error': f'Ошибка Keitaro API: {str(e)}'}, status=500)
+        except Exception as e:
+            return JsonResponse({'success': False, 'error': f'Ошибка при клонировании кампании: {str(e)}'}, status=500)
+        
+        return JsonResponse({
+            'success': True,
+            'message': f'Кампания "{campaign.name}" создана как копия "{source.name}"',
+            'campaign_id': campaign.id,
+            'flows_count': campaign.flows_count,
+        })
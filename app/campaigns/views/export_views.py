@@ -0,0 +1,35 @@
+"""
+Views для потоковой выгрузки данных
+"""
+from django.core.handlers.asgi import ASGIRequest
+from django.db import router
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
+from ..models import Campaign
+from ..services.export import DATASETS, EXPORT_FORMATS, aiter_export, iter_export
+from config.db_router import ReplicaReadMixin
+
+
+class ExportView(ReplicaReadMixin, View):
+    """
+    Выгрузка кампаний, потоков или распределения share (CSV или NDJSON)
+    
+    GET /campaigns/export/<campaigns|flows|shares>/?format=csv|ndjson&deleted=1
+    """
+    
+    def get(self, request, dataset):
+        fmt = request.GET.get('format', 'csv')
+        if dataset not in DATASETS:
+            return JsonResponse({'success': False, 'error': f'Неизвестный набор выгрузки: {dataset}'}, status=404)
+        if fmt not in EXPORT_FORMATS:
+            return JsonResponse({'success': False, 'error': f'Неизвестный формат выгрузки: {fmt}'}, status=400)
+        
+        # БД выбирается сейчас: строки читаются при отдаче ответа, когда middleware реплики уже завершился
+        using = router.db_for_read(Campaign)
+        chunks = iter_export(dataset, fmt, include_deleted=request.GET.get('deleted') == '1', using=using)
+        if isinstance(request, ASGIRequest):
+            chunks = aiter_export(chunks)
+        
+        response = StreamingHttpResponse(chunks, content_type=EXPORT_FORMATS[fmt])
+        response['Content-Disposition'] = f'attachment; filename="{dataset}.{fmt}"'
+        return response
@@ -1,12 +1,17 @@
 """
 Views для управления потоками (streams)
 """
+import asyncio
+from django.conf import settings
 from django.views import View
-from django.shortcuts import get_object_or_404
+from django.shortcuts import aget_object_or_404, get_object_or_404
 from django.http import JsonResponse
 from django.db import transaction
 from ..models import Campaign, Flow
 from ..services import KeitaroSyncService
+from ..services.counters import refresh_flow_counters
+from ..services.snapshots import refresh_flow_snapshots
+from ..services.versions import bump_flow_versions
 
 
 class SyncCampaignsView(View):
@@ -30,13 +35,14 @@ class SyncCampaignsView(View):
 
 
 class FetchStreamsView(View):
-    """AJAX: Синхронизация потоков кампании из Keitaro"""
+    """AJAX: Синхронизация потоков кампании из Keitaro (async: ожидание Keitaro не занимает поток)"""
     
-    def post(self, request, pk):
+    async def post(self, request, pk):
         try:
-            campaign = get_object_or_404(Campaign, pk=pk)
+            campaign = await aget_object_or_404(Campaign, pk=pk)
             sync_service = KeitaroSyncService(request.user)
-            count = sync_service.sync_streams(campaign)
+            async with sync_service.async_client() as client:
+                count = await sync_service.async_streams(campaign, client)
             
             return JsonResponse({
                 'success': True,
@@ -51,16 +57,35 @@ class FetchStreamsView(View):
 
 
 class CheckSyncView(View):
-    """AJAX: Проверка расхождений с Keitaro"""
+    """AJAX: Проверка расхождений с Keitaro (потоки сравниваются параллельно)"""
     
-    def get(self, request, pk):
+    async def get(self, request, pk):
         try:
-            campaign = get_object_or_404(Campaign, pk=pk)
+            campaign = await aget_object_or_404(Campaign, pk=pk)
             sync_service = KeitaroSyncService(request.user)
             
+            # Keitaro недоступен - сразу отдаём ответ, не дожидаясь таймаутов
+            if not sync_service.keitaro_available:
+                return JsonResponse({
+                    'success': True,
+                    'has_differences': False,
+                    'differences': [],
+                    'keitaro_unavailable': True,
+                })
+            
+            flows = [flow async for flow in campaign.flows.all()]
+            # Не больше CHECK_SYNC_CONCURRENCY запросов к Keitaro одновременно
+            semaphore = asyncio.Semaphore(settings.CHECK_SYNC_CONCURRENCY)
+            
+            async def compare(flow):
+                async with semaphore:
+                    return await sync_service.acompare_with_keitaro(flow, client)
+            
+            async with sync_service.async_client() as client:
+                results = await asyncio.gather(*(compare(flow) for flow in flows))
+            
             differences = []
-            for flow in campaign.flows.all():
-                result = sync_service.compare_with_keitaro(flow)
+            for flow, result in zip(flows, results):
                 if result.get('has_differences'):
                     differences.append({
                         'flow_id': flow.id,
@@ -84,12 +109,13 @@ class CheckSyncView(View):
 class PushToKeitaroView(View):
     """AJAX: Отправка изменений в Keitaro"""
     
-    def post(self, request, flow_id):
+    async def post(self, request, flow_id):
         try:
-            flow = get_object_or_404(Flow, pk=flow_id)
+            flow = await aget_object_or_404(Flow, pk=flow_id)
             sync_service = KeitaroSyncService(request.user)
             
-            sync_service.push_stream_offers(flow)
+            async with sync_service.async_client() as client:
+                await sync_service.apush_stream_offers(flow, client)
             
             return JsonResponse({
                 'success': True,
@@ -109,7 +135,11 @@ class CancelChangesView(View):
             sync_service = KeitaroSyncService(request.user)
             
             # Возвращаем disabled офферы в active перед синхронизацией
-            flow.flow_offers.filter(state='disabled').update(state='active')
+            with transaction.atomic():
+                flow.flow_offers.filter(state='disabled').update(state='active', disabled_at=None)
+                refresh_flow_counters(Flow.objects.filter(pk=flow.pk))
+                refresh_flow_snapshots(Flow.objects.filter(pk=flow.pk))
+                bump_flow_versions(Flow.objects.filter(pk=flow.pk))
             
             # Перезагружаем данные из Keitaro
             sync_service.sync_streams(flow.campaign)
@@ -1,12 +1,57 @@
 """
 Views для управления офферами в потоках
+
+Изменения передают версию потока (POST version), которую видел клиент. Версия проверяется
+и увеличивается одним условным UPDATE в начале транзакции; если поток уже изменён другим
+запросом, ответ - 409 с текущим состоянием потока.
 """
+from typing import Optional
 from django.views import View
 from django.shortcuts import get_object_or_404
 from django.http import JsonResponse
 from django.db import transaction
+from django.utils import timezone
 from ..models import Flow, Offer, FlowOffer
 from ..services import ShareCalculator
+from ..services.counters import adjust_flow_counters
+from ..services.snapshots import refresh_flow_snapshots
+from ..services.versions import bump_flow_version
+from config.db_router import ReplicaReadMixin
+
+
+def _seen_version(request) -> Optional[int]:
+    """
+    Версия потока, которую видел клиент
+    
+    Returns:
+        Версия или None, если клиент её не передал (проверяется версия, загруженная запросом)
+    
+    Raises:
+        ValueError: Если версия не число
+    """
+    value = request.POST.get('version', '')
+    if not value:
+        return None
+    if not value.isdigit():
+        raise ValueError('Некорректная версия потока')
+    return int(value)
+
+
+def _conflict_response(flow: Flow) -> JsonResponse:
+    """409: поток изменён другим запросом, в ответе его текущее состояние"""
+    flow.refresh_from_db(fields=['version', 'active_offers_count', 'total_offers_count', 'offers_snapshot'])
+    return JsonResponse({
+        'success': False,
+        'conflict': True,
+        'error': 'Поток изменён другим пользователем. Обновите страницу',
+        'version': flow.version,
+        'flow': {
+            'id': flow.id,
+            'active_offers_count': flow.active_offers_count,
+            'total_offers_count': flow.total_offers_count,
+            'offers': flow.offers_snapshot,
+        },
+    }, status=409)
 
 
 class AddOfferView(View):
@@ -16,17 +61,21 @@ class AddOfferView(View):
         try:
             flow = get_object_or_404(Flow, pk=flow_id)
             offer_id = request.POST.get('offer_id')
+            version = _seen_version(request)
             
             if not offer_id:
                 return JsonResponse({'success': False, 'error': 'Не указан offer_id'}, status=400)
             
-            offer = get_object_or_404(Offer, keitaro_id=offer_id, user=request.user)
+            offer = get_object_or_404(Offer.objects.visible_to(request.user), keitaro_id=offer_id)
             
             # Проверяем что оффер ещё не добавлен
             if FlowOffer.objects.filter(flow=flow, offer=offer).exists():
                 return JsonResponse({'success': False, 'error': 'Оффер уже добавлен в этот поток'}, status=400)
             
             with transaction.atomic():
+                if not bump_flow_version(flow, version):
+                    return _conflict_response(flow)
+                
                 # Создаём новый FlowOffer
                 flow_offer = FlowOffer.objects.create(
                     flow=flow,
@@ -34,6 +83,7 @@ class AddOfferView(View):
                     share=0,
                     state='active'
                 )
+                adjust_flow_counters(flow, active=1, total=1)
                 
                 # Пересчитываем share
                 flow_offers = list(flow.flow_offers.filter(state='active'))
@@ -45,6 +95,7 @@ class AddOfferView(View):
                     fo.share = new_shares[fo.id]
                     fo.save(update_fields=['share'])
                     updated_shares[fo.id] = fo.share
+                refresh_flow_snapshots(Flow.objects.filter(pk=flow.pk))
             
             return JsonResponse({
                 'success': True,
@@ -53,6 +104,7 @@ class AddOfferView(View):
                 'offer_name': offer.name,
                 'share': flow_offer.share,
                 'all_shares': updated_shares,
+                'version': flow.version,
             })
             
         except ValueError as e:
@@ -66,14 +118,21 @@ class RemoveOfferView(View):
     
     def post(self, request, pk):
         try:
-            flow_offer = get_object_or_404(FlowOffer, pk=pk)
+            flow_offer = get_object_or_404(FlowOffer.objects.select_related('flow'), pk=pk)
             flow = flow_offer.flow
+            version = _seen_version(request)
             
             with transaction.atomic():
-                # Помечаем FlowOffer как disabled вместо удаления
+                if not bump_flow_version(flow, version):
+                    return _conflict_response(flow)
+                
+                # Помечаем FlowOffer как disabled вместо удаления. Условный UPDATE: при
+                # повторном (или параллельном) запросе счётчик не уменьшится дважды
+                if FlowOffer.objects.filter(pk=flow_offer.pk, state='active').update(
+                        state='disabled', share=0, disabled_at=timezone.now(), updated_at=timezone.now()):
+                    adjust_flow_counters(flow, active=-1)
                 flow_offer.state = 'disabled'
                 flow_offer.share = 0
-                flow_offer.save(update_fields=['state', 'share'])
                 
                 # Пересчитываем share для оставшихся активных
                 flow_offers = list(flow.flow_offers.filter(state='active'))
@@ -87,13 +146,17 @@ class RemoveOfferView(View):
                 # Формируем all_shares включая удалённый оффер с share=0
                 all_shares = {fo.id: fo.share for fo in flow_offers}
                 all_shares[flow_offer.id] = 0  # Добавляем удалённый оффер с share=0
+                refresh_flow_snapshots(Flow.objects.filter(pk=flow.pk))
             
             return JsonResponse({
                 'success': True,
                 'message': 'Оффер помечен для удаления',
                 'all_shares': all_shares,
+                'version': flow.version,
             })
             
+        except ValueError as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
         except Exception as e:
             return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
@@ -103,13 +166,19 @@ class RestoreOfferView(View):
     
     def post(self, request, pk):
         try:
-            flow_offer = get_object_or_404(FlowOffer, pk=pk)
+            flow_offer = get_object_or_404(FlowOffer.objects.select_related('flow'), pk=pk)
             flow = flow_offer.flow
+            version = _seen_version(request)
             
             with transaction.atomic():
-                # Восстанавливаем FlowOffer
+                if not bump_flow_version(flow, version):
+                    return _conflict_response(flow)
+                
+                # Восстанавливаем FlowOffer (условный UPDATE, как при удалении)
+                if FlowOffer.objects.filter(pk=flow_offer.pk).exclude(state='active').update(
+                        state='active', disabled_at=None, updated_at=timezone.now()):
+                    adjust_flow_counters(flow, active=1)
                 flow_offer.state = 'active'
-                flow_offer.save(update_fields=['state'])
                 
                 # Пересчитываем share для всех активных офферов
                 flow_offers = list(flow.flow_offers.filter(state='active'))
@@ -124,13 +193,17 @@ class RestoreOfferView(View):
                     all_shares = {fo.id: fo.share for fo in flow_offers}
                 else:
                     all_shares = {}
+                refresh_flow_snapshots(Flow.objects.filter(pk=flow.pk))
             
             return JsonResponse({
                 'success': True,
                 'message': 'Оффер восстановлен',
                 'all_shares': all_shares,
+                'version': flow.version,
             })
             
+        except ValueError as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
         except Exception as e:
             return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
@@ -140,10 +213,14 @@ class TogglePinView(View):
     
     def post(self, request, pk):
         try:
-            flow_offer = get_object_or_404(FlowOffer, pk=pk)
+            flow_offer = get_object_or_404(FlowOffer.objects.select_related('flow'), pk=pk)
             flow = flow_offer.flow
+            version = _seen_version(request)
             
             with transaction.atomic():
+                if not bump_flow_version(flow, version):
+                    return _conflict_response(flow)
+                
                 # Переключаем состояние закрепления
                 flow_offer.is_pinned = not flow_offer.is_pinned
                 flow_offer.save(update_fields=['is_pinned'])
@@ -158,15 +235,21 @@ class TogglePinView(View):
                     fo.share = new_shares[fo.id]
                     fo.save(update_fields=['share'])
                     updated_shares[fo.id] = fo.share
+                refresh_flow_snapshots(Flow.objects.filter(pk=flow.pk))
                 
                 # Валидация
                 is_valid, error = ShareCalculator.validate_shares(flow_offers)
                 
                 if not is_valid:
+                    # Клиент возвращает закрепление как было: откатываем и его, и версию потока,
+                    # иначе следующее изменение с прежней версией получит ложный 409
+                    transaction.set_rollback(True)
+                    flow.version -= 1
                     return JsonResponse({
                         'success': False,
                         'error': error,
                         'is_valid': False,
+                        'version': flow.version,
                     }, status=400)
             
             return JsonResponse({
@@ -174,13 +257,16 @@ class TogglePinView(View):
                 'message': 'Состояние закрепления изменено',
                 'is_pinned': flow_offer.is_pinned,
                 'all_shares': updated_shares,
+                'version': flow.version,
             })
             
+        except ValueError as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
         except Exception as e:
             return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
 
-class OfferAutocompleteView(View):
+class OfferAutocompleteView(ReplicaReadMixin, View):
     """AJAX: Автодополнение офферов"""
     
     def get(self, request):
@@ -190,8 +276,7 @@ class OfferAutocompleteView(View):
             return JsonResponse({'results': []})
         
         # Поиск по кэшу офферов
-        offers = Offer.objects.filter(
-            user=request.user,
+        offers = Offer.objects.visible_to(request.user).filter(
             name__icontains=query,
             state='active'
         ).order_by('name')[:20]
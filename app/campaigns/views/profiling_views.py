@@ -0,0 +1,38 @@
+"""
+Views для просмотра профилей запросов (только для staff)
+"""
+import os
+from django.views.generic import TemplateView
+from django.views import View
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404
+from ..services.profiling import ProfileStore
+
+
+class StaffRequiredMixin:
+    """Доступ только для staff пользователей"""
+    
+    def dispatch(self, request, *args, **kwargs):
+        if not getattr(request.user, 'is_staff', False):
+            raise PermissionDenied
+        return super().dispatch(request, *args, **kwargs)
+
+
+class ProfileListView(StaffRequiredMixin, TemplateView):
+    """Последние профили запросов (запускаются заголовком X-Profile или ?_profile=1)"""
+    template_name = 'campaigns/profile_list.html'
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['profiles'] = ProfileStore().list()
+        return context
+
+
+class ProfileDownloadView(StaffRequiredMixin, View):
+    """Скачивание файла .prof (для snakeviz или pstats)"""
+    
+    def get(self, request, name):
+        path = ProfileStore().prof_path(name)
+        if not path:
+            raise Http404('Профиль не найден')
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=os.path.basename(path))
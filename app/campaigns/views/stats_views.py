@@ -6,13 +6,14 @@ from django.http import JsonResponse
 from datetime import datetime, timedelta
 from ..models import Campaign
 from ..services import KeitaroSyncService
-from config.exceptions import KeitaroAPIException
+from config.db_router import ReplicaReadMixin
+from config.exceptions import KeitaroAPIException, KeitaroCircuitOpenException
 
 
-class CampaignStatsAPIView(View):
-    """AJAX: Получение статистики кампаний через Keitaro report API"""
+class CampaignStatsAPIView(ReplicaReadMixin, View):
+    """AJAX: Получение статистики кампаний через Keitaro report API (async)"""
     
-    def post(self, request):
+    async def post(self, request):
         try:
             campaign_ids = request.POST.getlist('campaign_ids[]')
             
@@ -20,9 +21,8 @@ class CampaignStatsAPIView(View):
                 return JsonResponse({'success': False, 'error': 'Не указаны campaign_ids'}, status=400)
             
             # Получаем кампании
-            campaigns = Campaign.objects.filter(
-                id__in=campaign_ids
-            )
+            campaigns = [campaign async for campaign in Campaign.objects.filter(id__in=campaign_ids)]
+            by_keitaro_id = {campaign.keitaro_id: campaign for campaign in campaigns}
             
             sync_service = KeitaroSyncService(request.user)
             
@@ -62,7 +62,12 @@ class CampaignStatsAPIView(View):
             }
             
             try:
-                report_data = sync_service.client.get_report(report_params)
+                # Keitaro недоступен - не ждём таймаута, отдаём нули с предупреждением
+                if not sync_service.keitaro_available:
+                    raise KeitaroCircuitOpenException('Keitaro временно недоступен')
+                
+                async with sync_service.async_client() as client:
+                    report_data = await client.get_report(report_params)
                 
                 # Преобразуем данные в удобный формат
                 stats = {}
@@ -71,7 +76,7 @@ class CampaignStatsAPIView(View):
                     for row in report_data['rows']:
                         camp_keitaro_id = row.get('campaign_id')
                         # Находим campaign по keitaro_id
-                        campaign = campaigns.filter(keitaro_id=camp_keitaro_id).first()
+                        campaign = by_keitaro_id.get(camp_keitaro_id)
                         if campaign:
                             stats[str(campaign.id)] = {
                                 'clicks': row.get('clicks', 0),
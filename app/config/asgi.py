@@ -14,3 +14,11 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+# Статика отдаётся самим приложением (gunicorn не делает этого, в отличие от runserver),
+# если SERVE_STATIC=True (по умолчанию только при DEBUG; в production её раздаёт прокси)
+from django.conf import settings  # noqa: E402
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler  # noqa: E402
+
+if settings.SERVE_STATIC:
+    application = ASGIStaticFilesHandler(application)
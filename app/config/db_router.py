@@ -0,0 +1,153 @@
+"""
+Чтение с реплики БД для view, которые только читают данные кампаний
+
+Реплика включается настройками (см. DB_REPLICA_* в settings.py). С реплики читаются
+только модели REPLICA_APPS и только в view с ReplicaReadMixin (списки, карточка,
+автодополнение, сопоставление статистики); остальные чтения, все записи и чтения
+после записи идут в основную БД. Сессия, в которой была запись, ещё
+DB_REPLICA_STICKY_SECONDS секунд читает из основной БД (read-your-writes), чтобы
+пользователь не увидел устаревшие данные из-за задержки репликации.
+"""
+import time
+from contextvars import ContextVar
+from typing import Optional
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICA_DB_ALIAS = 'replica'
+
+# Приложения, данные которых можно читать с реплики (сессии и пользователи - всегда с основной БД)
+REPLICA_APPS = {'campaigns'}
+
+# Ключ сессии: до какого времени (timestamp) чтение идёт из основной БД
+STICKY_SESSION_KEY = '_db_primary_until'
+
+
+class ReplicaState:
+    """Маршрутизация чтения в рамках одного HTTP запроса"""
+
+    def __init__(self, pinned: bool = False):
+        # View разрешил чтение с реплики
+        self.replica_allowed = False
+        # Чтение закреплено за основной БД: недавняя запись в сессии или запись в этом запросе
+        self.pinned = pinned
+        # В запросе была запись в модели REPLICA_APPS
+        self.wrote = False
+
+    @property
+    def use_replica(self) -> bool:
+        return self.replica_allowed and not self.pinned
+
+
+# Изменяемый объект, а не значения: изменения из потоков sync_to_async видны запросу
+replica_state_var: ContextVar[Optional[ReplicaState]] = ContextVar('replica_state', default=None)
+
+
+def replica_configured() -> bool:
+    """Настроена ли реплика для чтения"""
+    return REPLICA_DB_ALIAS in settings.DATABASES
+
+
+def allow_replica_reads():
+    """Разрешить чтение с реплики до конца текущего HTTP запроса (вне запроса ничего не делает)"""
+    state = replica_state_var.get()
+    if state is not None:
+        state.replica_allowed = True
+
+
+class ReplicaRouter:
+    """
+    Router Django: чтение моделей REPLICA_APPS с реплики, если его разрешил view
+
+    Запись всегда в основную БД и закрепляет за ней чтение до конца запроса.
+    Миграции применяются только к основной БД.
+    """
+
+    def db_for_read(self, model, **hints) -> Optional[str]:
+        state = replica_state_var.get()
+        if state is not None and state.use_replica and model._meta.app_label in REPLICA_APPS:
+            return REPLICA_DB_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints) -> Optional[str]:
+        state = replica_state_var.get()
+        if state is not None and model._meta.app_label in REPLICA_APPS:
+            state.wrote = True
+            state.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints) -> Optional[bool]:
+        # Реплика содержит те же данные, что и основная БД
+        databases = {DEFAULT_DB_ALIAS, REPLICA_DB_ALIAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints) -> Optional[bool]:
+        return db != REPLICA_DB_ALIAS
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Состояние маршрутизации на время запроса и read-your-writes по сессии
+
+    Если в сессии недавно была запись, чтение запроса закрепляется за основной БД;
+    после запроса с записью окно продлевается на DB_REPLICA_STICKY_SECONDS.
+    Должен стоять после SessionMiddleware. Без настроенной реплики ничего не делает.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = replica_configured()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+
+        state = ReplicaState(pinned=self._sticky(request.session.get(STICKY_SESSION_KEY)))
+        token = replica_state_var.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            replica_state_var.reset(token)
+        if state.wrote:
+            request.session[STICKY_SESSION_KEY] = self._sticky_until()
+        return response
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+
+        state = ReplicaState(pinned=self._sticky(await request.session.aget(STICKY_SESSION_KEY)))
+        token = replica_state_var.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            replica_state_var.reset(token)
+        if state.wrote:
+            await request.session.aset(STICKY_SESSION_KEY, self._sticky_until())
+        return response
+
+    @staticmethod
+    def _sticky(until: Optional[float]) -> bool:
+        return bool(until) and until > time.time()
+
+    @staticmethod
+    def _sticky_until() -> float:
+        return time.time() + getattr(settings, 'DB_REPLICA_STICKY_SECONDS', 5)
+
+
+class ReplicaReadMixin:
+    """View только читает данные кампаний: их можно читать с реплики БД"""
+
+    def dispatch(self, request, *args, **kwargs):
+        allow_replica_reads()
+        return super().dispatch(request, *args, **kwargs)
@@ -17,3 +17,31 @@ class KeitaroConnectionException(KeitaroAPIException):
     """Исключение для ошибок подключения к Keitaro (сервис недоступен)"""
     pass
 
+
+class KeitaroRequestNotSentException(KeitaroConnectionException):
+    """
+    Исключение, когда запрос точно не дошёл до Keitaro (соединение не установлено)
+
+    В отличие от таймаута чтения и 5xx, повтор такого запроса безопасен и для записи (POST).
+    """
+    pass
+
+
+class KeitaroCircuitOpenException(KeitaroRequestNotSentException):
+    """Исключение при открытом circuit breaker (Keitaro временно считается недоступным)"""
+    pass
+
+
+class KeitaroRateLimitException(KeitaroRequestNotSentException):
+    """Исключение при исчерпании клиентского лимита запросов к Keitaro"""
+    pass
+
+
+class ArchiveRestoreException(Exception):
+    """Исключение при восстановлении из архива (строка уже есть в рабочих таблицах или некуда восстанавливать)"""
+    pass
+
+
+class CampaignCloneException(Exception):
+    """Исключение при клонировании кампании (кампания создана в Keitaro, но часть потоков не создана)"""
+    pass
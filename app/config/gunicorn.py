@@ -0,0 +1,77 @@
+"""
+Конфигурация gunicorn для production
+
+Запуск (из корня репозитория):
+    gunicorn -c app/config/gunicorn.py
+
+Режим задаётся SERVER_MODE:
+    asgi (по умолчанию) - воркеры uvicorn, async views ждут Keitaro без занятия потока
+    wsgi                - воркеры gthread (потоки), постоянные соединения с БД
+
+Количество воркеров и потоков вычисляется по числу CPU, переопределяется
+через WEB_CONCURRENCY и GUNICORN_THREADS.
+"""
+import multiprocessing
+import os
+from pathlib import Path
+
+
+def _env_int(name: str, default: int) -> int:
+    """Целое из переменной окружения (пустое значение из docker-compose - значение по умолчанию)"""
+    return int(os.getenv(name) or default)
+
+
+SERVER_MODE = (os.getenv('SERVER_MODE') or 'asgi').lower()
+CPU_COUNT = multiprocessing.cpu_count()
+
+# Каталог Django проекта (app/): отсюда импортируются config.asgi / config.wsgi
+chdir = str(Path(__file__).resolve().parent.parent)
+bind = os.getenv('GUNICORN_BIND') or '0.0.0.0:8000'
+
+if SERVER_MODE == 'wsgi':
+    wsgi_app = 'config.wsgi:application'
+    worker_class = 'gthread'
+    # Потоки ждут ответа Keitaro и БД, поэтому их больше, чем ядер
+    workers = _env_int('WEB_CONCURRENCY', CPU_COUNT * 2 + 1)
+    threads = _env_int('GUNICORN_THREADS', 4)
+else:
+    wsgi_app = 'config.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+    # Один event loop обслуживает много одновременных запросов - достаточно воркера на ядро
+    workers = _env_int('WEB_CONCURRENCY', max(CPU_COUNT, 2))
+    threads = 1
+    # Под ASGI ORM каждого запроса выполняется в новом потоке (sync_to_async), поэтому
+    # постоянные соединения не переиспользуются, а копятся до завершения потоков
+    # (с пулом PostgreSQL соединения возвращаются в пул, DB_CONN_MAX_AGE не используется)
+    if not os.getenv('DB_CONN_MAX_AGE'):
+        os.environ['DB_CONN_MAX_AGE'] = '0'
+
+# Приложение загружается до fork: воркеры разделяют память импортированного кода
+preload_app = True
+
+# Плавный перезапуск воркера после N запросов (с разбросом, чтобы воркеры не
+# перезапускались одновременно) ограничивает рост памяти
+max_requests = _env_int('GUNICORN_MAX_REQUESTS', 1000)
+max_requests_jitter = _env_int('GUNICORN_MAX_REQUESTS_JITTER', max_requests // 10)
+
+# Таймаут запроса больше таймаута чтения отчёта Keitaro с повторами
+timeout = _env_int('GUNICORN_TIMEOUT', 120)
+graceful_timeout = _env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = _env_int('GUNICORN_KEEPALIVE', 5)
+
+# Heartbeat воркеров в памяти, а не на диске контейнера
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Логи в stdout/stderr контейнера
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
+loglevel = (os.getenv('LOG_LEVEL') or 'INFO').lower()
+
+# Прокси перед приложением передаёт X-Forwarded-* (адреса через запятую, * - любые)
+forwarded_allow_ips = os.getenv('FORWARDED_ALLOW_IPS') or '127.0.0.1'
+
+
+def post_fork(server, worker):
+    """Соединения с БД, открытые при загрузке приложения, не должны делиться между воркерами"""
+    from django.db import connections
+    connections.close_all()
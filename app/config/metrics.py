@@ -0,0 +1,459 @@
+"""
+Метрики приложения в формате Prometheus, общие для всех воркеров
+
+Каждый процесс копит значения в памяти и периодически сбрасывает их в свой
+файл <pid>.json в METRICS_DIR. При выгрузке /metrics файлы всех процессов
+суммируются: счётчики и гистограммы складываются (в том числе от завершившихся
+воркеров - их значения переносятся в общий архивный файл), gauge выводятся
+по каждому живому процессу с меткой pid.
+"""
+import atexit
+import inspect
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка только в рамках процесса
+    fcntl = None
+
+# Границы корзин по умолчанию, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_ARCHIVE_FILE = 'archive.json'
+_LOCK_FILE = '.lock'
+
+LabelSet = Tuple[Tuple[str, str], ...]
+
+
+class Metric:
+    """Описание метрики"""
+
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def _labels(self, labels: Dict) -> LabelSet:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name}: ожидались метки {self.labelnames}, получены {tuple(labels)}')
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+
+class Counter(Metric):
+    """Монотонно растущий счётчик (суммируется по процессам)"""
+
+    kind = 'counter'
+
+    def inc(self, value: float = 1, **labels):
+        registry.add(self.name, self._labels(labels), value)
+
+
+class Histogram(Metric):
+    """Гистограмма (корзины, сумма и количество суммируются по процессам)"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value: float, **labels):
+        labelset = self._labels(labels)
+        for bound in self.buckets:
+            if value <= bound:
+                registry.add(f'{self.name}_bucket', labelset + (('le', _format_value(bound)),), 1)
+        registry.add(f'{self.name}_bucket', labelset + (('le', '+Inf'),), 1)
+        registry.add(f'{self.name}_sum', labelset, value)
+        registry.add(f'{self.name}_count', labelset, 1)
+
+    @contextmanager
+    def time(self, **labels):
+        """Замер длительности блока"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+class Gauge(Metric):
+    """Текущее значение процесса (выводится с меткой pid, только для живых процессов)"""
+
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        registry.set(self.name, self._labels(labels), value)
+
+
+class MetricsRegistry:
+    """Значения метрик процесса и их сохранение в общий каталог"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.metrics: Dict[str, Metric] = {}
+        self._pid = os.getpid()
+        self._values: Dict[Tuple[str, LabelSet], float] = {}
+        self._gauges: Dict[Tuple[str, LabelSet], float] = {}
+        self._dirty = False
+        self._flushed_at = 0.0
+
+    def register(self, metric: Metric):
+        self.metrics[metric.name] = metric
+
+    @property
+    def directory(self) -> str:
+        directory = getattr(settings, 'METRICS_DIR', '') or os.path.join(tempfile.gettempdir(), 'campaign-manager-metrics')
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def _check_fork(self):
+        # После fork (gunicorn preload_app) дочерний процесс начинает со своих нулей
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._values = {}
+            self._gauges = {}
+            self._flushed_at = 0.0
+
+    def add(self, sample: str, labels: LabelSet, value: float):
+        with self._lock:
+            self._check_fork()
+            key = (sample, labels)
+            self._values[key] = self._values.get(key, 0) + value
+            self._dirty = True
+
+    def set(self, sample: str, labels: LabelSet, value: float):
+        with self._lock:
+            self._check_fork()
+            self._gauges[(sample, labels)] = value
+            self._dirty = True
+
+    def reset(self):
+        """Обнуление значений процесса (для тестов)"""
+        with self._lock:
+            self._values = {}
+            self._gauges = {}
+            self._dirty = True
+
+    def flush(self, force: bool = False):
+        """
+        Сохранение значений процесса в его файл
+
+        Args:
+            force: Сохранить, даже если METRICS_FLUSH_INTERVAL ещё не прошёл
+        """
+        interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 1.0)
+        with self._lock:
+            self._check_fork()
+            now = time.monotonic()
+            if not self._dirty or (not force and now - self._flushed_at < interval):
+                return
+            data = {
+                'pid': self._pid,
+                'values': [[sample, list(labels), value] for (sample, labels), value in self._values.items()],
+                'gauges': [[sample, list(labels), value] for (sample, labels), value in self._gauges.items()],
+            }
+            self._dirty = False
+            self._flushed_at = now
+        _write_json(os.path.join(self.directory, f'{self._pid}.json'), data)
+
+    def collect(self) -> Tuple[Dict[Tuple[str, LabelSet], float], Dict[Tuple[str, LabelSet], float]]:
+        """
+        Суммарные значения всех процессов
+
+        Файлы завершившихся процессов переносятся в архив (счётчики не теряются).
+
+        Returns:
+            (счётчики и гистограммы, gauge с меткой pid)
+        """
+        self.flush(force=True)
+        directory = self.directory
+        values: Dict[Tuple[str, LabelSet], float] = {}
+        gauges: Dict[Tuple[str, LabelSet], float] = {}
+
+        with _locked(os.path.join(directory, _LOCK_FILE)):
+            archive_path = os.path.join(directory, _ARCHIVE_FILE)
+            archive = _read_json(archive_path) or {'values': []}
+            archive_changed = False
+            _merge(values, archive['values'])
+
+            for filename in os.listdir(directory):
+                if not filename.endswith('.json') or filename == _ARCHIVE_FILE:
+                    continue
+                data = _read_json(os.path.join(directory, filename))
+                if data is None:
+                    continue
+                if _pid_alive(data['pid']):
+                    _merge(values, data['values'])
+                    for sample, labels, value in data['gauges']:
+                        gauges[(sample, tuple(map(tuple, labels)) + (('pid', str(data['pid'])),))] = value
+                else:
+                    _merge(values, data['values'])
+                    archive['values'].extend(data['values'])
+                    archive_changed = True
+                    os.remove(os.path.join(directory, filename))
+
+            if archive_changed:
+                compacted: Dict[Tuple[str, LabelSet], float] = {}
+                _merge(compacted, archive['values'])
+                archive['values'] = [[sample, list(labels), value] for (sample, labels), value in compacted.items()]
+                _write_json(archive_path, archive)
+
+        return values, gauges
+
+    def render(self) -> str:
+        """Выгрузка в текстовом формате Prometheus"""
+        values, gauges = self.collect()
+        samples: Dict[str, List[Tuple[str, LabelSet, float]]] = {}
+        for (sample, labels), value in list(values.items()) + list(gauges.items()):
+            samples.setdefault(_metric_name(sample, self.metrics), []).append((sample, labels, value))
+
+        lines = []
+        for name in sorted(self.metrics):
+            metric = self.metrics[name]
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for sample, labels, value in sorted(samples.get(name, []), key=_sample_order):
+                lines.append(f'{sample}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _metric_name(sample: str, metrics: Dict[str, Metric]) -> str:
+    for suffix in ('_bucket', '_sum', '_count'):
+        if sample.endswith(suffix) and sample[:-len(suffix)] in metrics:
+            return sample[:-len(suffix)]
+    return sample
+
+
+def _sample_order(item):
+    sample, labels, _ = item
+    plain = tuple(pair for pair in labels if pair[0] != 'le')
+    le = dict(labels).get('le')
+    return plain, sample, float('inf') if le == '+Inf' else float(le or 0)
+
+
+def _merge(target: Dict, rows: Iterable):
+    for sample, labels, value in rows:
+        key = (sample, tuple(map(tuple, labels)))
+        target[key] = target.get(key, 0) + value
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: LabelSet) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        # Windows: os.kill с сигналом 0 не поддерживается
+        return True
+    return True
+
+
+def _read_json(path: str) -> Optional[Dict]:
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path: str, data: Dict):
+    # Атомарная замена: читатель никогда не увидит недописанный файл
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+_thread_lock = threading.Lock()
+
+
+@contextmanager
+def _locked(path: str):
+    with _thread_lock, open(path, 'a') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+registry = MetricsRegistry()
+
+
+def _flush_at_exit():
+    """Сохранение значений при завершении процесса (настройки могут быть не загружены)"""
+    if not settings.configured:
+        return
+    try:
+        registry.flush(force=True)
+    except Exception:
+        pass  # При выходе интерпретатора ошибка записи метрик не должна выводить traceback
+
+
+atexit.register(_flush_at_exit)
+
+
+def track_sync(job: str):
+    """
+    Декоратор синхронизации: длительность, количество обработанных строк (результат int) и ошибки
+
+    Поддерживает и обычные функции, и корутины (async варианты синхронизации).
+
+    Args:
+        job: Имя задачи (метка job)
+    """
+    def observe(started: float, result: Any):
+        sync_duration.observe(time.perf_counter() - started, job=job)
+        if isinstance(result, int) and not isinstance(result, bool):
+            sync_rows.inc(result, job=job)
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception:
+                    sync_failures.inc(job=job)
+                    sync_duration.observe(time.perf_counter() - started, job=job)
+                    raise
+                observe(started, result)
+                return result
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                sync_failures.inc(job=job)
+                sync_duration.observe(time.perf_counter() - started, job=job)
+                raise
+            observe(started, result)
+            return result
+        return wrapper
+    return decorator
+
+
+def process_memory_bytes() -> int:
+    """Резидентная память текущего процесса (байты, 0 если недоступно)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        # Linux отдаёт килобайты, macOS - байты; это пиковое, а не текущее значение
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if os.uname().sysname == 'Darwin' else usage * 1024
+    except (ImportError, AttributeError):
+        return 0
+
+
+# Счётчики ошибок пула psycopg: ключ статистики -> метка kind
+DB_POOL_ERRORS = {
+    'requests_errors': 'timeout',
+    'connections_errors': 'connect',
+    'connections_lost': 'lost',
+    'returns_bad': 'bad_return',
+}
+
+
+def observe_db_pool(alias: str, pool):
+    """
+    Метрики пула соединений psycopg
+
+    Размер пула, свободные соединения и ожидающие запросы - gauge (по воркеру),
+    число выдач, время ожидания и ошибки - счётчики из приращений pop_stats.
+
+    Args:
+        alias: Алиас БД в DATABASES
+        pool: psycopg_pool.ConnectionPool
+    """
+    stats = pool.pop_stats()
+    db_pool_connections.set(stats.get('pool_size', 0), alias=alias, state='open')
+    db_pool_connections.set(stats.get('pool_available', 0), alias=alias, state='idle')
+    db_pool_max_connections.set(stats.get('pool_max', 0), alias=alias)
+    db_pool_waiting.set(stats.get('requests_waiting', 0), alias=alias)
+    if stats.get('requests_num'):
+        db_pool_requests.inc(stats['requests_num'], alias=alias)
+    if stats.get('requests_wait_ms'):
+        db_pool_wait.inc(stats['requests_wait_ms'] / 1000, alias=alias)
+    for key, kind in DB_POOL_ERRORS.items():
+        if stats.get(key):
+            db_pool_errors.inc(stats[key], alias=alias, kind=kind)
+
+
+def update_db_pool_metrics():
+    """Метрики пулов соединений всех БД процесса (БД без пула пропускаются)"""
+    from django.db import connections
+    for alias in connections:
+        connection = connections[alias]
+        if connection.vendor == 'postgresql' and connection.settings_dict.get('OPTIONS', {}).get('pool'):
+            observe_db_pool(alias, connection.pool)
+
+
+# Метрики приложения
+http_requests = Counter('http_requests_total', 'HTTP запросы по имени URL, методу и статусу', ['view', 'method', 'status'])
+http_request_duration = Histogram('http_request_duration_seconds', 'Время обработки HTTP запроса', ['view'])
+db_queries = Counter('db_queries_total', 'SQL запросы по имени URL', ['view'])
+db_query_duration = Counter('db_query_duration_seconds_total', 'Суммарное время SQL запросов по имени URL', ['view'])
+db_queries_per_request = Histogram(
+    'db_queries_per_request', 'Количество SQL запросов на HTTP запрос', ['view'],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+keitaro_calls = Counter('keitaro_calls_total', 'Вызовы Keitaro API', ['method', 'endpoint', 'status'])
+keitaro_call_duration = Histogram('keitaro_call_duration_seconds', 'Время вызова Keitaro API (с повторами)', ['method', 'endpoint'])
+keitaro_retries = Counter('keitaro_retries_total', 'Повторы запросов к Keitaro API', ['method', 'endpoint'])
+keitaro_response_bytes = Counter('keitaro_response_bytes_total', 'Объём ответов Keitaro API', ['method', 'endpoint'])
+keitaro_cache_requests = Counter('keitaro_cache_requests_total', 'Обращения к кэшу ответов Keitaro', ['result'])
+keitaro_coalesced_requests = Counter(
+    'keitaro_coalesced_requests_total', 'GET запросы к Keitaro: выполненные, объединённые и из микро-кэша', ['result'])
+sync_duration = Histogram('sync_job_duration_seconds', 'Длительность синхронизации с Keitaro', ['job'])
+sync_rows = Counter('sync_job_rows_total', 'Строки, обработанные синхронизацией', ['job'])
+sync_failures = Counter('sync_job_failures_total', 'Ошибки синхронизации', ['job'])
+process_memory = Gauge('process_resident_memory_bytes', 'Резидентная память воркера', [])
+db_pool_connections = Gauge('db_pool_connections', 'Соединения пула БД воркера: открытые и свободные', ['alias', 'state'])
+db_pool_max_connections = Gauge('db_pool_max_connections', 'Максимальный размер пула БД воркера', ['alias'])
+db_pool_waiting = Gauge('db_pool_waiting_requests', 'Запросы, ожидающие соединение из пула БД', ['alias'])
+db_pool_requests = Counter('db_pool_requests_total', 'Выдачи соединений из пула БД', ['alias'])
+db_pool_wait = Counter('db_pool_wait_seconds_total', 'Суммарное ожидание соединения из пула БД', ['alias'])
+db_pool_errors = Counter(
+    'db_pool_errors_total', 'Ошибки пула БД: таймаут ожидания, ошибка подключения, потерянные и испорченные соединения',
+    ['alias', 'kind'])
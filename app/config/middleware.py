@@ -0,0 +1,149 @@
+"""
+Middleware инструментирования запросов (работают и под WSGI, и под ASGI)
+"""
+import logging
+import time
+from contextlib import ExitStack
+from typing import Optional
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def get_query_budget(view_name: Optional[str]) -> Optional[int]:
+    """
+    Бюджет SQL запросов для view
+
+    Args:
+        view_name: Имя URL вместе с namespace ('campaigns:campaign_detail')
+
+    Returns:
+        Максимальное количество запросов или None, если бюджет не задан
+    """
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    if view_name in budgets:
+        return budgets[view_name]
+    return getattr(settings, 'QUERY_BUDGET_DEFAULT', None)
+
+
+class QueryCounter:
+    """Обёртка execute_wrapper: считает SQL запросы и суммарное время в БД"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def install(self, stack: ExitStack):
+        """Подключение ко всем соединениям текущего потока до закрытия stack"""
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+class QueryBudgetMiddleware:
+    """
+    Подсчёт SQL запросов и времени БД на запрос
+
+    Добавляет заголовки X-DB-Query-Count и X-DB-Time-Ms и пишет в лог запросы,
+    превысившие бюджет из settings.QUERY_BUDGETS (по имени URL) или QUERY_BUDGET_DEFAULT.
+    Запросы, выполненные при отдаче StreamingHttpResponse, не учитываются.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        counter = QueryCounter()
+        with ExitStack() as stack:
+            counter.install(stack)
+            response = self.get_response(request)
+        return self._report(request, response, counter)
+
+    async def __acall__(self, request):
+        # Async ORM выполняет запросы в отдельном потоке (sync_to_async), а соединения
+        # у каждого потока свои - поэтому обёртка ставится и снимается в том же потоке
+        counter = QueryCounter()
+        stack = ExitStack()
+        await sync_to_async(counter.install)(stack)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self._report(request, response, counter)
+
+    def _report(self, request, response, counter: QueryCounter):
+        request.db_query_counter = counter
+
+        if getattr(settings, 'DIAGNOSTIC_HEADERS', True):
+            response['X-DB-Query-Count'] = str(counter.count)
+            response['X-DB-Time-Ms'] = f'{counter.duration * 1000:.1f}'
+
+        view_name = request.resolver_match.view_name if request.resolver_match else None
+        budget = get_query_budget(view_name)
+        if budget is not None and counter.count > budget:
+            logger.warning(
+                'Превышен бюджет SQL запросов: %s %s (%s) - %d запросов при бюджете %d, %.1f мс в БД',
+                request.method, request.path, view_name or '-', counter.count, budget, counter.duration * 1000,
+            )
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Метрики HTTP запросов: количество и время по имени URL, SQL запросы, память воркера, пул БД
+
+    Должен стоять выше QueryBudgetMiddleware: берёт из запроса его счётчик SQL запросов.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self._record(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self._record(request, response, time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def _record(request, response, duration: float):
+        view = request.resolver_match.view_name if request.resolver_match else 'unmatched'
+        metrics.http_requests.inc(view=view, method=request.method, status=response.status_code)
+        metrics.http_request_duration.observe(duration, view=view)
+        counter = getattr(request, 'db_query_counter', None)
+        if counter is not None:
+            metrics.db_queries.inc(counter.count, view=view)
+            metrics.db_query_duration.inc(counter.duration, view=view)
+            metrics.db_queries_per_request.observe(counter.count, view=view)
+        metrics.process_memory.set(metrics.process_memory_bytes())
+        metrics.update_db_pool_metrics()
+        metrics.registry.flush()
@@ -0,0 +1,71 @@
+"""
+ID запроса: сквозной идентификатор для логов и вызовов Keitaro
+"""
+import logging
+import re
+import uuid
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+# Принимаем ID от прокси (X-Request-ID), только если он безопасен для логов и заголовков
+_VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+request_id_var: ContextVar[str] = ContextVar('request_id', default='-')
+
+
+def get_request_id() -> str:
+    """ID текущего запроса ('-' вне HTTP запроса, например в management командах)"""
+    return request_id_var.get()
+
+
+class RequestIDMiddleware:
+    """
+    Присваивает запросу ID и возвращает его в заголовке X-Request-ID
+
+    ID берётся из входящего X-Request-ID (если задан прокси) или генерируется.
+    Хранится в contextvar, поэтому доступен в логах и сервисах без передачи request.
+    Как и остальные middleware проекта, работает и в синхронном (WSGI), и в
+    асинхронном (ASGI) режиме, чтобы async views не переводились обратно в поток.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def _assign(request):
+        incoming = request.headers.get('X-Request-ID', '')
+        request.request_id = incoming if _VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex
+        return request_id_var.set(request.request_id)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self._assign(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_id_var.reset(token)
+        response['X-Request-ID'] = request.request_id
+        return response
+
+    async def __acall__(self, request):
+        token = self._assign(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_id_var.reset(token)
+        response['X-Request-ID'] = request.request_id
+        return response
+
+
+class RequestIDFilter(logging.Filter):
+    """Добавляет request_id в записи лога (для форматтера)"""
+
+    def filter(self, record):
+        record.request_id = get_request_id()
+        return True
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import copy
 from pathlib import Path
 import os
 from dotenv import load_dotenv
@@ -49,13 +50,19 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'config.request_id.RequestIDMiddleware',  # ID запроса для логов и трассировки Keitaro
+    'config.middleware.MetricsMiddleware',  # Метрики запросов для /metrics
+    'config.middleware.QueryBudgetMiddleware',  # Подсчёт SQL запросов и бюджеты по URL
+    'campaigns.middleware.KeitaroTracingMiddleware',  # Вызовы Keitaro в рамках запроса
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'config.db_router.ReplicaStickinessMiddleware',  # Чтение с реплики БД и read-your-writes по сессии
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'users.middleware.AuthMiddleware',  # Наш кастомный middleware
+    'campaigns.middleware.ProfilingMiddleware',  # Профилирование запроса по X-Profile (staff)
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -94,6 +101,21 @@ if os.getenv('POSTGRES_HOST'):
             'PORT': os.getenv('POSTGRES_PORT', '5432'),
         }
     }
+    # Пул соединений psycopg (в каждом воркере свой): соединения переиспользуются между
+    # запросами и потоками, в том числе под ASGI. Воркеры × DB_POOL_MAX_SIZE не должны
+    # превышать max_connections Postgres
+    if os.getenv('DB_POOL', 'True') == 'True':
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {
+                'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+                'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+                # Ожидание свободного соединения, секунды (затем ошибка запроса)
+                'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+                # Закрытие простаивающих соединений сверх min_size и пересоздание старых, секунды
+                'max_idle': float(os.getenv('DB_POOL_MAX_IDLE', '300')),
+                'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', '1800')),
+            },
+        }
 else:
     DATABASES = {
         'default': {
@@ -102,6 +124,30 @@ else:
         }
     }
 
+# Реплика для чтения (необязательно): Postgres - DB_REPLICA_HOST (остальные параметры как у
+# основной БД), SQLite - DB_REPLICA_NAME (путь к файлу, например копия db.sqlite3 для проверки)
+if os.getenv('DB_REPLICA_HOST') or os.getenv('DB_REPLICA_NAME'):
+    DATABASES['replica'] = copy.deepcopy(DATABASES['default'])
+    if os.getenv('DB_REPLICA_HOST'):
+        DATABASES['replica']['HOST'] = os.getenv('DB_REPLICA_HOST')
+        DATABASES['replica']['PORT'] = os.getenv('DB_REPLICA_PORT') or DATABASES['default'].get('PORT', '')
+    if os.getenv('DB_REPLICA_NAME'):
+        DATABASES['replica']['NAME'] = os.getenv('DB_REPLICA_NAME')
+    # В тестах реплика - та же тестовая БД
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+    DATABASE_ROUTERS = ['config.db_router.ReplicaRouter']
+
+# После записи чтение сессии столько секунд идёт из основной БД (задержка репликации)
+DB_REPLICA_STICKY_SECONDS = float(os.getenv('DB_REPLICA_STICKY_SECONDS', '5'))
+
+# Постоянные соединения с БД: время жизни в секундах (0 - закрывать после каждого запроса),
+# перед повторным использованием соединение проверяется (с пулом - при выдаче из пула).
+# Под ASGI gunicorn.py ставит 0; с пулом соединения возвращаются в пул после запроса
+for database in DATABASES.values():
+    pooled = bool(database.get('OPTIONS', {}).get('pool'))
+    database['CONN_MAX_AGE'] = 0 if pooled else int(os.getenv('DB_CONN_MAX_AGE') or '60')
+    database['CONN_HEALTH_CHECKS'] = True
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -141,6 +187,10 @@ STATIC_URL = 'static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# Раздача статики приложением (config/asgi.py, config/wsgi.py): по умолчанию только при DEBUG,
+# в production статику раздаёт прокси (nginx); пустое значение - как DEBUG
+SERVE_STATIC = (os.getenv('SERVE_STATIC') or str(DEBUG)) == 'True'
+
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
@@ -152,6 +202,140 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Keitaro API settings
 KEITARO_URL = os.getenv('KEITARO_URL', '')
 
+# Таймауты запросов к Keitaro по классам endpoint: (подключение, чтение) в секундах
+KEITARO_CONNECT_TIMEOUT = float(os.getenv('KEITARO_CONNECT_TIMEOUT', '3'))
+KEITARO_TIMEOUTS = {
+    'default': (KEITARO_CONNECT_TIMEOUT, float(os.getenv('KEITARO_READ_TIMEOUT', '10'))),
+    'catalog': (KEITARO_CONNECT_TIMEOUT, float(os.getenv('KEITARO_CATALOG_READ_TIMEOUT', '30'))),
+    'report': (KEITARO_CONNECT_TIMEOUT, float(os.getenv('KEITARO_REPORT_READ_TIMEOUT', '30'))),
+}
+
+# Повторы идемпотентных запросов (GET) с экспоненциальной задержкой
+KEITARO_MAX_RETRIES = int(os.getenv('KEITARO_MAX_RETRIES', '2'))
+KEITARO_RETRY_BACKOFF = float(os.getenv('KEITARO_RETRY_BACKOFF', '0.5'))
+KEITARO_RETRY_BACKOFF_MAX = float(os.getenv('KEITARO_RETRY_BACKOFF_MAX', '4'))
+
+# Circuit breaker: открывается при доле ошибок выше порога в скользящем окне
+KEITARO_BREAKER_ERROR_RATE = float(os.getenv('KEITARO_BREAKER_ERROR_RATE', '0.5'))
+KEITARO_BREAKER_MIN_CALLS = int(os.getenv('KEITARO_BREAKER_MIN_CALLS', '10'))
+KEITARO_BREAKER_WINDOW = float(os.getenv('KEITARO_BREAKER_WINDOW', '30'))
+KEITARO_BREAKER_COOLDOWN = float(os.getenv('KEITARO_BREAKER_COOLDOWN', '30'))
+
+# Клиентский rate limit по классам endpoint: (запросов в секунду, всплеск); 0 отключает лимит.
+# Состояние хранится в файлах KEITARO_RATE_LIMIT_DIR и общее для всех воркеров на машине
+KEITARO_RATE_LIMITS = {
+    'default': (float(os.getenv('KEITARO_RATE_LIMIT', '10')), float(os.getenv('KEITARO_RATE_LIMIT_BURST', '20'))),
+    'catalog': (float(os.getenv('KEITARO_CATALOG_RATE_LIMIT', '2')), float(os.getenv('KEITARO_CATALOG_RATE_LIMIT_BURST', '4'))),
+    'report': (float(os.getenv('KEITARO_REPORT_RATE_LIMIT', '0.5')), float(os.getenv('KEITARO_REPORT_RATE_LIMIT_BURST', '2'))),
+}
+KEITARO_RATE_LIMIT_DIR = os.getenv('KEITARO_RATE_LIMIT_DIR', '')
+KEITARO_RATE_LIMIT_MAX_WAIT = float(os.getenv('KEITARO_RATE_LIMIT_MAX_WAIT', '10'))
+
+# Объединение одинаковых параллельных GET запросов и микро-кэш их результатов (секунды, 0 - отключён)
+KEITARO_SINGLEFLIGHT = os.getenv('KEITARO_SINGLEFLIGHT', 'True') == 'True'
+KEITARO_MICROCACHE_TTL = float(os.getenv('KEITARO_MICROCACHE_TTL', '0'))
+
+# Кэш ответов Keitaro: бэкенд (LRUResponseCache в памяти процесса или DjangoResponseCache
+# поверх CACHES), лимит памяти и TTL по шаблонам endpoint (секунды, отсутствие - не кэшировать).
+# LRUResponseCache свой у каждого воркера gunicorn: запись сбрасывает кэш только в воркере,
+# который её выполнил, остальные отдают прежние ответы до истечения TTL. При нескольких
+# воркерах для немедленной инвалидации нужен DjangoResponseCache с общим бэкендом в CACHES
+KEITARO_RESPONSE_CACHE = {
+    'BACKEND': os.getenv('KEITARO_CACHE_BACKEND', 'campaigns.services.cache.LRUResponseCache'),
+    'OPTIONS': {
+        'max_bytes': int(os.getenv('KEITARO_CACHE_MAX_BYTES', str(32 * 1024 * 1024))),
+    },
+}
+KEITARO_CACHE_TTLS = {
+    'campaigns': int(os.getenv('KEITARO_CACHE_TTL_CAMPAIGNS', '60')),
+    'campaigns/{id}': int(os.getenv('KEITARO_CACHE_TTL_CAMPAIGNS', '60')),
+    'campaigns/{id}/streams': int(os.getenv('KEITARO_CACHE_TTL_STREAMS', '10')),
+    'streams/{id}': int(os.getenv('KEITARO_CACHE_TTL_STREAMS', '10')),
+    'offers': int(os.getenv('KEITARO_CACHE_TTL_OFFERS', '300')),
+    'offers/{id}': int(os.getenv('KEITARO_CACHE_TTL_OFFERS', '300')),
+    'report/build': int(os.getenv('KEITARO_CACHE_TTL_REPORT', '60')),
+}
+
+# Трассировка вызовов Keitaro: вызовы дольше порога (мс) пишутся в лог как медленные (0 - не писать)
+KEITARO_SLOW_CALL_MS = float(os.getenv('KEITARO_SLOW_CALL_MS', '1000'))
+
+# Потоковый разбор больших списков Keitaro: размер фрагмента загрузки (байты) и пачки bulk сохранения
+KEITARO_STREAM_CHUNK_BYTES = int(os.getenv('KEITARO_STREAM_CHUNK_BYTES', str(64 * 1024)))
+KEITARO_SYNC_CHUNK_SIZE = int(os.getenv('KEITARO_SYNC_CHUNK_SIZE', '500'))
+
+# Неизвестные офферы (создание кампании, синхронизация потоков) загружаются по одному через
+# get_offer, а не полной синхронизацией каталога: запросов одновременно
+KEITARO_OFFER_FETCH_CONCURRENCY = int(os.getenv('KEITARO_OFFER_FETCH_CONCURRENCY', '4'))
+
+# Выгрузка (campaigns:export, manage.py export): строк в пачке курсора БД и в одном фрагменте ответа
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '2000'))
+
+# Массовое создание кампаний из CSV (campaigns:bulk_create_campaigns, manage.py bulk_create_campaigns):
+# кампаний, создаваемых в Keitaro одновременно, повторов вызова при ошибке подключения и строк в файле
+BULK_CREATE_CONCURRENCY = int(os.getenv('BULK_CREATE_CONCURRENCY', '4'))
+BULK_CREATE_RETRIES = int(os.getenv('BULK_CREATE_RETRIES', '2'))
+BULK_CREATE_MAX_ROWS = int(os.getenv('BULK_CREATE_MAX_ROWS', '500'))
+
+# Проверка расхождений с Keitaro (campaigns:check_sync): потоков кампании, сравниваемых одновременно
+CHECK_SYNC_CONCURRENCY = int(os.getenv('CHECK_SYNC_CONCURRENCY', '5'))
+
+# Клонирование кампании (campaigns:clone_campaign): потоков копии, создаваемых в Keitaro одновременно
+CLONE_STREAM_CONCURRENCY = int(os.getenv('CLONE_STREAM_CONCURRENCY', '4'))
+
+# Архивация (manage.py archive): удалённые кампании и отключённые офферы потоков старше
+# срока хранения (дни) переносятся из рабочих таблиц в сжатый архив
+ARCHIVE_RETENTION_DAYS = int(os.getenv('ARCHIVE_RETENTION_DAYS', '90'))
+
+# Бюджеты SQL запросов на HTTP запрос по имени URL; превышение пишется в лог (config.middleware).
+# Синхронизация потоков пишет пакетно, поэтому её бюджет не зависит от числа потоков и офферов
+# QUERY_BUDGET_DEFAULT применяется к URL без своего бюджета (0 - не проверять)
+QUERY_BUDGET_DEFAULT = int(os.getenv('QUERY_BUDGET_DEFAULT', '50')) or None
+QUERY_BUDGETS = {
+    'campaigns:campaign_list': 8,
+    'campaigns:campaign_detail': 8,
+    'campaigns:campaign_detail_api': 5,
+    'campaigns:offer_autocomplete': 4,
+    'campaigns:add_offer': 30,
+    'campaigns:remove_offer': 30,
+    'campaigns:restore_offer': 30,
+    'campaigns:toggle_pin': 30,
+    'campaigns:fetch_streams': 25,
+    'campaigns:push_to_keitaro': 10,
+}
+# Диагностические заголовки в ответах: X-DB-Query-Count, X-DB-Time-Ms, X-Keitaro-Calls, X-Keitaro-Time-Ms
+DIAGNOSTIC_HEADERS = os.getenv('DIAGNOSTIC_HEADERS', 'True') == 'True'
+
+# Метрики Prometheus (/metrics): каталог файлов метрик воркеров (общий для всех воркеров
+# на машине), интервал сброса значений процесса в файл (секунды) и токен доступа (пусто - /metrics отвечает 403)
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '1'))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Профилирование запросов staff пользователями (X-Profile: 1 или ?_profile=1): каталог
+# профилей, размер кольцевого буфера и количество функций в сводке
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'True') == 'True'
+PROFILING_DIR = os.getenv('PROFILING_DIR', '')
+PROFILING_MAX_PROFILES = int(os.getenv('PROFILING_MAX_PROFILES', '50'))
+PROFILING_TOP_FUNCTIONS = int(os.getenv('PROFILING_TOP_FUNCTIONS', '25'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '{asctime} {levelname} [{request_id}] {name}: {message}', 'style': '{'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'simple', 'filters': ['request_id']},
+    },
+    'filters': {
+        'request_id': {'()': 'config.request_id.RequestIDFilter'},
+    },
+    'loggers': {
+        'config': {'handlers': ['console'], 'level': os.getenv('LOG_LEVEL', 'INFO'), 'propagate': False},
+        'campaigns': {'handlers': ['console'], 'level': os.getenv('LOG_LEVEL', 'INFO'), 'propagate': False},
+    },
+}
+
 # Share calculation settings
 MIN_SHARE_PERCENT = int(os.getenv('MIN_SHARE_PERCENT', '1'))  # Минимальный процент share для незакреплённых офферов
 
@@ -0,0 +1,40 @@
+"""
+Помощники для тестов
+"""
+from contextlib import contextmanager
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from .middleware import get_query_budget
+
+
+class QueryBudgetTestMixin:
+    """
+    Проверка бюджета SQL запросов view в тестах
+
+    Пример:
+        with self.assertQueryBudget('campaigns:campaign_detail'):
+            self.client.get(url)
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, view_name: str = None, budget: int = None, using: str = 'default'):
+        """
+        Тест падает, если блок выполнил больше запросов, чем разрешено бюджетом
+
+        Args:
+            view_name: Имя URL, бюджет которого берётся из settings.QUERY_BUDGETS
+            budget: Явный бюджет (вместо бюджета из настроек)
+            using: Алиас БД
+        """
+        if budget is None:
+            budget = get_query_budget(view_name)
+        if budget is None:
+            self.fail(f'Для {view_name} не задан бюджет SQL запросов (QUERY_BUDGETS)')
+
+        with CaptureQueriesContext(connections[using]) as context:
+            yield context
+
+        executed = len(context)
+        if executed > budget:
+            queries = '\n'.join(f'{i}. {query["sql"]}' for i, query in enumerate(context.captured_queries, start=1))
+            self.fail(f'{view_name or "Блок"}: {executed} SQL запросов при бюджете {budget}\n{queries}')
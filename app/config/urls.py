@@ -17,6 +17,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.shortcuts import redirect
+from .views import metrics_view
 
 # Обработчики ошибок должны быть определены в корневом urls.py
 handler404 = 'config.views.handler404'
@@ -27,5 +28,6 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('users/', include('users.urls')),
     path('campaigns/', include('campaigns.urls')),
+    path('metrics', metrics_view, name='metrics'),
     path('', lambda request: redirect('campaigns:campaign_list')),
 ]
@@ -1,7 +1,11 @@
 """
 Обработчики ошибок для кастомных страниц
 """
+import hmac
+from django.conf import settings
+from django.http import HttpResponse
 from django.shortcuts import render
+from . import metrics
 
 
 def handler404(request, exception):
@@ -18,3 +22,18 @@ def handler403(request, exception):
     """Обработчик 403 ошибки"""
     return render(request, '403.html', status=403)
 
+
+def metrics_view(request):
+    """
+    Метрики в текстовом формате Prometheus
+
+    Endpoint открыт без авторизации приложения, поэтому требуется заголовок
+    "Authorization: Bearer <METRICS_TOKEN>"; без заданного METRICS_TOKEN доступ запрещён.
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if not token:
+        return HttpResponse('Forbidden: METRICS_TOKEN is not set', status=403, content_type='text/plain')
+    provided = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(provided.encode(), token.encode()):
+        return HttpResponse('Unauthorized', status=401, content_type='text/plain')
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -21,9 +21,10 @@ $(document).ready(function() {
             url: `/campaigns/flow/${flowId}/add-offer/`,
             method: 'POST',
             headers: {'X-CSRFToken': window.csrfToken},
-            data: {offer_id: offerId},
+            data: {offer_id: offerId, version: getFlowVersion(flowId)},
             success: function(data) {
                 if (data.success) {
+                    setFlowVersion(flowId, data.version);
                     markFlowAsEdited(flowId);
                     showToast('Оффер добавлен', 'success');
                     // Очищаем поле ввода
@@ -81,6 +82,7 @@ $(document).ready(function() {
                 }
             },
             error: function(xhr) {
+                if (handleFlowConflict(xhr)) return;
                 const error = xhr.responseJSON?.error || 'Неизвестная ошибка';
                 showToast(error, 'error');
                 btn.prop('disabled', false).text('Добавить');
@@ -102,8 +104,10 @@ $(document).ready(function() {
             url: `/campaigns/flow-offer/${flowOfferId}/remove/`,
             method: 'POST',
             headers: {'X-CSRFToken': window.csrfToken},
+            data: {version: getFlowVersion(flowId)},
             success: function(data) {
                 if (data.success) {
+                    setFlowVersion(flowId, data.version);
                     markFlowAsEdited(flowId);
                     showToast('Оффер помечен для удаления', 'success');
                     // Делаем название серым
@@ -136,6 +140,7 @@ $(document).ready(function() {
                 }
             },
             error: function(xhr) {
+                if (handleFlowConflict(xhr)) return;
                 const error = xhr.responseJSON?.error || 'Неизвестная ошибка';
                 showToast(error, 'error');
             }
@@ -152,8 +157,10 @@ $(document).ready(function() {
             url: `/campaigns/flow-offer/${flowOfferId}/restore/`,
             method: 'POST',
             headers: {'X-CSRFToken': window.csrfToken},
+            data: {version: getFlowVersion(flowId)},
             success: function(data) {
                 if (data.success) {
+                    setFlowVersion(flowId, data.version);
                     markFlowAsEdited(flowId);
                     showToast('Оффер восстановлен', 'success');
                     // Возвращаем нормальный цвет названия
@@ -180,6 +187,7 @@ $(document).ready(function() {
                 }
             },
             error: function(xhr) {
+                if (handleFlowConflict(xhr)) return;
                 const error = xhr.responseJSON?.error || 'Неизвестная ошибка';
                 showToast(error, 'error');
             }
@@ -215,8 +223,10 @@ $(document).ready(function() {
             url: `/campaigns/flow-offer/${flowOfferId}/toggle-pin/`,
             method: 'POST',
             headers: {'X-CSRFToken': window.csrfToken},
+            data: {version: getFlowVersion(flowId)},
             success: function(data) {
                 if (data.success) {
+                    setFlowVersion(flowId, data.version);
                     // Обновляем состояние булавки на основе ответа сервера
                     const pinned = data.is_pinned !== undefined ? data.is_pinned : newPinned;
                     pinBtn.data('pinned', pinned);
@@ -250,6 +260,7 @@ $(document).ready(function() {
                 }
             },
             error: function(xhr) {
+                if (handleFlowConflict(xhr)) return;
                 // Откатываем визуальное состояние при ошибке
                 pinBtn.data('pinned', isPinned);
                 pinBtn.removeClass('text-gray-400 text-blue-600');
@@ -36,7 +36,9 @@ $(document).ready(function() {
             url: `/campaigns/${window.campaignId}/check-sync/`,
             method: 'GET',
             success: function(data) {
-                if (data.success && data.has_differences) {
+                if (data.success && data.keitaro_unavailable) {
+                    showToast('Keitaro временно недоступен, показаны локальные данные', 'warning');
+                } else if (data.success && data.has_differences) {
                     $('#sync-warning').removeClass('hidden');
                 }
             }
@@ -32,3 +32,29 @@ function markFlowAsEdited(flowId) {
     flowContainer.addClass('edited-flow');
     flowContainer.find('.flow-actions').show();
 }
+
+/**
+ * Версия потока, которую видит страница (передаётся с каждым изменением офферов)
+ */
+function getFlowVersion(flowId) {
+    return $(`.flow-container[data-flow-id="${flowId}"]`).attr('data-flow-version');
+}
+
+/**
+ * Запомнить версию потока из ответа сервера
+ */
+function setFlowVersion(flowId, version) {
+    if (version !== undefined) {
+        $(`.flow-container[data-flow-id="${flowId}"]`).attr('data-flow-version', version);
+    }
+}
+
+/**
+ * Конфликт версий (409): поток изменён другим пользователем, перезагружаем актуальное состояние
+ */
+function handleFlowConflict(xhr) {
+    if (xhr.status !== 409) return false;
+    showToast(xhr.responseJSON?.error || 'Поток изменён другим пользователем', 'warning');
+    setTimeout(() => location.reload(), 1500);
+    return true;
+}
@@ -1,3 +1,4 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.shortcuts import redirect
 from django.urls import reverse
 from .models import User
@@ -15,19 +16,50 @@ class AuthMiddleware:
         '/admin/',  # Django admin имеет свою аутентификацию
     ]
     
+    # URL без аутентификации, совпадающие точно (не префиксы)
+    ALLOWED_EXACT_PATHS = {
+        '/metrics',  # Prometheus (защищается METRICS_TOKEN)
+    }
+    
+    sync_capable = True
+    async_capable = True
+    
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
     
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self._authenticate(request)
+        if response is not None:
+            return response
+        return self.get_response(request)
+    
+    async def __acall__(self, request):
+        # Сессия и пользователь читаются из БД - в потоке, не блокируя event loop
+        response = await sync_to_async(self._authenticate)(request)
+        if response is not None:
+            return response
+        return await self.get_response(request)
+    
+    def _authenticate(self, request):
+        """
+        Проверка сессии и установка request.user
+        
+        Returns:
+            Редирект на login или None, если запрос можно обрабатывать дальше
+        """
         # Проверяем, нужна ли аутентификация для этого URL
         path = request.path
         
         # Пропускаем allowed paths и static/media
-        if any(path.startswith(allowed) for allowed in self.ALLOWED_PATHS):
-            return self.get_response(request)
+        if path in self.ALLOWED_EXACT_PATHS or any(path.startswith(allowed) for allowed in self.ALLOWED_PATHS):
+            return None
         
         if path.startswith('/static/') or path.startswith('/media/'):
-            return self.get_response(request)
+            return None
         
         # Проверяем наличие user_id в session
         user_id = request.session.get('user_id')
@@ -54,6 +86,4 @@ class AuthMiddleware:
             request.session.flush()
             return redirect('users:login')
         
-        response = self.get_response(request)
-        return response
-
+        return None